@@ -33,12 +33,16 @@ install -m 1770 -d %buildroot/%_var/spool/jurt/builds/spools/
 install -m 1770 -d %buildroot/%_var/spool/jurt/builds/logs/
 install -m 1770 -d %buildroot/%_var/spool/jurt/builds/fail/
 install -m 1770 -d %buildroot/%_var/spool/jurt/builds/success/
+install -m 2770 -d %buildroot/%_var/spool/jurt/builds/history/
+install -m 2770 -d %buildroot/%_var/spool/jurt/artifacts/
 install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/
 install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/temp/
 install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/active/
 install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/old/
 install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/keep/
+install -m 1770 -d %buildroot/%_var/spool/jurt/chroots/trash/
 install -m 0770 -d %buildroot/%_var/spool/jurt/chroots/cached
+install -m 2770 -d %buildroot/%_var/spool/jurt/chroots/index/
 
 %clean
 %__rm -rf %buildroot
@@ -68,10 +72,14 @@ install -m 0770 -d %buildroot/%_var/spool/jurt/chroots/cached
 %attr(1770,root,jurt) %dir %_var/spool/jurt/builds/logs/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/builds/fail/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/builds/success/
+%attr(2770,root,jurt) %dir %_var/spool/jurt/builds/history/
+%attr(2770,root,jurt) %dir %_var/spool/jurt/artifacts/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/temp/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/active/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/old/
 %attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/keep/
+%attr(1770,root,jurt) %dir %_var/spool/jurt/chroots/trash/
+%attr(2770,root,jurt) %dir %_var/spool/jurt/chroots/index/
 %_var/spool/jurt/chroots/cached/
 %{_mandir}/*/*
@@ -0,0 +1,176 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Content-addressed store of built packages
+
+Every package built is stored once under the sha256 of its contents, and
+the success, spool and delivery directories only hold hardlinks to the
+stored copy. Rebuilds producing identical packages then use no extra
+space, and an object is garbage once the store holds its only link.
+"""
+import os
+import errno
+import hashlib
+import logging
+from jurtlib import Error, util
+
+logger = logging.getLogger("jurt.artifacts")
+
+CHUNK_SIZE = 1024 * 1024
+
+class ArtifactError(Error):
+    pass
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+class ArtifactStore:
+
+    def __init__(self, path):
+        self.path = path
+        self.objectsdir = os.path.join(path, "objects")
+
+    def object_path(self, digest):
+        return os.path.join(self.objectsdir, digest[:2], digest[2:])
+
+    def _link_object(self, path, objpath):
+        """Makes objpath the stored copy of path, returns False if another
+        copy was stored meanwhile"""
+        objdir = os.path.dirname(objpath)
+        if not os.path.isdir(objdir):
+            try:
+                os.makedirs(objdir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        try:
+            os.link(path, objpath)
+        except OSError, e:
+            if e.errno == errno.EEXIST:
+                return False
+            raise
+        return True
+
+    def _replace_with_link(self, objpath, path):
+        tmppath = "%s.%d.tmp" % (path, os.getpid())
+        os.link(objpath, tmppath)
+        try:
+            os.rename(tmppath, path)
+        except OSError:
+            os.unlink(tmppath)
+            raise
+
+    def store(self, path):
+        """Stores path, replacing it with a link to the stored copy when
+        there is one already
+
+        Returns the digest of path and the number of bytes saved by the
+        deduplication.
+        """
+        try:
+            digest = file_digest(path)
+        except EnvironmentError, e:
+            raise ArtifactError, "failed to store %s: %s" % (path, e)
+        try:
+            objpath = self.object_path(digest)
+            if not os.path.exists(objpath) and self._link_object(path,
+                    objpath):
+                logger.debug("stored %s as %s", path, digest)
+                return digest, 0
+            st = os.stat(path)
+            if os.path.samefile(path, objpath):
+                return digest, 0
+            self._replace_with_link(objpath, path)
+        except EnvironmentError, e:
+            if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                # not on the same filesystem or owned by someone else
+                logger.debug("not deduplicating %s: %s", path, e)
+                return digest, 0
+            raise ArtifactError, "failed to store %s: %s" % (path, e)
+        logger.debug("%s is a copy of the stored %s", path, digest)
+        return digest, st.st_size
+
+    def add(self, path):
+        """Stores path, returns the number of bytes saved"""
+        return self.store(path)[1]
+
+    def store_files(self, paths):
+        """Stores paths, returns their digests and the number of bytes
+        saved"""
+        digests = []
+        saved = 0
+        for path in paths:
+            digest, size = self.store(path)
+            digests.append(digest)
+            saved += size
+        if saved:
+            logger.info("%s saved by reusing identical packages",
+                    util.format_size(saved))
+        return digests, saved
+
+    def add_files(self, paths):
+        return self.store_files(paths)[1]
+
+    def _objects(self):
+        for dirpath, dirnames, filenames in os.walk(self.objectsdir):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    yield path, os.lstat(path)
+                except OSError:
+                    continue
+
+    def usage(self):
+        """Provides the number of objects, the bytes they use and the bytes
+        the links to them would use if they were copies"""
+        count = stored = linked = 0
+        for path, st in self._objects():
+            count += 1
+            stored += st.st_size
+            linked += st.st_size * max(st.st_nlink - 1, 0)
+        return count, stored, linked
+
+    def collect(self, dry_run=False):
+        """Removes the objects not linked from anywhere else, yields the
+        path and size of each one"""
+        for path, st in self._objects():
+            if st.st_nlink > 1:
+                continue
+            if not dry_run:
+                try:
+                    os.unlink(path)
+                except OSError, e:
+                    logger.warn("failed to remove %s: %s", path, e)
+                    continue
+            yield path, st.st_size
+
+def get_artifact_store(path):
+    if not path:
+        return None
+    return ArtifactStore(os.path.expanduser(path))
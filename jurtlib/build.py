@@ -23,13 +23,17 @@ import sys
 import os
 import time
 import logging
-import subprocess
 import shlex
-import shutil
-from jurtlib import CommandError, Error, util
+import threading
+from jurtlib import Error, util, fileops, root as rootmod
+from jurtlib.history import BuildStats, get_build_history, package_name
+from jurtlib.artifacts import ArtifactError, get_artifact_store, file_digest
+from jurtlib.buildcache import BuildCacheError, get_build_cache, cache_key
+from jurtlib import schedule, compress
 from jurtlib.registry import Registry
 from jurtlib.configutil import parse_bool
-from jurtlib.spool import Spool
+from jurtlib.spool import Spool, collect_spools
+from jurtlib.space import SpaceWatcher, existing_parent
 from jurtlib.su import my_username
 
 logger = logging.getLogger("jurt.build")
@@ -37,14 +41,18 @@ logger = logging.getLogger("jurt.build")
 class BuildError(Error):
     pass
 
+BUILD_ORDERS = ("command-line", "longest-first")
+
 class BuildResult:
 
-    def __init__(self, id, sourceid, package, success, builtpaths):
+    def __init__(self, id, sourceid, package, success, builtpaths,
+            stats=None):
         self.id = id
         self.sourceid = sourceid
         self.package = package
         self.success = success
         self.builtpaths = builtpaths
+        self.stats = stats
 
 def create_dirs(path):
     if not os.path.exists(path):
@@ -60,6 +68,13 @@ class Builder:
         self.interactive = parse_bool(buildconf.interactive)
         self.deliverydir = os.path.expanduser(buildconf.delivery_dir)
         self.logcompresscmd = shlex.split(buildconf.log_compress_command)
+        try:
+            self.compressworkers = int(buildconf.log_compress_workers)
+        except ValueError:
+            raise BuildError, ("invalid value for log-compress-workers: %r" %
+                    (buildconf.log_compress_workers))
+        if self.compressworkers <= 0:
+            self.compressworkers = compress.default_workers()
         self.spooldir = buildconf.spool_dir
         self.donedir = buildconf.success_dir
         self.faildir = buildconf.failure_dir
@@ -73,6 +88,59 @@ class Builder:
         self.packagesdirname = buildconf.packages_dir_name
         self.latestname = buildconf.latest_home_link_name
         self.statusfilename = buildconf.build_status_file
+        self.reuseroot = parse_bool(buildconf.reuse_root)
+        self.targetname = buildconf.target_name
+        self.history = get_build_history(buildconf.build_history_file)
+        self.artifacts = get_artifact_store(
+                buildconf.artifact_store_dir.strip())
+        try:
+            cachettl = float(buildconf.build_cache_ttl) * 60 * 60
+        except ValueError:
+            raise BuildError, ("invalid value for build-cache-ttl: %r" %
+                    (buildconf.build_cache_ttl))
+        self.buildcache = get_build_cache(self.artifacts, cachettl)
+        # the configuration that affects the packages built
+        self.cacheconf = (("target", self.targetname),
+                ("repos", buildconf.repos),
+                ("macros", buildconf.rpm_build_macros),
+                ("command", buildconf.rpm_build_source_command))
+        self.buildorder = buildconf.build_order
+        if self.buildorder not in BUILD_ORDERS:
+            logger.warn("invalid value for build-order configuration "
+                    "option: %r", self.buildorder)
+            self.buildorder = "command-line"
+        self.sourceinfo = {}
+        self.rootspath = buildconf.roots_path
+        try:
+            self.minfreespace = int(buildconf.min_free_space) * 1024 * 1024
+        except ValueError:
+            raise BuildError, ("invalid value for min-free-space: %r" %
+                    (buildconf.min_free_space))
+        try:
+            self.autocleanspace = (int(buildconf.auto_clean_free_space) *
+                    1024 * 1024)
+            self.autocleaninterval = int(buildconf.auto_clean_interval)
+        except ValueError:
+            raise BuildError, ("invalid value for auto-clean-free-space or "
+                    "auto-clean-interval: %r, %r" %
+                    (buildconf.auto_clean_free_space,
+                        buildconf.auto_clean_interval))
+        try:
+            self.spoolmaxage = (float(buildconf.spool_max_age) * 24 * 60 *
+                    60)
+        except ValueError:
+            raise BuildError, ("invalid value for spool-max-age: %r" %
+                    (buildconf.spool_max_age))
+        self.spacewatcher = None
+        self.cleanmanager = None
+        self.spoolsharers = []
+        self.spoolmanagers = []
+        self.stopping = threading.Event()
+        try:
+            self.preflightworkers = max(1, int(buildconf.preflight_workers))
+        except ValueError:
+            raise BuildError, ("invalid value for preflight-workers: %r" %
+                    (buildconf.preflight_workers))
         self.logsdirname = "logs"
         self.builtdirname = "built"
         try:
@@ -126,64 +194,229 @@ class Builder:
         path = os.path.abspath(value)
         return path
 
-    def build_one(self, id, fresh, sourceid, path, logstore, spool,
-            stage=None, timeout=None, keeproot=False):
-        logger.info("working on %s", sourceid)
-        root = self._get_root(id, fresh, logstore, self.interactive)
-        root.activate()
-        try:
-            username, uid = self.build_user_info()
-            homedir = self.build_user_home(username)
-            if fresh:
-                root.add_user(username, uid)
-                self.packagemanager.setup_repositories(root, self.repos,
-                        logstore, spool)
+    def _build_in_root(self, id, root, path, logstore, spool, username,
+            uid, homedir, stats, stage=None, timeout=None):
+        with stats.phase("prepare"):
             self.packagemanager.build_prepare(root, homedir, username, uid)
             insidepath = root.copy_in(path, homedir, uid)
             srcpath = self.packagemanager.extract_source(insidepath, root,
                     username, homedir, logstore)
-            logger.info("installing build dependencies")
+        logger.info("installing build dependencies")
+        with stats.phase("builddeps"):
             self.packagemanager.install_build_deps(srcpath, root, username,
                     homedir, self.repos, logstore, spool)
             self.packagemanager.describe_root(root, username, logstore)
-            logger.info("building")
+        logger.info("building")
+        root.max_rss(reset=True)
+        with stats.phase("build"):
             (package, success, builtpaths) = \
                     self.packagemanager.build_source(srcpath, root, logstore,
                             username, homedir, spool, stage, timeout)
-            if self.interactive:
-                root.interactive_prepare(username, uid,
-                        self.packagemanager, self.repos, logstore)
-                root.interactive_shell(username)
-            if success:
-                iddir = os.path.join(self.donedir, id)
-            else:
-                iddir = os.path.join(self.faildir, id)
-            builtdest = os.path.join(iddir, self.builtdirname)
-            if not os.path.exists(builtdest):
-                logger.debug("created %s" % (builtdest))
-                os.makedirs(builtdest)
-            if builtpaths:
-                root.copy_out(builtpaths, builtdest) # FIXME set ownership
-        finally:
+        stats.maxrss = root.max_rss() or None
+        if self.history.enabled:
             try:
-                root.deactivate()
-            except:
-                sys.stderr.write("\nWARNING WARNING: something bad happened "
-                        "while unmouting root, things were possibly left "
-                        "mounted!\n")
-                raise
-        if not keeproot:
-            root.destroy(self.interactive)
-        localbuilt = []
+                stats.diskusage = root.disk_usage()
+            except Error, e:
+                logger.warn("failed to measure the disk usage of the "
+                        "root: %s", e)
+        if self.interactive:
+            root.interactive_prepare(username, uid,
+                    self.packagemanager, self.repos, logstore)
+            root.interactive_shell(username)
+        if success:
+            iddir = os.path.join(self.donedir, id)
+        else:
+            iddir = os.path.join(self.faildir, id)
+        builtdest = os.path.join(iddir, self.builtdirname)
+        if not os.path.exists(builtdest):
+            logger.debug("created %s" % (builtdest))
+            os.makedirs(builtdest)
+        if builtpaths:
+            with stats.phase("copyout"):
+                # owned by the user, so that they can be hardlinked
+                root.copy_out(builtpaths, builtdest, uid=os.getuid(),
+                        gid=os.getgid())
+        stats.finish(success)
+        return package, success, builtdest, builtpaths
+
+    def _build_result(self, id, sourceid, package, success, builtdest,
+            builtpaths, spool, stats, cachekey=None):
         localbuilt = [os.path.join(builtdest, os.path.basename(path))
                 for path in builtpaths]
+        if self.artifacts is not None:
+            try:
+                digests, _ = self.artifacts.store_files(localbuilt)
+            except ArtifactError, e:
+                logger.warn("failed to store the built packages: %s", e)
+            else:
+                if success and cachekey is not None:
+                    try:
+                        self.buildcache.record(cachekey, sourceid, id,
+                                localbuilt, digests)
+                    except (BuildCacheError, EnvironmentError), e:
+                        logger.warn("%s", e)
         if success:
             spool.put_packages(localbuilt)
-        result = BuildResult(id, sourceid, package, success, localbuilt)
-        return result
+        return BuildResult(id, sourceid, package, success, localbuilt,
+                stats)
+
+    def _cache_key(self, sourcepath, spool):
+        """Hashes the inputs of a build known before creating its root, None
+        when the build cannot be cached"""
+        if self.buildcache is None:
+            return None
+        parts = [("source", file_digest(sourcepath))]
+        parts.extend(self.cacheconf)
+        parts.append(("spool", spool.packages()))
+        return cache_key(parts)
+
+    def _cached_build(self, id, sourceid, cachekey, spool):
+        entry = self.buildcache.lookup(cachekey)
+        if entry is None:
+            return None
+        builtdest = os.path.join(self.donedir, id, self.builtdirname)
+        try:
+            builtpaths = self.buildcache.restore(entry, builtdest)
+        except BuildCacheError, e:
+            logger.warn("%s", e)
+            return None
+        logger.info("%s is unchanged since build %s, reusing its packages",
+                sourceid, entry["id"])
+        spool.put_packages(builtpaths)
+        return BuildResult(id, sourceid, None, True, builtpaths)
+
+    def _deactivate(self, root):
+        try:
+            root.deactivate()
+        except:
+            sys.stderr.write("\nWARNING WARNING: something bad happened "
+                    "while unmouting root, things were possibly left "
+                    "mounted!\n")
+            raise
+
+    def build_one(self, id, fresh, sourceid, path, logstore, spool,
+            stage=None, timeout=None, keeproot=False):
+        logger.info("working on %s", sourceid)
+        cachekey = None
+        if fresh and not stage and not self.interactive:
+            cachekey = self._cache_key(path, spool)
+            if cachekey is not None:
+                result = self._cached_build(id, sourceid, cachekey, spool)
+                if result is not None:
+                    return result
+        stats = BuildStats(sourceid)
+        with stats.phase("root"):
+            root = self._get_root(id, fresh, logstore, self.interactive)
+            root.activate()
+        try:
+            username, uid = self.build_user_info()
+            homedir = self.build_user_home(username)
+            if fresh:
+                with stats.phase("setup"):
+                    root.add_user(username, uid)
+                    self.packagemanager.setup_repositories(root, self.repos,
+                            logstore, spool)
+            package, success, builtdest, builtpaths = \
+                    self._build_in_root(id, root, path, logstore, spool,
+                            username, uid, homedir, stats, stage, timeout)
+        finally:
+            self._deactivate(root)
+        if not keeproot:
+            root.destroy(self.interactive, background=True)
+        return self._build_result(id, sourceid, package, success,
+                builtdest, builtpaths, spool, stats, cachekey)
+
+    def _new_batch_root(self, id, logstore, spool):
+        root = self._get_root(id, True, logstore, False)
+        root.activate()
+        try:
+            username, uid = self.build_user_info()
+            root.add_user(username, uid)
+            self.packagemanager.setup_repositories(root, self.repos,
+                    logstore, spool)
+            snapshot = self.packagemanager.snapshot(root, username)
+        except:
+            self._deactivate(root)
+            raise
+        return root, username, uid, snapshot, bool(spool.package_count())
+
+    def build_batch(self, id, paths, logstore, spool, timeout=None,
+            keeproot=False, keepbuilding=False):
+        """Builds all the packages using the same root
+
+        After each package the build dependencies it installed are removed,
+        and a new root is only created when that fails.
+        """
+        results = []
+        root = None
+        try:
+            for i, sourcepath in enumerate(paths):
+                self._check_stopped()
+                sourceid = self._get_source_id(sourcepath)
+                sublogstore = logstore.subpackage(sourceid)
+                logger.info("working on %s", sourceid)
+                cachekey = self._cache_key(sourcepath, spool)
+                if cachekey is not None:
+                    result = self._cached_build(id, sourceid, cachekey, spool)
+                    if result is not None:
+                        results.append(result)
+                        continue
+                stats = BuildStats(sourceid)
+                if root is None:
+                    with stats.phase("root"):
+                        root, username, uid, snapshot, hasspool = \
+                                self._new_batch_root(id, sublogstore, spool)
+                    homedir = self.build_user_home(username)
+                elif not hasspool and spool.package_count():
+                    # the spool media is only added once it has packages
+                    with stats.phase("setup"):
+                        self.packagemanager.setup_repositories(root,
+                                self.repos, sublogstore, spool)
+                    hasspool = True
+                package, success, builtdest, builtpaths = \
+                        self._build_in_root(id, root, sourcepath, sublogstore,
+                                spool, username, uid, homedir, stats,
+                                timeout=timeout)
+                results.append(self._build_result(id, sourceid, package,
+                    success, builtdest, builtpaths, spool, stats, cachekey))
+                if not success and not keepbuilding:
+                    break
+                if i == len(paths) - 1:
+                    break
+                with stats.phase("rollback"):
+                    self.packagemanager.reset_build_dirs(root, homedir,
+                            username)
+                    restored = self.packagemanager.rollback(root, username,
+                            snapshot, sublogstore)
+                if not restored:
+                    logger.info("could not restore the root to its initial "
+                            "state, a new one will be created")
+                    self._deactivate(root)
+                    root.destroy(False, background=True)
+                    root = None
+        finally:
+            if root is not None:
+                self._deactivate(root)
+        if root is not None and not keeproot:
+            root.destroy(False, background=True)
+        return results
+
+    def _source_info(self, sourcepath):
+        try:
+            info = self.sourceinfo[sourcepath]
+        except KeyError:
+            info = self.packagemanager.get_source_info(sourcepath)
+            self.sourceinfo[sourcepath] = info
+        return info
+
+    def check_sources(self, paths):
+        """Reads the source packages, failing for invalid ones, and keeps
+        their information for later"""
+        for sourcepath in paths:
+            self._source_info(sourcepath)
 
     def _get_source_id(self, sourcepath):
-        info = self.packagemanager.get_source_info(sourcepath)
+        info = self._source_info(sourcepath)
         name = info.name + "-" + info.version + "-" + info.release
         name = name.replace("/", "_")
         return name
@@ -194,20 +427,6 @@ class Builder:
         id = time.strftime(self.idtimefmt) + "-" + name
         return id
 
-    def _pipe_through(self, from_, progargs, to):
-        fromfile = open(from_)
-        tofile = open(to, "w")
-        cmdline = subprocess.list2cmdline(progargs)
-        logger.debug("piping %s through %s into %s" % (from_, cmdline, to))
-        proc = subprocess.Popen(progargs, shell=False, stdin=fromfile,
-                stdout=tofile, stderr=subprocess.PIPE)
-        proc.wait()
-        if proc.returncode != 0:
-            raise CommandError(proc.returncode, cmdline,
-                    proc.stderr.read())
-        tofile.close()
-        fromfile.close()
-
     def _write_status_file(self, results, topdir):
         statuspath = os.path.join(topdir, self.statusfilename)
         if all(result.success for result in results):
@@ -230,33 +449,37 @@ class Builder:
         id, subidpaths = logstore.logs()
         # copying and compressing log files
         self._write_status_file(buildresults, topdir)
+        pairs = []
         for subid, path in subidpaths:
             subtop = os.path.join(topdir, subid, self.logsdirname)
             create_dirs(subtop)
             logname = os.path.basename(path) + self.deliverylogext
-            destpath = os.path.join(subtop, logname)
-            self._pipe_through(path, self.logcompresscmd, destpath)
+            pairs.append((path, os.path.join(subtop, logname)))
+        compress.compress_files(pairs, self.logcompresscmd,
+                self.compressworkers)
         # copying (or hardlinking) the built packages
         for result in buildresults:
+            start = time.time()
             sourcetopdir = os.path.join(topdir, result.sourceid)
+            # cached builds have no logs that would have created it
+            create_dirs(sourcetopdir)
             self._write_status_file((result,), sourcetopdir)
             for path in result.builtpaths:
                 pkgdestdir = os.path.join(sourcetopdir, self.packagesdirname)
                 create_dirs(pkgdestdir)
                 destpath = os.path.join(pkgdestdir, os.path.basename(path))
-                if util.same_partition(pkgdestdir, path):
-                    logger.debug("creating hardlink from %s to %s" % (path,
-                        destpath))
-                    os.link(path, destpath)
-                else:
-                    logger.debug("copying %s to %s" % (path, destpath))
-                    shutil.copy(path, destpath)
+                fileops.copy_file(path, destpath)
+            if result.stats is not None:
+                result.stats.add_phase("deliver", time.time() - start)
+                self.history.record(self.targetname, id, result.stats)
         # creating a symlink pointing to the most recently delivered build
         util.replace_link(latestpath, id)
         logger.info("done, see %s" % (topdir))
 
     def _get_root(self, id, fresh, logstore, interactive):
         if fresh:
+            if self.spacewatcher is not None:
+                self.spacewatcher.check()
             logger.info("creating root %s", id)
             root = self.rootmanager.create_new(id, self.packagemanager,
                     self.repos, logstore, interactive=interactive)
@@ -266,24 +489,189 @@ class Builder:
                     self.packagemanager, interactive=interactive)
         return root
 
+    def collect_spools(self, inuse, dry_run=False):
+        """Removes the spools older than spool-max-age not used by any of
+        the roots named in inuse"""
+        if not os.path.isdir(self.spooldir):
+            return []
+        return collect_spools(self.spooldir, self.spoolmaxage, inuse,
+                self.rootmanager.clean_workers(), dry_run)
+
+    def _clean_roots(self, targetfree):
+        for name, timestamp in self.cleanmanager.clean(targetfree=targetfree):
+            logger.info("removed old root %s", name)
+
+    def share_spools(self, rootmanagers):
+        """Sets the root managers of the other targets using the spool
+        directory, their roots keep spools from being collected too"""
+        self.spoolsharers = rootmanagers
+
+    def _clean_spools(self, targetfree):
+        inuse = rootmod.ids_in_use(self.spoolmanagers)
+        for name, mtime, size, inodes in self.collect_spools(inuse):
+            logger.info("removed stale spool %s", name)
+
+    def _watch_space(self):
+        """Starts cleaning up in background when space is running out"""
+        if not self.autocleanspace:
+            return
+        # the agent of the root manager is busy with the build
+        self.cleanmanager = self.rootmanager.sibling()
+        self.spoolmanagers = [self.cleanmanager] + [rootmanager.sibling()
+                for rootmanager in self.spoolsharers]
+        self.spacewatcher = SpaceWatcher((self.rootspath, self.spooldir),
+                self.autocleanspace, self.autocleaninterval)
+        self.spacewatcher.add_cleaner("old roots", self.rootspath,
+                self._clean_roots)
+        self.spacewatcher.add_cleaner("stale spools", self.spooldir,
+                self._clean_spools)
+        self.spacewatcher.check()
+        self.spacewatcher.start()
+
+    def _stop_watching_space(self):
+        if self.spacewatcher is not None:
+            self.spacewatcher.stop()
+            self.spacewatcher = None
+            for rootmanager in self.spoolmanagers:
+                rootmanager.su().stop()
+            self.spoolmanagers = []
+            self.cleanmanager = None
+
+    def _check_free_space(self, path):
+        # the delivery directory may not exist yet
+        path = existing_parent(path)
+        free = util.free_space(path)
+        if free < self.minfreespace:
+            raise BuildError, ("only %s available in %s, at least %s are "
+                    "required (see min-free-space)" % (util.format_size(free),
+                        path, util.format_size(self.minfreespace)))
+
+    def _check_build_deps(self, sourcepath, names):
+        info = self._source_info(sourcepath)
+        # the ones built in the batch will be in the spool
+        deps = [dep for dep in info.requires
+                if not any(schedule.provided_by(dep, name)
+                    for name in names)]
+        missing = self.packagemanager.missing_build_deps(deps, self.repos)
+        if missing:
+            raise BuildError, ("%s has build dependencies that cannot "
+                    "be satisfied: %s" % (os.path.basename(sourcepath),
+                        ", ".join(missing)))
+
+    def _run_checks(self, checks):
+        from multiprocessing.pool import ThreadPool
+        def run(check):
+            fun, args = check
+            try:
+                fun(*args)
+            except (EnvironmentError, Error), e:
+                return str(e)
+            return None
+        pool = ThreadPool(min(self.preflightworkers, len(checks)))
+        try:
+            problems = pool.map(run, checks)
+        finally:
+            pool.close()
+            pool.join()
+        return [problem for problem in problems if problem]
+
+    def preflight(self, paths):
+        """Checks everything the build needs before creating any root
+
+        The source packages, the free space and the superuser agent are
+        checked at once, followed by the build dependencies, as they
+        need the headers of all the source packages.
+        """
+        checks = [(self._source_info, (path,)) for path in paths]
+        for path in (self.rootspath, self.spooldir, self.deliverydir):
+            checks.append((self._check_free_space, (path,)))
+        checks.append((self.rootmanager.test_sudo, (False,)))
+        problems = self._run_checks(checks)
+        if not problems:
+            names = [self._source_info(path).name for path in paths]
+            problems = self._run_checks([(self._check_build_deps,
+                (path, names)) for path in paths])
+        if problems:
+            raise BuildError, ("pre-flight checks failed:\n%s" %
+                    ("\n".join(problems)))
+
+    def order_sources(self, paths):
+        """Puts the packages expected to take longer first
+
+        Packages that seem to build-require a package given before them
+        on the command line are kept after it.
+        """
+        jobs = []
+        for i, sourcepath in enumerate(paths):
+            info = self._source_info(sourcepath)
+            sourceid = self._get_source_id(sourcepath)
+            duration = self.history.estimate(self.targetname, info.name)
+            jobs.append(schedule.Job(i, sourcepath, sourceid, info.name,
+                info.requires, duration))
+        if all(job.duration is None for job in jobs):
+            logger.debug("no build history for any of the packages, "
+                    "keeping the command line order")
+            return list(paths)
+        ordered = schedule.longest_first(jobs)
+        logger.info("build order (about %s in total):",
+                util.format_duration(schedule.makespan(ordered)))
+        for job in ordered:
+            if job.duration is None:
+                expected = "unknown"
+            else:
+                expected = util.format_duration(job.duration)
+            logger.info("  %s (%s)", job.sourceid, expected)
+        return [job.path for job in ordered]
+
     def build(self, id, fresh, paths, logstore, stage=None, timeout=None,
-            keeproot=False, keepbuilding=False):
-        spool = self.create_spool(id)
-        # TODO ^^^^^ think about unintended spool reuse
+            keeproot=False, keepbuilding=False, reuseroot=None,
+            buildorder=None):
         results = []
-        for sourcepath in paths:
-            self.packagemanager.check_source_package(sourcepath)
+        self._watch_space()
+        try:
+            self.preflight(paths)
+            spool = self.create_spool(id)
+            # TODO ^^^^^ think about unintended spool reuse
+            if buildorder is None:
+                buildorder = self.buildorder
+            if buildorder == "longest-first" and len(paths) > 1:
+                paths = self.order_sources(paths)
+            if reuseroot is None:
+                reuseroot = self.reuseroot
+            if reuseroot and (not fresh or stage or self.interactive):
+                logger.debug("not reusing the root for the whole batch")
+                reuseroot = False
+            if reuseroot:
+                results = self.build_batch(id, paths, logstore, spool,
+                        timeout, keeproot, keepbuilding)
+            else:
+                for sourcepath in paths:
+                    self._check_stopped()
+                    sourceid = self._get_source_id(sourcepath)
+                    result = self.build_one(id, fresh, sourceid, sourcepath,
+                            logstore.subpackage(sourceid), spool, stage,
+                            timeout, keeproot)
+                    results.append(result)
+                    if not result.success and not keepbuilding:
+                        break
+            logstore.done()
+            self.deliver(id, results, logstore)
+        finally:
+            self._stop_watching_space()
+            self.rootmanager.wait_destroyed()
+            self.history.close()
+        return results
+
+    def estimate(self, paths):
+        """Yields the source id and expected build duration of each package
+
+        The duration is None for packages never built successfully.
+        """
         for sourcepath in paths:
             sourceid = self._get_source_id(sourcepath)
-            result = self.build_one(id, fresh, sourceid, sourcepath,
-                    logstore.subpackage(sourceid), spool, stage, timeout,
-                    keeproot)
-            results.append(result)
-            if not result.success and not keepbuilding:
-                break
-        logstore.done()
-        self.deliver(id, results, logstore)
-        return results
+            yield sourceid, self.history.estimate(self.targetname,
+                    package_name(sourceid))
+        self.history.close()
 
     def shell(self, id, fresh, logstore):
         root = self._get_root(id, fresh, logstore, interactive=True)
@@ -302,6 +690,14 @@ class Builder:
         finally:
             root.deactivate()
 
+    def stop(self):
+        """Makes a running build stop before its next package"""
+        self.stopping.set()
+
+    def _check_stopped(self):
+        if self.stopping.is_set():
+            raise BuildError, "the build was interrupted"
+
     def set_interactive(self):
         self.interactive = True
 
@@ -0,0 +1,147 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Cache of successful builds
+
+A build is looked up by a hash of everything it depends on that is known
+before a root is created: the source package contents, the target
+configuration that affects the build and the packages available in the
+spool. The packages of a hit are taken from the artifact store. Entries
+expire after a TTL, as the state of the repositories is not part of the
+key.
+"""
+import os
+import time
+import json
+import errno
+import hashlib
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.buildcache")
+
+class BuildCacheError(Error):
+    pass
+
+def cache_key(parts):
+    """Hashes a sequence of (name, value) pairs"""
+    digest = hashlib.sha256()
+    for name, value in parts:
+        digest.update("%s=%r\n" % (name, value))
+    return digest.hexdigest()
+
+class BuildCache:
+
+    def __init__(self, path, store, ttl):
+        self.path = path
+        self.store = store
+        self.ttl = ttl
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:])
+
+    def _expired(self, entry, now=None):
+        return (now or time.time()) - entry.get("time", 0) > self.ttl
+
+    def _load(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (EnvironmentError, ValueError), e:
+            if getattr(e, "errno", None) != errno.ENOENT:
+                logger.debug("ignoring broken cache entry %s: %s", path, e)
+            return None
+
+    def _available(self, entry):
+        return all(os.path.exists(self.store.object_path(digest))
+                for name, digest in entry["files"])
+
+    def lookup(self, key):
+        """Provides the entry of a previous build or None"""
+        entry = self._load(self._entry_path(key))
+        if entry is None or self._expired(entry):
+            return None
+        if not self._available(entry):
+            logger.debug("packages of cached build %s were removed", key)
+            return None
+        return entry
+
+    def record(self, key, sourceid, id, paths, digests):
+        """Records the packages of a build, digests are the ones given by
+        ArtifactStore.store_files for paths"""
+        entry = {"time": time.time(), "sourceid": sourceid, "id": id,
+                "files": [(os.path.basename(path), digest)
+                    for path, digest in zip(paths, digests)]}
+        path = self._entry_path(key)
+        tmppath = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmppath, "w") as f:
+                json.dump(entry, f)
+            os.rename(tmppath, path)
+        except EnvironmentError, e:
+            raise BuildCacheError, ("failed to record the build of %s: %s" %
+                    (sourceid, e))
+        logger.debug("cached build of %s as %s", sourceid, key)
+
+    def restore(self, entry, destdir):
+        """Links the packages of a cached build into destdir, returns their
+        paths"""
+        paths = []
+        try:
+            if not os.path.isdir(destdir):
+                os.makedirs(destdir)
+            for name, digest in entry["files"]:
+                path = os.path.join(destdir, name)
+                if os.path.lexists(path):
+                    os.unlink(path)
+                os.link(self.store.object_path(digest), path)
+                paths.append(path)
+        except EnvironmentError, e:
+            raise BuildCacheError, ("failed to restore the packages of "
+                    "%s: %s" % (entry.get("sourceid"), e))
+        return paths
+
+    def collect(self, dry_run=False):
+        """Removes the expired entries and the ones whose packages are no
+        longer stored, yields the source id of each one"""
+        now = time.time()
+        for dirpath, dirnames, filenames in os.walk(self.path):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                entry = self._load(path)
+                if (entry is not None and not self._expired(entry, now)
+                        and self._available(entry)):
+                    continue
+                if not dry_run:
+                    try:
+                        os.unlink(path)
+                    except OSError, e:
+                        logger.warn("failed to remove %s: %s", path, e)
+                        continue
+                yield (entry or {}).get("sourceid", name)
+
+def get_build_cache(store, ttl):
+    if store is None or ttl <= 0:
+        return None
+    return BuildCache(os.path.join(store.path, "builds"), store, ttl)
@@ -29,8 +29,8 @@ class CommandError(Error):
 def run(args, error=False):
     proc = subprocess.Popen(args=args, shell=False,
             stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    proc.wait()
-    output = proc.stdout.read()
+    # reading before waiting, a full pipe would block it forever
+    output = proc.communicate()[0]
     if proc.returncode != 0 and error:
         cmdline = subprocess.list2cmdline(args)
         raise CommandError, ("command failed: %s\n%s\n" %
@@ -24,7 +24,7 @@ import os
 import optparse
 import logging
 import time
-from jurtlib import Error
+from jurtlib import Error, util
 from jurtlib.config import JurtConfig
 from jurtlib.facade import JurtFacade
 
@@ -190,7 +190,11 @@ root. Run jurt-test-sudo for checking whether it is properly configured.
     def init_parser(self, parser):
         JurtCommand.init_parser(self, parser)
         parser.add_option("-t", "--target", type="string",
-                help="Target packages are built for")
+                help=("Target packages are built for, a comma-separated "
+                    "list builds for all of them at once"))
+        parser.add_option("-a", "--all-targets", default=False,
+                action="store_true",
+                help="Build for all the targets at once")
         parser.add_option("-b", "--stop", default=None, metavar="STAGE",
                 help="Stop at build stage STAGE and drops into a shell")
         parser.add_option("-s", "--showlog",
@@ -211,6 +215,24 @@ root. Run jurt-test-sudo for checking whether it is properly configured.
                 action="store_true",
                 help=("Keep building the following packages when the "
                     "preceding one has failed (jurt aborts by default)."))
+        parser.add_option("-r", "--reuse-root", default=None,
+                action="store_true",
+                help=("Build all the packages in the same root, removing "
+                    "the build dependencies between them (see the "
+                    "reuse-root configuration option)"))
+        parser.add_option("--keep-order", dest="build_order",
+                default=None, action="store_const", const="command-line",
+                help=("Build the packages in the order they were given "
+                    "(see the build-order configuration option)"))
+        parser.add_option("-L", "--longest-first", dest="build_order",
+                action="store_const", const="longest-first",
+                help=("Build first the packages expected to take longer, "
+                    "based on the build history (see the build-order "
+                    "configuration option)"))
+        parser.add_option("-e", "--estimate", default=False,
+                action="store_true",
+                help=("Only print how long the packages are expected to "
+                    "take to build, based on the build history"))
         parser.add_option("-n", "--newid", default=None, metavar="ID",
                 help=("Set the name of the root to be created "
                     "(so that it can be reused with -i ID)"))
@@ -219,9 +241,74 @@ root. Run jurt-test-sudo for checking whether it is properly configured.
                 help=("Limit in seconds of build time (when exceeded the "
                      "build task is killed with SIGTERM)"))
 
+    def _estimate(self, targetname):
+        total = 0.0
+        unknown = 0
+        for sourceid, duration in self.jurt.estimate(self.args,
+                targetname):
+            if duration is None:
+                unknown += 1
+                print "%s\tunknown" % (sourceid)
+            else:
+                total += duration
+                print "%s\t%s" % (sourceid, util.format_duration(duration))
+        line = "total: %s" % (util.format_duration(total))
+        if unknown:
+            line += " (%d package(s) never built)" % (unknown)
+        print line
+
+    def _target_names(self):
+        if self.opts.all_targets:
+            if self.opts.target:
+                raise CliError, "-t and -a cannot be used together"
+            return [name for name, _ in self.jurt.target_names()]
+        if self.opts.target and "," in self.opts.target:
+            return [name.strip() for name in self.opts.target.split(",")
+                    if name.strip()]
+        return None
+
+    def _build_targets(self, targetnames):
+        if (self.opts.latest or self.opts.id or self.opts.stop
+                or self.opts.showlog):
+            raise CliError, ("-i, -l, -b and -s cannot be used when "
+                    "building for several targets")
+        outcomes = self.jurt.build_targets(self.args, targetnames,
+                self.opts.newid, timeout=self.opts.duration,
+                keeproot=self.opts.keeproot,
+                keepbuilding=self.opts.keep_building,
+                reuseroot=self.opts.reuse_root,
+                buildorder=self.opts.build_order)
+        failed = 0
+        print "summary:"
+        for name, results, error in outcomes:
+            if error is not None:
+                failed += 1
+                print "  %s: error: %s" % (name, error)
+                continue
+            broken = [result.sourceid for result in results
+                    if not result.success]
+            if broken:
+                failed += 1
+                print "  %s: failed: %s" % (name, " ".join(broken))
+            else:
+                print "  %s: ok (%d packages)" % (name, len(results))
+        if failed:
+            raise CliError, ("the build failed for %d of %d targets" %
+                    (failed, len(outcomes)))
+
     def run(self):
         if not self.args:
             raise CliError, "no source packages provided (--help?)"
+        targetnames = self._target_names()
+        if self.opts.estimate:
+            for targetname in (targetnames or [self.opts.target]):
+                if targetnames:
+                    print "%s:" % (targetname)
+                self._estimate(targetname)
+            return
+        if targetnames:
+            self._build_targets(targetnames)
+            return
         if self.opts.showlog:
             outputfile = sys.stdout
         else:
@@ -243,23 +330,63 @@ root. Run jurt-test-sudo for checking whether it is properly configured.
         self.jurt.build(self.args, self.opts.target, id, fresh,
                 timeout=self.opts.duration, stage=self.opts.stop,
                 outputfile=outputfile, keeproot=self.opts.keeproot,
-                keepbuilding=self.opts.keep_building)
+                keepbuilding=self.opts.keep_building,
+                reuseroot=self.opts.reuse_root,
+                buildorder=self.opts.build_order)
 
 class Clean(JurtCommand):
 
     usage = "%prog -t TARGET file.src.rpm..."
-    descr = "Cleans old roots"
+    descr = "Cleans old roots, spools and logs"
 
     def init_parser(self, parser):
         JurtCommand.init_parser(self, parser)
         parser.add_option("-n", "--dry-run", default=False,
             action="store_true",
             help="Do not remove any root")
+        parser.add_option("-f", "--target-free", type="string",
+            default=None, metavar="SIZE",
+            help="Also remove the least recently used roots until SIZE "
+                "(ie. 200G) is free")
 
     def run(self):
-        for name, timestamp in self.jurt.clean(dry_run=self.opts.dry_run):
+        targetfree = None
+        if self.opts.target_free:
+            try:
+                targetfree = util.parse_size(self.opts.target_free)
+            except ValueError:
+                raise CliError, ("invalid size for --target-free: %s" %
+                        (self.opts.target_free))
+        for name, timestamp in self.jurt.clean(dry_run=self.opts.dry_run,
+                targetfree=targetfree):
             age = (time.time() - timestamp) // 24 // 60 // 60
             print "removing %s (%d days)" % (name, age)
+        for name, timestamp, size, inodes in \
+                self.jurt.clean_spools(dry_run=self.opts.dry_run):
+            age = (time.time() - timestamp) // 24 // 60 // 60
+            print "removing spool %s (%d days, %s, %d inodes)" % (name, age,
+                    util.format_size(size), inodes)
+        for name, timestamp, size in \
+                self.jurt.clean_logs(dry_run=self.opts.dry_run):
+            age = (time.time() - timestamp) // 24 // 60 // 60
+            print "removing logs of %s (%d days, %s)" % (name, age,
+                    util.format_size(size))
+        for store in self.jurt.artifact_stores():
+            removed = list(store.collect(dry_run=self.opts.dry_run))
+            if removed:
+                print "removing %d unused packages from %s (%s)" % (
+                        len(removed), store.path,
+                        util.format_size(sum(size for _, size in removed)))
+            count, stored, linked = store.usage()
+            if stored:
+                print ("%s: %d packages using %s, deduplication ratio "
+                        "%.2f" % (store.path, count, util.format_size(stored),
+                            float(linked) / stored))
+        for cache in self.jurt.build_caches():
+            removed = list(cache.collect(dry_run=self.opts.dry_run))
+            if removed:
+                print "removing %d expired builds from %s" % (len(removed),
+                        cache.path)
 
 
 class Invalidate(JurtCommand):
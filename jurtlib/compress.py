@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2012 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Compression of the logs delivered
+
+The logs of a build are compressed at once, each one by a process running
+log-compress-command. When the command is xz and an lzma module is
+available, the small logs are compressed in-process with the same preset
+instead, sparing a fork for each one. Both give a stream that xz
+decompresses to the same data, but not necessarily the same bytes: a
+multithreaded xz also records the block sizes in the headers.
+"""
+import os
+import logging
+import subprocess
+from jurtlib import CommandError
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+logger = logging.getLogger("jurt.compress")
+
+# logs up to this size are compressed in-process
+SMALL_LOG = 1024 * 1024
+
+def xz_preset(args):
+    """Provides the preset used by an xz command line that compresses to
+    stdout, or None if it is something else"""
+    if not args or os.path.basename(args[0]) != "xz":
+        return None
+    preset = 6
+    stdout = False
+    for arg in args[1:]:
+        if not arg.startswith("-") or arg.startswith("--"):
+            return None
+        for flag in arg[1:]:
+            if flag.isdigit():
+                preset = int(flag)
+            elif flag in "cz":
+                stdout = stdout or flag == "c"
+            else:
+                return None
+    if not stdout:
+        return None
+    return preset
+
+def pipe_through(from_, progargs, to):
+    cmdline = subprocess.list2cmdline(progargs)
+    logger.debug("piping %s through %s into %s" % (from_, cmdline, to))
+    with open(from_) as fromfile:
+        with open(to, "w") as tofile:
+            proc = subprocess.Popen(progargs, shell=False, stdin=fromfile,
+                    stdout=tofile, stderr=subprocess.PIPE)
+            errors = proc.stderr.read()
+            proc.wait()
+    if proc.returncode != 0:
+        raise CommandError(proc.returncode, cmdline, errors)
+
+def compress_file(from_, progargs, to):
+    preset = xz_preset(progargs)
+    if (lzma is not None and preset is not None
+            and os.path.getsize(from_) <= SMALL_LOG):
+        logger.debug("compressing %s into %s in-process" % (from_, to))
+        with open(from_, "rb") as fromfile:
+            data = lzma.compress(fromfile.read(), preset=preset)
+        with open(to, "wb") as tofile:
+            tofile.write(data)
+    else:
+        pipe_through(from_, progargs, to)
+
+def compress_files(pairs, progargs, workers):
+    """Compresses each (from, to) pair of paths, running up to workers
+    compressions at once"""
+    from multiprocessing.pool import ThreadPool
+    pairs = list(pairs)
+    if not pairs:
+        return
+    pool = ThreadPool(min(workers, len(pairs)))
+    try:
+        pool.map(lambda (from_, to): compress_file(from_, progargs, to),
+                pairs)
+    finally:
+        pool.close()
+        pool.join()
+
+def default_workers():
+    import multiprocessing
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
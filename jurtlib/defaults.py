@@ -38,6 +38,10 @@ system-file = /etc/jurt/jurt.conf
 
 arch = host
 arch-map = i586 /usr/bin/setarch i586
+arch-personality = i586 linux32 | i686 linux32 | i386 linux32
+arch-personality-doc = personality (linux or linux32) set directly by
+    the agent for the commands run in roots of the given arch, instead of
+    using the command from arch-map
 
 repos = use-repositories-from-system
 
@@ -68,10 +72,28 @@ builder-uid-doc = note the builder-uid option is not used when using
 max-uid = 2147483647
 build-status-file = status
 chroot-spool-dir = /build-spool/
+reuse-root = no
+reuse-root-doc = build all the packages of a jurt-build run in the same
+    root, removing the build dependencies installed after each package
+    (see also jurt-build --reuse-root)
 built-dir-name = packages
 delivery-dir = ~/jurt/
 delivery-log-file-ext = .xz
 log-compress-command = xz -9c
+log-compress-workers = 0
+log-compress-workers-doc = number of logs compressed at once when
+    delivering a build, 0 uses the number of processors
+log-max-size = 64
+log-max-size-doc = size in MB a single build log can take, for longer
+    output only the first and last halves are kept. Set to 0 to disable it.
+logs-max-age = 30
+logs-max-age-doc = logs of builds older than logs-max-age days are removed
+    from logs-dir by jurt-clean (the compressed copies in delivery-dir are
+    kept). Set to 0 to disable it.
+logs-max-total-size = 10240
+logs-max-total-size-doc = jurt-clean also removes the logs of the oldest
+    builds until logs-dir uses less than this size in MB. Set to 0 to
+    disable it.
 logs-dir-name = logs
 latest-build-suffix = -build-latest
 latest-interactive-suffix = -interactive-latest
@@ -94,8 +116,11 @@ urpmi-command = /usr/bin/env -i /usr/sbin/urpmi
 urpmiaddmedia-command = /usr/sbin/urpmi.addmedia --no-md5sum
 urpmi-extra-options = --no-suggests --excludedocs
 urpmi-update-command = /usr/sbin/urpmi.update -a
+urpme-command = /usr/bin/env -i /usr/sbin/urpme
 urpmi-list-medias-command = /usr/bin/env -i /usr/bin/urpmq --dump-config
 urpmi-ignore-system-medias = (testing|backports|debug|SRPMS|file://|cdrom://)
+urpmq-whatprovides-command = /usr/bin/env -i /usr/bin/urpmq --whatprovides
+urpmq-missing-output = ^No package named (.*)$
 genhdlist-command = /usr/bin/genhdlist2 --allow-empty-media
 urpmi-fatal-output = (No space left on device|A requested package cannot be installed|Some requested packages cannot be installed)
 
@@ -110,6 +135,7 @@ smart-options = -o sync-urpmi-medialist=no
 smart-channel-add-command = %(smart-command)s channel %(smart-options)s --yes --add
 smart-install-command = %(smart-command)s install --yes %(smart-options)s
 smart-update-command = %(smart-command)s update %(smart-options)s
+smart-remove-command = %(smart-command)s remove --yes %(smart-options)s
 smart-datadir = /var/lib/smart
 smart-spool-channel = build-spool type=urpmi "baseurl=$path"
                       hdlurl=media_info/synthesis.hdlist.cz
@@ -118,6 +144,8 @@ smart-spool-update-command = /usr/bin/genhdlist2
 rpm-command = /bin/rpm
 rpm-list-packages-command = %(rpm-command)s -qa --qf
     'n=%%{name} e=%%{epoch} v=%%{version} r=%%{release} de=%%{distepoch} dt=%%{disttag}\\n'
+rpm-list-installed-command = %(rpm-command)s -qa --qf
+    '%%{name} %%{name}-%%{version}-%%{release}.%%{arch}\\n'
 rpm-install-source-command = %(rpm-command)s --nodeps -i
 rpm-build-source-command = /usr/bin/rpmbuild
 rpm-skip-build-deps = ^rpmlib\\(
@@ -152,10 +180,60 @@ root-post-command = passwd -l root; touch /jurt-root
 root-max-age = 14
 root-max-age-doc = Roots older than root-max-age (in days) can be removed by
     jurt-clean.
+spool-max-age = 7
+spool-max-age-doc = Spools not changed for spool-max-age days are removed by
+    jurt-clean, unless an active or kept root has the same build id.
 put-copy-command = cp -a
 pull-glob = SPECS/*.spec SOURCES/*
 chroot-destroy-command = rm --recursive --one-file-system --preserve-root
         --interactive=never
+artifact-store-dir = %(jurt-base-dir)s/artifacts/
+artifact-store-dir-doc = directory where the built packages are stored
+    under the sha256 of their contents. The success, spool and delivery
+    directories get hardlinks to them, so that identical packages are
+    stored once. Unused packages are removed by jurt-clean. Leave it
+    empty to disable the store.
+build-cache-ttl = 0
+build-cache-ttl-doc = hours a successful build is reused by later builds of
+    the same source package, when the target configuration and the
+    packages in the spool did not change. The packages are taken from the
+    artifact store, so it requires artifact-store-dir. As the state of the
+    repositories is not checked, keep it short. Set to 0 to disable it.
+build-history-file = %(builds-dir)s/history/history.sqlite
+build-history-file-doc = SQLite database where the duration, disk usage
+    and memory usage of each build are recorded, used by
+    jurt-build --estimate. Leave it empty to disable the history.
+build-order = command-line
+build-order-doc = order in which the packages of a jurt-build run are
+    built: command-line, or longest-first, which uses the build history
+    to start with the packages expected to take longer. Packages that
+    seem to build-require a package given before them are kept after it,
+    but that is guessed from their names, so it may miss dependencies
+    (see also jurt-build --longest-first and --keep-order)
+min-free-space = 1024
+min-free-space-doc = space in MB that must be available in the roots,
+    spool and delivery directories for jurt-build to start
+auto-clean-free-space = 2048
+auto-clean-free-space-doc = when less than this space in MB is available
+    in the roots or spool directories, before creating a root or while
+    building, the old roots are removed, starting with the ones older than
+    root-max-age and then the least recently used ones. Set to 0 to
+    disable it.
+auto-clean-interval = 60
+auto-clean-interval-doc = seconds between free space checks while building
+preflight-workers = 8
+preflight-workers-doc = number of checks run at once before a build
+    starts (source packages, free space, superuser agent)
+root-index-file = %(roots-path)s/index/roots.journal
+root-index-file-doc = journal of the state changes of the roots, used to
+    list and find roots without scanning the state directories. It is
+    rebuilt from the state directories when missing. Leave it empty to
+    always scan them.
+clean-workers = 4
+clean-workers-doc = number of roots destroyed in parallel by jurt-clean
+async-root-destroy = yes
+async-root-destroy-doc = destroy the roots used in builds in background,
+    while the next package is built
 chroot-remount-wrapper-command-doc = a command that will be appended after
                                      chroot command line. It is intended
                                      to remount /proc and /sys. It should
@@ -187,8 +265,24 @@ btrfs-delete-subvol-command = %(btrfs-command)s subvolume delete
 mount-command = /bin/mount
 tmpfs-mount-command = %(mount-command)s -t tmpfs jurt-tmpfs
 tmpfs-umount-command = /bin/umount
+tmpfs-package-space = 2048
+tmpfs-package-space-doc = space in MB reserved in tmpfs roots for the build
+    dependencies and the build itself, added to the size of the cached root
+tmpfs-compression-ratio = 4
+tmpfs-compression-ratio-doc = used to estimate the size of a cached root
+    when its unpacked size was not recorded
+tmpfs-min-free-memory = 1024
+tmpfs-min-free-memory-doc = memory in MB that must be left available on
+    the host, otherwise the root is created on disk
 
 unshare-command = unshare --ipc --uts
+chroot-executor = no
+chroot-executor-doc = run the commands of the builds through a process
+    started once for each active root and user, already inside the root
+    and running as the user, instead of running chroot-command and
+    su-command for each of them. The executor enters new IPC and UTS
+    namespaces as unshare-command does, and commands are run by the login
+    shell of the user.
 interactive-shell-term = xterm
 chroot-command = /usr/bin/env -i %(unshare-command)s -- /usr/sbin/chroot
 ; note that newer sudo doesn't allow passing variables with spaces to
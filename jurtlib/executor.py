@@ -0,0 +1,280 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Long-lived process running commands inside a root for the agent
+
+The executor is forked from the agent once per root and user. It enters
+new IPC and UTS namespaces, chroots and switches to the user only once,
+and then forks one login shell for each command it receives, instead of
+the env + unshare + chroot + su chain executed for every command.
+"""
+import os
+import sys
+import errno
+import signal
+import logging
+# needed after chrooting, where the modules cannot be found (os.wait4
+# imports resource)
+import json
+import pwd
+import grp
+import resource
+import traceback
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.executor")
+
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+
+# the exit code of timeout(1)
+TIMEOUT_STATUS = 124
+# seconds between the SIGTERM and the SIGKILL of a command timed out
+KILL_GRACE = 5
+
+ROOT_PATH = "/usr/local/sbin:/usr/sbin:/sbin:/usr/local/bin:/usr/bin:/bin"
+USER_PATH = "/usr/local/bin:/usr/bin:/bin"
+
+class ExecutorError(Error):
+    pass
+
+# the agent side of the pipes of all running executors
+_openfds = set()
+
+_libc = []
+
+def _load_libc():
+    # find_library runs ldconfig, better done before chrooting
+    if not _libc:
+        import ctypes
+        import ctypes.util
+        _libc.append(ctypes.CDLL(ctypes.util.find_library("c"),
+            use_errno=True))
+    return _libc[0]
+
+def _unshare(flags):
+    import ctypes
+    if _load_libc().unshare(flags) != 0:
+        raise ExecutorError, ("unshare failed: %s" %
+                os.strerror(ctypes.get_errno()))
+
+def _set_cloexec(fd):
+    import fcntl
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+def _encode(fields):
+    return json.dumps(fields) + "\n"
+
+def _decode(line):
+    return json.loads(line)
+
+class ChrootExecutor:
+
+    def __init__(self, root, user=None, personality=None):
+        self.root = root
+        self.user = user
+        self.personality = personality
+        self.pid = None
+        self.requests = None
+        self.replies = None
+
+    def start(self):
+        _load_libc()
+        reqread, reqwrite = os.pipe()
+        repread, repwrite = os.pipe()
+        # whatever is buffered would be written twice otherwise
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                # otherwise other executors would never see EOF
+                for fd in _openfds:
+                    os.close(fd)
+                _openfds.clear()
+                os.close(reqwrite)
+                os.close(repread)
+                self._serve(os.fdopen(reqread, "r", 0),
+                        os.fdopen(repwrite, "w", 0))
+            except:
+                traceback.print_exc()
+                status = 1
+            os._exit(status)
+        os.close(reqread)
+        os.close(repwrite)
+        _set_cloexec(reqwrite)
+        _set_cloexec(repread)
+        _openfds.update((reqwrite, repread))
+        self.pid = pid
+        self.requests = os.fdopen(reqwrite, "w", 0)
+        self.replies = os.fdopen(repread, "r", 0)
+        logger.debug("started executor %d for %s", pid, self.root)
+
+    def alive(self):
+        if self.pid is None:
+            return False
+        try:
+            pid, _ = os.waitpid(self.pid, os.WNOHANG)
+        except OSError, e:
+            if e.errno != errno.ECHILD:
+                raise
+            pid = self.pid
+        if pid == self.pid:
+            self.pid = None
+            return False
+        return True
+
+    def run(self, args, shell=True, timeout=None, ignorestderr=False):
+        """Runs args in the root, returns the exit status and peak RSS
+
+        When shell is set, args is run by a login shell of the user as
+        su -l would do, otherwise it is executed directly with an empty
+        environment.
+        """
+        try:
+            self.requests.write(_encode({"args": args, "shell": shell,
+                "timeout": timeout, "ignorestderr": ignorestderr}))
+            line = self.replies.readline()
+        except IOError, e:
+            raise ExecutorError, "failed to talk to the executor: %s" % (e)
+        if not line:
+            self.stop()
+            raise ExecutorError, "the executor for %s died" % (self.root)
+        reply = _decode(line)
+        return reply["returncode"], reply["maxrss"]
+
+    def stop(self):
+        if self.requests is not None:
+            _openfds.difference_update((self.requests.fileno(),
+                self.replies.fileno()))
+            self.requests.close()
+            self.replies.close()
+            self.requests = self.replies = None
+        if self.pid is not None:
+            try:
+                os.waitpid(self.pid, 0)
+            except OSError, e:
+                if e.errno != errno.ECHILD:
+                    raise
+            self.pid = None
+
+    # the methods below run in the executor process
+
+    def _enter(self):
+        _unshare(CLONE_NEWIPC | CLONE_NEWUTS)
+        if self.personality is not None:
+            from jurtlib.personality import set_personality
+            set_personality(self.personality)
+        os.chroot(self.root)
+        os.chdir("/")
+        if self.user is None:
+            return {}, "/"
+        # from the passwd of the root, as the chroot is already done
+        pw = pwd.getpwnam(self.user)
+        groups = [group.gr_gid for group in grp.getgrall()
+                if self.user in group.gr_mem]
+        os.setgroups([pw.pw_gid] + groups)
+        os.setgid(pw.pw_gid)
+        os.setuid(pw.pw_uid)
+        env = {"HOME": pw.pw_dir, "SHELL": pw.pw_shell, "USER": self.user,
+                "LOGNAME": self.user, "PATH": USER_PATH}
+        if pw.pw_uid == 0:
+            env["PATH"] = ROOT_PATH
+        return env, pw.pw_dir
+
+    def _serve(self, requests, replies):
+        env, home = self._enter()
+        shell = env.get("SHELL") or "/bin/sh"
+        while True:
+            line = requests.readline()
+            if not line:
+                break
+            request = _decode(line)
+            pid = os.fork()
+            if pid == 0:
+                try:
+                    requests.close()
+                    replies.close()
+                    # in its own process group, so that everything it
+                    # starts can be killed on timeout
+                    os.setsid()
+                    if request["ignorestderr"]:
+                        fd = os.open(os.devnull, os.O_WRONLY)
+                        os.dup2(fd, 2)
+                        os.close(fd)
+                    args = request["args"]
+                    if request["shell"]:
+                        os.chdir(home)
+                        # a leading dash makes it a login shell
+                        argv0 = "-" + os.path.basename(shell)
+                        os.execve(shell, [argv0, "-c", args], env)
+                    else:
+                        os.execvpe(args[0], args, env)
+                except:
+                    traceback.print_exc()
+                os._exit(127)
+            returncode, maxrss = self._wait(pid, request["timeout"])
+            replies.write(_encode({"returncode": returncode,
+                "maxrss": maxrss}))
+
+    def _kill_group(self, pid, signum):
+        try:
+            os.killpg(pid, signum)
+        except OSError, e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    def _wait(self, pid, timeout):
+        expired = []
+        def expire(signum, frame):
+            if expired:
+                self._kill_group(pid, signal.SIGKILL)
+                return
+            expired.append(True)
+            self._kill_group(pid, signal.SIGTERM)
+            signal.alarm(KILL_GRACE)
+        if timeout:
+            signal.signal(signal.SIGALRM, expire)
+            signal.alarm(int(timeout))
+        try:
+            while True:
+                try:
+                    _, status, usage = os.wait4(pid, 0)
+                except OSError, e:
+                    if e.errno == errno.EINTR:
+                        continue
+                    raise
+                break
+        finally:
+            if timeout:
+                signal.alarm(0)
+        if expired:
+            # whatever survived the command itself
+            self._kill_group(pid, signal.SIGKILL)
+            returncode = TIMEOUT_STATUS
+        elif os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        return returncode, usage.ru_maxrss * 1024
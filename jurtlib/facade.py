@@ -19,6 +19,7 @@
 # along with Jurt Build Bot; if not, write to the Free Software
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
+import os
 from jurtlib import Error, SetupError
 from jurtlib import config, root, su, target as targetmod
 
@@ -76,11 +77,66 @@ class JurtFacade:
 
     def build(self, paths, targetname=None, id=None, fresh=False,
             stage=None, timeout=None, outputfile=None, keeproot=False,
-            keepbuilding=False):
+            keepbuilding=False, reuseroot=None, buildorder=None):
         """Builds a set of packages"""
         target = self.get_target(targetname, id, interactive=bool(stage))
-        target.build(paths, id, fresh, stage, timeout, outputfile,
-                keeproot, keepbuilding)
+        target.share_spools(self._spool_sharers(target))
+        return target.build(paths, id, fresh, stage, timeout, outputfile,
+                keeproot, keepbuilding, reuseroot, buildorder)
+
+    def build_targets(self, paths, targetnames, id=None, timeout=None,
+            keeproot=False, keepbuilding=False, reuseroot=None,
+            buildorder=None):
+        """Builds a set of packages for several targets at once
+
+        Each target builds in its own thread, with its own superuser
+        agent, and the target name is appended to the build id. Returns
+        a list of (targetname, results, error) in the order of
+        targetnames.
+        """
+        import threading
+        targets = [self.get_target(name) for name in targetnames]
+        for target in targets:
+            target.share_spools(self._spool_sharers(target))
+        if id is None:
+            id = targets[0].builder.build_id()
+        outcomes = {}
+        def build(target):
+            try:
+                results = target.build(paths, id + "-" + target.name,
+                        True, None, timeout, None, keeproot, keepbuilding,
+                        reuseroot, buildorder)
+            except Error, e:
+                outcomes[target.name] = (None, e)
+            else:
+                outcomes[target.name] = (results, None)
+        threads = []
+        for target in targets:
+            thread = threading.Thread(target=build, args=(target,),
+                    name=target.name)
+            thread.start()
+            threads.append(thread)
+        try:
+            for thread in threads:
+                # joining with a timeout keeps the main thread interruptible
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            # the builds must deactivate their roots before exiting
+            for target in targets:
+                target.stop()
+            for thread in threads:
+                thread.join()
+            raise
+        unexpected = Error("unexpected error, see the messages above")
+        return [(name,) + outcomes.get(name, (None, unexpected))
+                for name in targetnames]
+
+    def estimate(self, paths, targetname=None):
+        """Yields the expected build duration of each package"""
+        target = self.get_target(targetname)
+        for info in target.estimate(paths):
+            yield info
 
     def target_names(self):
         defname = self.config.jurt.default_target
@@ -110,12 +166,70 @@ class JurtFacade:
                 dryrun=dryrun):
             yield info
 
-    def clean(self, dry_run=False):
+    def clean(self, dry_run=False, targetfree=None):
         self._init_targets()
         for target in self.targets.values():
-            for info in target.clean(dry_run):
+            for info in target.clean(dry_run, targetfree):
                 yield info
 
+    def _by_directory(self, getdir):
+        """Groups the targets by the directory they share, as the spools
+        and logs directories are shared by default"""
+        self._init_targets()
+        groups = {}
+        order = []
+        for target in self.targets.values():
+            path = getdir(target)
+            if path not in groups:
+                groups[path] = []
+                order.append(path)
+            groups[path].append(target)
+        return [groups[path] for path in order]
+
+    def _spool_sharers(self, target):
+        """The other configured targets using the spool directory of
+        target"""
+        spooldir = target.spool_dir()
+        sharers = []
+        for name, targetconf in self.targetsconf.iteritems():
+            if (name != target.name and
+                    os.path.abspath(targetconf.spool_dir) == spooldir):
+                sharers.append(self.init_target(name))
+        return sharers
+
+    def clean_spools(self, dry_run=False):
+        for targets in self._by_directory(targetmod.Target.spool_dir):
+            # a spool is in use while a root of any of them needs it
+            inuse = root.ids_in_use([target.rootmanager
+                for target in targets])
+            for info in targets[0].clean_spools(inuse, dry_run):
+                yield info
+
+    def clean_logs(self, dry_run=False):
+        for targets in self._by_directory(targetmod.Target.logs_dir):
+            inuse = root.ids_in_use([target.rootmanager
+                for target in targets])
+            for info in targets[0].clean_logs(inuse, dry_run):
+                yield info
+
+    def artifact_stores(self):
+        self._init_targets()
+        stores = {}
+        for target in self.targets.values():
+            store = target.artifact_store()
+            if store is not None:
+                stores[os.path.abspath(store.path)] = store
+        return stores.values()
+
+    def build_caches(self):
+        self._init_targets()
+        caches = {}
+        for target in self.targets.values():
+            cache = target.build_cache()
+            if cache is not None:
+                caches[os.path.abspath(cache.path)] = cache
+        return caches.values()
+
     def keep(self, id):
         target = self.get_target(None, id)
         target.keep(id)
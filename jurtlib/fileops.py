@@ -0,0 +1,312 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+In-process file operations used by the superuser agent
+
+They replace forking install(1) and cp(1) for the small operations done
+many times in each build.
+"""
+import os
+import stat
+import errno
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.fileops")
+
+BUFSIZE = 1024 * 1024
+
+class FileOpsError(Error):
+    pass
+
+def _resolve_id(value, getter, field):
+    if value is None:
+        return -1
+    if isinstance(value, (int, long)):
+        return value
+    if value.isdigit():
+        return int(value)
+    try:
+        return getattr(getter(value), field)
+    except KeyError:
+        raise FileOpsError, "invalid user or group: %s" % (value)
+
+def resolve_owner(uid=None, gid=None):
+    import pwd
+    import grp
+    return (_resolve_id(uid, pwd.getpwnam, "pw_uid"),
+            _resolve_id(gid, grp.getgrnam, "gr_gid"))
+
+def _parse_mode(mode, default):
+    if mode is None:
+        return default
+    if isinstance(mode, basestring):
+        try:
+            return int(mode, 8)
+        except ValueError:
+            raise FileOpsError, "invalid file mode: %s" % (mode)
+    return mode
+
+# from linux/fs.h
+FICLONE = 0x40049409
+
+# errors meaning a copy method is not usable for a pair of files
+UNSUPPORTED = frozenset((errno.EINVAL, errno.ENOSYS, errno.EXDEV,
+    errno.EOPNOTSUPP, errno.ENOTTY, errno.EBADF, errno.EPERM))
+
+_libc_functions = {}
+
+def _libc_function(name):
+    """Loads sendfile or copy_file_range from the C library"""
+    if name not in _libc_functions:
+        try:
+            import ctypes
+            import ctypes.util
+            lib = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fun = getattr(lib, name)
+            if name == "sendfile":
+                fun.argtypes = (ctypes.c_int, ctypes.c_int, ctypes.c_void_p,
+                        ctypes.c_size_t)
+            else:
+                fun.argtypes = (ctypes.c_int, ctypes.c_void_p, ctypes.c_int,
+                        ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint)
+            fun.restype = ctypes.c_ssize_t
+        except (ImportError, OSError, AttributeError), e:
+            logger.debug("%s not available: %s", name, e)
+            fun = None
+        _libc_functions[name] = fun
+    return _libc_functions[name]
+
+def _reflink(srcfd, dstfd, size):
+    import fcntl
+    try:
+        fcntl.ioctl(dstfd, FICLONE, srcfd)
+    except IOError, e:
+        if e.errno in UNSUPPORTED:
+            return False
+        raise
+    return True
+
+def _kernel_copy(name, call, size):
+    import ctypes
+    copied = 0
+    while copied < size:
+        done = call(min(size - copied, 1 << 30))
+        if done < 0:
+            err = ctypes.get_errno()
+            if err == errno.EINTR:
+                continue
+            if copied == 0 and err in UNSUPPORTED:
+                return False
+            raise FileOpsError, "%s failed: %s" % (name, os.strerror(err))
+        if done == 0:
+            break
+        copied += done
+    return True
+
+def _copy_file_range(srcfd, dstfd, size):
+    fun = _libc_function("copy_file_range")
+    if fun is None:
+        return False
+    return _kernel_copy("copy_file_range",
+            lambda count: fun(srcfd, None, dstfd, None, count, 0), size)
+
+def _sendfile(srcfd, dstfd, size):
+    fun = _libc_function("sendfile")
+    if fun is None:
+        return False
+    return _kernel_copy("sendfile",
+            lambda count: fun(dstfd, srcfd, None, count), size)
+
+def _copy_buffered(srcfd, dstfd, size=None):
+    while True:
+        data = os.read(srcfd, BUFSIZE)
+        if not data:
+            break
+        while data:
+            written = os.write(dstfd, data)
+            data = data[written:]
+    return True
+
+COPY_METHODS = (("reflink", _reflink),
+        ("copy_file_range", _copy_file_range),
+        ("sendfile", _sendfile),
+        ("buffered", _copy_buffered))
+
+def copy_data(srcfd, dstfd, size):
+    """Copies the data between file descriptors using the cheapest method
+    that works for them, returns the name of the method used"""
+    for name, method in COPY_METHODS:
+        if size == 0 and name != "buffered":
+            continue
+        if method(srcfd, dstfd, size):
+            if name in ("copy_file_range", "sendfile"):
+                # copies anything the file may have gained meanwhile
+                _copy_buffered(srcfd, dstfd)
+            return name
+
+def copy_file(source, dest, link=True):
+    """Copies source to dest, hardlinking it when link is True and both
+    are in the same filesystem
+
+    Returns the name of the method used and the number of bytes copied.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+    try:
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        if link:
+            try:
+                os.link(source, dest)
+            except OSError, e:
+                if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+            else:
+                logger.debug("hardlinked %s to %s", source, dest)
+                return "link", 0
+        import shutil
+        srcfd = os.open(source, os.O_RDONLY)
+        try:
+            st = os.fstat(srcfd)
+            dstfd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                    0600)
+            try:
+                method = copy_data(srcfd, dstfd, st.st_size)
+            finally:
+                os.close(dstfd)
+        finally:
+            os.close(srcfd)
+        shutil.copystat(source, dest)
+    except EnvironmentError, e:
+        raise FileOpsError, "failed to copy %s to %s: %s" % (source, dest,
+                e)
+    logger.debug("copied %s to %s using %s (%d bytes)", source, dest,
+            method, st.st_size)
+    return method, st.st_size
+
+def install_file(source, dest, uid=None, gid=None, mode=None):
+    """Works like install(1): dest is replaced by a copy of source
+
+    The default mode is 0755, as in install(1). Returns the path of the
+    new file, the copy method used and the number of bytes copied.
+    """
+    if os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source))
+    mode = _parse_mode(mode, 0755)
+    uid, gid = resolve_owner(uid, gid)
+    try:
+        srcfd = os.open(source, os.O_RDONLY)
+        try:
+            size = os.fstat(srcfd).st_size
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            dstfd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                    0600)
+            try:
+                method = copy_data(srcfd, dstfd, size)
+                if uid != -1 or gid != -1:
+                    os.fchown(dstfd, uid, gid)
+                os.fchmod(dstfd, mode)
+            finally:
+                os.close(dstfd)
+        finally:
+            os.close(srcfd)
+    except EnvironmentError, e:
+        raise FileOpsError, "failed to install %s into %s: %s" % (source,
+                dest, e)
+    logger.debug("installed %s as %s using %s (%d bytes)", source, dest,
+            method, size)
+    return dest, method, size
+
+def install_dir(path, uid=None, gid=None, mode=None):
+    """Works like install -d: missing parents are created and only the
+    last directory gets the owner and mode"""
+    mode = _parse_mode(mode, 0755)
+    uid, gid = resolve_owner(uid, gid)
+    try:
+        if not os.path.isdir(path):
+            os.makedirs(path, 0755)
+        if uid != -1 or gid != -1:
+            os.chown(path, uid, gid)
+        os.chmod(path, mode)
+    except EnvironmentError, e:
+        raise FileOpsError, "failed to create directory %s: %s" % (path, e)
+
+def _copy_metadata(st, path):
+    os.lchown(path, st.st_uid, st.st_gid)
+    if not stat.S_ISLNK(st.st_mode):
+        os.chmod(path, stat.S_IMODE(st.st_mode))
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+def _link_or_copy(source, dest, st, link):
+    if os.path.lexists(dest):
+        os.unlink(dest)
+    if stat.S_ISLNK(st.st_mode):
+        os.symlink(os.readlink(source), dest)
+        os.lchown(dest, st.st_uid, st.st_gid)
+    elif link:
+        os.link(source, dest)
+    elif stat.S_ISREG(st.st_mode):
+        install_file(source, dest, st.st_uid, st.st_gid,
+                stat.S_IMODE(st.st_mode))
+        os.utime(dest, (st.st_atime, st.st_mtime))
+    else:
+        logger.debug("skipping special file %s", source)
+
+def link_tree(source, dest, link=True):
+    """Works like cp -afl (or cp -af when link is False)
+
+    When source ends with /. its contents are merged into dest.
+    """
+    if os.path.basename(source) != "." and os.path.isdir(dest):
+        dest = os.path.join(dest, os.path.basename(source.rstrip("/")))
+    source = os.path.normpath(source)
+    try:
+        st = os.lstat(source)
+        if not stat.S_ISDIR(st.st_mode):
+            _link_or_copy(source, dest, st, link)
+            return
+        dirs = []
+        for dirpath, dirnames, filenames in os.walk(source):
+            subdir = dirpath[len(source):].lstrip("/")
+            destdir = os.path.join(dest, subdir)
+            if not os.path.isdir(destdir):
+                os.mkdir(destdir, 0700)
+            dirs.append((dirpath, destdir))
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                _link_or_copy(path, os.path.join(destdir, name),
+                        os.lstat(path), link)
+            for name in dirnames[:]:
+                path = os.path.join(dirpath, name)
+                if os.path.islink(path):
+                    # os.walk lists symlinks to directories as directories
+                    _link_or_copy(path, os.path.join(destdir, name),
+                            os.lstat(path), link)
+                    dirnames.remove(name)
+        # timestamps are only preserved if set after populating
+        for dirpath, destdir in reversed(dirs):
+            _copy_metadata(os.lstat(dirpath), destdir)
+    except EnvironmentError, e:
+        raise FileOpsError, "failed to copy %s to %s: %s" % (source, dest,
+                e)
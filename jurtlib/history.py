@@ -0,0 +1,213 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Local database of the resources used by past builds
+
+It is used to predict how long a set of packages will take to build.
+"""
+import os
+import time
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.history")
+
+# number of past successful builds of a package used in estimates
+ESTIMATE_SAMPLES = 5
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS builds (
+    id INTEGER PRIMARY KEY,
+    target TEXT NOT NULL,
+    buildid TEXT NOT NULL,
+    package TEXT NOT NULL,
+    sourceid TEXT NOT NULL,
+    started REAL NOT NULL,
+    duration REAL NOT NULL,
+    diskusage INTEGER,
+    maxrss INTEGER,
+    success INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS builds_package ON builds (target, package);
+CREATE TABLE IF NOT EXISTS phases (
+    build INTEGER NOT NULL REFERENCES builds (id),
+    name TEXT NOT NULL,
+    duration REAL NOT NULL
+);
+"""
+
+class HistoryError(Error):
+    pass
+
+def package_name(sourceid):
+    """Package name from a name-version-release source id"""
+    fields = sourceid.rsplit("-", 2)
+    if len(fields) == 3:
+        return fields[0]
+    return sourceid
+
+class BuildStats:
+    """Resources used while building one source package"""
+
+    def __init__(self, sourceid):
+        self.sourceid = sourceid
+        self.package = package_name(sourceid)
+        self.started = time.time()
+        self.finished = None
+        self.phases = []
+        self.diskusage = None
+        self.maxrss = None
+        self.success = None
+
+    def phase(self, name):
+        return _PhaseTimer(self, name)
+
+    def add_phase(self, name, elapsed):
+        self.phases.append((name, elapsed))
+
+    def finish(self, success):
+        self.success = success
+        self.finished = time.time()
+
+    def duration(self):
+        return (self.finished or time.time()) - self.started
+
+class _PhaseTimer:
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+
+    def __exit__(self, type, value, traceback):
+        self.stats.add_phase(self.name, time.time() - self.start)
+
+class NullHistory:
+    """Used when build-history-file is not set"""
+
+    enabled = False
+
+    def record(self, target, buildid, stats):
+        pass
+
+    def estimate(self, target, package):
+        return None
+
+    def usage(self, target, package):
+        return None, None
+
+    def close(self):
+        pass
+
+class BuildHistory(NullHistory):
+
+    enabled = True
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            import sqlite3
+            created = not os.path.exists(self.path)
+            try:
+                self.conn = sqlite3.connect(self.path, timeout=30)
+                self.conn.executescript(SCHEMA)
+            except sqlite3.Error, e:
+                self.conn = None
+                raise HistoryError, ("failed to open the build history "
+                        "at %s: %s" % (self.path, e))
+            if created:
+                try:
+                    # shared by the members of the jurt group
+                    os.chmod(self.path, 0660)
+                except EnvironmentError, e:
+                    logger.debug("failed to change permissions of %s: %s",
+                            self.path, e)
+        return self.conn
+
+    def record(self, target, buildid, stats):
+        import sqlite3
+        try:
+            conn = self._connect()
+            with conn:
+                cursor = conn.execute("INSERT INTO builds (target, "
+                        "buildid, package, sourceid, started, duration, "
+                        "diskusage, maxrss, success) VALUES "
+                        "(?, ?, ?, ?, ?, ?, ?, ?, ?)", (target, buildid,
+                            stats.package, stats.sourceid, stats.started,
+                            stats.duration(), stats.diskusage, stats.maxrss,
+                            int(bool(stats.success))))
+                rowid = cursor.lastrowid
+                conn.executemany("INSERT INTO phases (build, name, "
+                        "duration) VALUES (?, ?, ?)", [(rowid, name,
+                            elapsed) for name, elapsed in stats.phases])
+        except (sqlite3.Error, HistoryError), e:
+            # the history must never break a build
+            logger.warn("failed to record build history: %s", e)
+
+    def estimate(self, target, package):
+        """Expected duration in seconds of a build of package
+
+        Returns None when there is no successful build of it.
+        """
+        import sqlite3
+        try:
+            conn = self._connect()
+            rows = conn.execute("SELECT duration FROM builds WHERE "
+                    "target = ? AND package = ? AND success = 1 "
+                    "ORDER BY started DESC LIMIT ?", (target, package,
+                        ESTIMATE_SAMPLES)).fetchall()
+        except (sqlite3.Error, HistoryError), e:
+            logger.warn("failed to read build history: %s", e)
+            return None
+        if not rows:
+            return None
+        return sum(row[0] for row in rows) / len(rows)
+
+    def usage(self, target, package):
+        """Peak disk usage and RSS seen in the last builds of package"""
+        import sqlite3
+        try:
+            conn = self._connect()
+            row = conn.execute("SELECT max(diskusage), max(maxrss) FROM "
+                    "(SELECT diskusage, maxrss FROM builds WHERE "
+                    "target = ? AND package = ? ORDER BY started DESC "
+                    "LIMIT ?)", (target, package,
+                        ESTIMATE_SAMPLES)).fetchone()
+        except (sqlite3.Error, HistoryError), e:
+            logger.warn("failed to read build history: %s", e)
+            return None, None
+        return row
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def get_build_history(path):
+    if not path:
+        return NullHistory()
+    return BuildHistory(os.path.expanduser(path))
@@ -21,33 +21,138 @@
 #
 import os
 import time
+import shutil
 import logging
+from jurtlib import Error
+from jurtlib.util import TailBuffer
 from jurtlib.registry import Registry
 
 logger = logging.getLogger("jurt.logger")
 
+class LoggerError(Error):
+    pass
+
+def _megabytes(conf, name):
+    value = getattr(conf, name.replace("-", "_"))
+    try:
+        return int(value) * 1024 * 1024
+    except ValueError:
+        raise LoggerError, "invalid value for %s: %r" % (name, value)
+
+def logs_usage(path):
+    """Provides the total size and the most recent mtime of the files
+    below path"""
+    size = 0
+    mtime = os.lstat(path).st_mtime
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            size += st.st_size
+            mtime = max(mtime, st.st_mtime)
+    return size, mtime
+
 class LoggerFactory:
 
     def __init__(self, loggerconf, globalconf):
         self.logbasedir = os.path.expanduser(loggerconf.logs_dir)
+        self.maxlogsize = _megabytes(loggerconf, "log-max-size")
+        self.maxtotalsize = _megabytes(loggerconf, "logs-max-total-size")
+        try:
+            self.maxage = float(loggerconf.logs_max_age) * 24 * 60 * 60
+        except ValueError:
+            raise LoggerError, ("invalid value for logs-max-age: %r" %
+                    (loggerconf.logs_max_age))
 
     def get_logger(self, id, outputfile=None):
-        return Logger(id, self.logbasedir, outputfile=outputfile)
+        return Logger(id, self.logbasedir, outputfile=outputfile,
+                maxlogsize=self.maxlogsize)
+
+    def collect(self, inuse, dry_run=False):
+        """Removes the logs of the builds older than logs-max-age, then
+        the oldest ones until they use less than logs-max-total-size
+
+        The logs of the build ids in inuse are kept. Yields (id, mtime,
+        size) for each build removed.
+        """
+        try:
+            names = os.listdir(self.logbasedir)
+        except OSError:
+            return
+        found = []
+        total = 0
+        for name in names:
+            path = os.path.join(self.logbasedir, name)
+            try:
+                size, mtime = logs_usage(path)
+            except OSError:
+                continue
+            total += size
+            if name not in inuse:
+                found.append((mtime, name, path, size))
+        found.sort()
+        now = time.time()
+        for mtime, name, path, size in found:
+            expired = self.maxage and now - mtime > self.maxage
+            if not expired and (not self.maxtotalsize
+                    or total <= self.maxtotalsize):
+                break
+            if not dry_run:
+                try:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path)
+                    else:
+                        os.unlink(path)
+                except EnvironmentError, e:
+                    logger.warn("failed to remove the logs at %s: %s", path,
+                            e)
+                    continue
+            total -= size
+            yield name, mtime, size
 
 class OutputLogger(file):
+    """A log file that also matches the output with trap and copies it to
+    outputfile
+
+    With maxsize, only the first and the last maxsize / 2 bytes are
+    written, the last ones when the log is closed.
+    """
 
-    def __init__(self, name, mode="a", trap=None, outputfile=None):
+    def __init__(self, name, mode="a", trap=None, outputfile=None,
+            maxsize=0):
         super(OutputLogger, self).__init__(name, mode)
         self.trap = trap
         self.outputfile = outputfile
         self.matches = []
+        self.maxsize = maxsize
+        self.headleft = maxsize // 2
+        self.tail = TailBuffer(maxsize - maxsize // 2)
+
+    def _flush_tail(self):
+        omitted = self.tail.omitted()
+        if omitted:
+            file.write(self, "\n==== %d bytes omitted, the log exceeded "
+                    "%d bytes\n" % (omitted, self.maxsize))
+        file.write(self, self.tail.getvalue())
+        self.tail = TailBuffer(self.tail.maxsize)
 
     def start(self):
         self.write("==== started log at %s\n" % (time.ctime()))
         self.flush()
 
     def write(self, data):
-        file.write(self, data)
+        if not self.maxsize:
+            file.write(self, data)
+        else:
+            rest = data
+            if self.headleft > 0:
+                file.write(self, rest[:self.headleft])
+                head = min(len(rest), self.headleft)
+                self.headleft -= head
+                rest = rest[head:]
+            self.tail.write(rest)
         if self.trap is not None:
             found = list(self.trap.finditer(data))
             if found:
@@ -57,6 +162,8 @@ class OutputLogger(file):
 
     def close(self):
         self.write("==== closing log at %s\n" % (time.ctime()))
+        if self.tail.size:
+            self._flush_tail()
         self.flush()
         file.close(self)
 
@@ -65,8 +172,9 @@ class OutputLogger(file):
 
 class Logger:
 
-    def __init__(self, id, logbasedir, outputfile=None):
+    def __init__(self, id, logbasedir, outputfile=None, maxlogsize=0):
         self.id = id
+        self.maxlogsize = maxlogsize
         self.path = os.path.join(logbasedir, id)
         self.subpackages = []
         self.logfiles = []
@@ -76,7 +184,8 @@ class Logger:
 
     def get_output_handler(self, name, trap=None):
         path = os.path.join(self.path, name) + ".log"
-        fileobj = OutputLogger(path, trap=trap, outputfile=self.outputfile)
+        fileobj = OutputLogger(path, trap=trap, outputfile=self.outputfile,
+                maxsize=self.maxlogsize)
         logger.debug("created log file %s" % (path))
         fileobj.start()
         self.logfiles.append(path)
@@ -93,7 +202,8 @@ class Logger:
         return self.id, found
 
     def subpackage(self, subid):
-        logger = Logger(subid, self.path, outputfile=self.outputfile)
+        logger = Logger(subid, self.path, outputfile=self.outputfile,
+                maxlogsize=self.maxlogsize)
         self.subpackages.append((subid, logger))
         return logger
 
@@ -0,0 +1,224 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Mount table index and mount syscalls used by the superuser agent
+"""
+import os
+import re
+import errno
+import select
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.mount")
+
+MOUNTINFO = "/proc/self/mountinfo"
+
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOEXEC = 8
+MS_SYNCHRONOUS = 16
+MS_NOATIME = 1024
+MS_NODIRATIME = 2048
+MS_BIND = 4096
+MS_REC = 16384
+MS_RELATIME = 1 << 21
+MNT_DETACH = 2
+
+FLAG_OPTIONS = {"ro": MS_RDONLY, "nosuid": MS_NOSUID, "nodev": MS_NODEV,
+        "noexec": MS_NOEXEC, "sync": MS_SYNCHRONOUS, "noatime": MS_NOATIME,
+        "nodiratime": MS_NODIRATIME, "relatime": MS_RELATIME}
+IGNORED_OPTIONS = frozenset(("defaults", "rw", "suid", "dev", "exec",
+    "async", "auto", "noauto", "user", "nouser"))
+
+class MountError(Error):
+    pass
+
+_escape_re = re.compile(r"\\([0-7]{3})")
+
+def unescape(field):
+    """Decodes the octal escapes used by the kernel in mount tables"""
+    return _escape_re.sub(lambda m: chr(int(m.group(1), 8)), field)
+
+class MountEntry:
+
+    def __init__(self, mountid, parentid, mountpoint, fstype, source,
+            options):
+        self.mountid = mountid
+        self.parentid = parentid
+        self.mountpoint = mountpoint
+        self.fstype = fstype
+        self.source = source
+        self.options = options
+
+def parse_mountinfo(lines):
+    """Parses the lines in the format of /proc/self/mountinfo"""
+    for line in lines:
+        fields = line.split()
+        try:
+            sep = fields.index("-", 6)
+            entry = MountEntry(int(fields[0]), int(fields[1]),
+                    os.path.abspath(unescape(fields[4])), fields[sep + 1],
+                    unescape(fields[sep + 2]), fields[5])
+        except (ValueError, IndexError):
+            logger.debug("invalid mountinfo line: %r", line)
+            continue
+        yield entry
+
+def parse_options(rawoptions):
+    """Converts fstab options to mount flags and filesystem data"""
+    flags = 0
+    data = []
+    for option in rawoptions.split(","):
+        option = option.strip()
+        if not option or option in IGNORED_OPTIONS:
+            continue
+        flag = FLAG_OPTIONS.get(option)
+        if flag is not None:
+            flags |= flag
+        else:
+            data.append(option)
+    return flags, ",".join(data)
+
+_libc = None
+
+def libc():
+    """Returns the C library loaded with ctypes, or None when the mount
+    syscalls are not available"""
+    global _libc
+    if _libc is None:
+        try:
+            import ctypes
+            import ctypes.util
+            name = ctypes.util.find_library("c")
+            lib = ctypes.CDLL(name, use_errno=True)
+            lib.mount, lib.umount2
+        except (ImportError, OSError, AttributeError), e:
+            logger.debug("mount syscalls not available: %s", e)
+            _libc = False
+        else:
+            _libc = lib
+    return _libc or None
+
+def _check(result, what, path):
+    if result != 0:
+        import ctypes
+        err = ctypes.get_errno()
+        raise MountError, ("failed to %s %s: %s" % (what, path,
+            os.strerror(err)))
+
+def mount(source, target, fstype, rawoptions="defaults", bind=False):
+    lib = libc()
+    if bind:
+        flags = MS_BIND | MS_REC
+        fstype = None
+        data = None
+    else:
+        flags, data = parse_options(rawoptions)
+    _check(lib.mount(source, target, fstype, flags, data or None),
+            "mount", target)
+
+def umount(target, detach=False):
+    lib = libc()
+    flags = 0
+    if detach:
+        flags |= MNT_DETACH
+    _check(lib.umount2(target, flags), "umount", target)
+
+class MountTable:
+    """Index of the mount table
+
+    The table is only parsed again when the kernel reports that it has
+    changed, and the mounts done through this object update it directly.
+    """
+
+    def __init__(self, path=MOUNTINFO):
+        self.path = path
+        self.file = None
+        self.poller = None
+        self.mounts = {}
+        self.byroot = {}
+
+    def _open(self):
+        try:
+            self.file = open(self.path)
+        except EnvironmentError, e:
+            raise MountError, "%s is needed when mounting: %s" % (self.path,
+                    e)
+        self.poller = select.poll()
+        self.poller.register(self.file.fileno(),
+                select.POLLPRI | select.POLLERR)
+
+    def _changed(self):
+        events = self.poller.poll(0)
+        return any(mask & (select.POLLPRI | select.POLLERR)
+                for _, mask in events)
+
+    def refresh(self, force=False):
+        if self.file is None:
+            self._open()
+            force = True
+        if self._changed() or force:
+            self.file.seek(0)
+            self.mounts = dict((entry.mountpoint, entry)
+                    for entry in parse_mountinfo(self.file.readlines()))
+            self.byroot.clear()
+            logger.debug("parsed %d entries from %s", len(self.mounts),
+                    self.path)
+
+    def is_mounted(self, path):
+        return os.path.abspath(path) in self.mounts
+
+    def below(self, root):
+        """Mount points inside root, the deepest first"""
+        root = os.path.abspath(root)
+        found = self.byroot.get(root)
+        if found is None:
+            prefix = root + "/"
+            found = [path for path in self.mounts if path.startswith(prefix)]
+            self.byroot[root] = found
+        return sorted(found, key=len, reverse=True)
+
+    def _add(self, path, entry):
+        self.mounts[path] = entry
+        for root, paths in self.byroot.iteritems():
+            if path.startswith(root + "/"):
+                paths.append(path)
+
+    def _remove(self, path):
+        self.mounts.pop(path, None)
+        for paths in self.byroot.itervalues():
+            if path in paths:
+                paths.remove(path)
+
+    def mount(self, source, target, fstype, rawoptions="defaults",
+            bind=False):
+        target = os.path.abspath(target)
+        mount(source, target, fstype, rawoptions, bind)
+        self._add(target, MountEntry(None, None, target, fstype, source,
+            rawoptions))
+
+    def umount(self, target):
+        target = os.path.abspath(target)
+        umount(target)
+        self._remove(target)
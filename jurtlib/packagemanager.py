@@ -26,7 +26,7 @@ import shlex
 import re
 import logging
 import tempfile
-from jurtlib import Error, CommandError, su, cmd
+from jurtlib import Error, CommandError, su, cmd, util
 from jurtlib.registry import Registry
 from jurtlib.configutil import parse_conf_fields
 from jurtlib.template import template_expand
@@ -71,6 +71,26 @@ class PackageManager(object):
     def build_source(self, sourcepath, root, logger, spool):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def snapshot(self, root, username):
+        """Returns an opaque object describing the packages installed in
+        the root, to be used with rollback()"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def rollback(self, root, username, snapshot, logstore):
+        """Removes the packages installed after snapshot() was called
+
+        Returns False when the root cannot be brought back to the state of
+        the snapshot.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reset_build_dirs(self, root, homedir, username):
+        """Removes the files left by a previous build in homedir"""
+        raise NotImplementedError
+
     @abc.abstractmethod
     def repos_from_config(self, configstr):
         """Parses a configuration line and converts it to a Repository()"""
@@ -105,7 +125,8 @@ class URPMIRepos(Repos):
     def __init__(self, configline, listmediascmd, ignoremediasexpr):
         self.listmediascmd = listmediascmd
         self.ignoremediasexpr = ignoremediasexpr
-        if configline.strip() == self.use_from_system_line:
+        self.fromsystem = configline.strip() == self.use_from_system_line
+        if self.fromsystem:
             self._medias = None
         else:
             self._medias = self.parse_conf(configline)
@@ -183,6 +204,7 @@ class RPMBasedPackageManager(PackageManager):
         self.collectglob = shlex.split(pmconf.rpm_collect_glob)
         self.genhdlistcmd = shlex.split(pmconf.genhdlist_command)
         self.rpmarchcmd = shlex.split(pmconf.rpm_get_arch_command)
+        self.systemarch = None
         self.rpmtopdir = pmconf.rpm_topdir.strip()
         self.rpmsubdirs = shlex.split(pmconf.rpm_topdir_subdirs)
         self.rpmmacros = pmconf.rpm_macros_file.strip()
@@ -191,6 +213,7 @@ class RPMBasedPackageManager(PackageManager):
         if self.packager == "undefined":
             self.packager = None
         self.rpmlistpkgs = shlex.split(pmconf.rpm_list_packages_command)
+        self.rpmlistinstalled = shlex.split(pmconf.rpm_list_installed_command)
         self.allowedrpmcmds = shlex.split(pmconf.interactive_allowed_rpm_commands)
         self.extramacros = split_extra_macros(pmconf.rpm_build_macros,
                 "rpm-build-macros")
@@ -250,8 +273,11 @@ class RPMBasedPackageManager(PackageManager):
         self.get_source_info(path)
 
     def system_arch(self):
-        output, _ = cmd.run(self.rpmarchcmd)
-        return output.strip()
+        # asked for every command run in the roots by the agent
+        if self.systemarch is None:
+            output, _ = cmd.run(self.rpmarchcmd)
+            self.systemarch = output.strip()
+        return self.systemarch
 
     def valid_binary(self, path):
         if not path.endswith(".rpm") or path.endswith(".src.rpm"):
@@ -308,6 +334,64 @@ class RPMBasedPackageManager(PackageManager):
         finally:
             outputlogger.close()
 
+    def snapshot(self, root, username):
+        args = self.rpmlistinstalled[:]
+        installed = set()
+        def add(line):
+            # lines are in the format "name fullname", far shorter than
+            # su.MAX_LINE_SIZE, anything else is not from rpm --qf
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                installed.add(tuple(fields))
+            elif fields:
+                logger.warn("unexpected line listing the installed "
+                        "packages: %r", line[:80])
+        try:
+            root.su().run_as(args, user=username, quiet=True,
+                    linehandler=add)
+        except su.CommandError, e:
+            raise PackageManagerError, ("failed to list the packages "
+                    "installed in the root: %s" % (e))
+        return frozenset(installed)
+
+    def remove(self, packages, root, logstore):
+        raise NotImplementedError
+
+    def rollback(self, root, username, snapshot, logstore):
+        current = self.snapshot(root, username)
+        if snapshot - current:
+            logger.debug("packages from the base root were upgraded or "
+                    "removed: %s", " ".join(fullname for _, fullname in
+                        (snapshot - current)))
+            return False
+        installed = current - snapshot
+        if installed:
+            logger.debug("removing %d packages installed for the last "
+                    "build", len(installed))
+            try:
+                self.remove(sorted(installed), root, logstore)
+            except PackageManagerError, e:
+                logger.warn("%s", e)
+                return False
+        return True
+
+    def reset_build_dirs(self, root, homedir, username):
+        topdir = self._topdir(homedir)
+        args = ["rm", "-rf"]
+        args.extend(os.path.join(topdir, name) for name in self.rpmsubdirs)
+        try:
+            root.su().run_as(args, user=username, quiet=True)
+        except su.CommandError, e:
+            raise PackageManagerError, ("failed to remove the build "
+                    "directories: %s" % (e))
+
+    def missing_build_deps(self, deps, repos):
+        """Build dependencies that cannot be satisfied from repos
+
+        Returns an empty list when it cannot be known without a root.
+        """
+        return []
+
     def fix_build_deps(self, deps):
         newdeps = []
         for dep in deps:
@@ -325,13 +409,11 @@ class RPMBasedPackageManager(PackageManager):
 
     def list_build_deps_oldrpm(self, srcpkgpath, root, builduser, homedir,
             outputlogger):
+        exprs = [os.path.join(homedir, baseexpr)
+                for baseexpr in self.collectglob]
         def list_srpms():
-            all = set()
-            for baseexpr in self.collectglob:
-                expr = os.path.join(homedir, baseexpr)
-                all.update(path for path in root.glob(expr)
-                                    if path.endswith(".src.rpm"))
-            return all
+            return set(path for path, size, mtime in root.find(exprs)
+                    if path.endswith(".src.rpm"))
         args = self.rpmrecreatesrpm[:]
         args.append(srcpkgpath)
         before = list_srpms()
@@ -345,10 +427,10 @@ class RPMBasedPackageManager(PackageManager):
         after = list_srpms()
         args = self.rpmbuildreqsrpm[:]
         args.extend(after.difference(before))
+        deps = []
         try:
-            output = root.su().run_as(args, user=builduser, quiet=True,
-                    ignorestderr=True)
-            deps = output.splitlines()
+            root.su().run_as(args, user=builduser, quiet=True,
+                    ignorestderr=True, linehandler=deps.append)
         except su.CommandError, e:
             raise PackageManagerError, ("failed to query build "
                     "dependecies: %s" % (e))
@@ -358,9 +440,10 @@ class RPMBasedPackageManager(PackageManager):
             outputlogger):
         args = self.rpmbuildreqspec[:]
         args.append(srcpkgpath)
+        deps = []
         try:
-            output = root.su().run_as(args, user=builduser, quiet=True)
-            deps = output.splitlines()
+            root.su().run_as(args, user=builduser, quiet=True,
+                    linehandler=deps.append)
         except su.CommandError, e:
             if "unknown option" in e.output:
                 logger.debug("%r failed with %r, so we will have to "
@@ -406,9 +489,13 @@ class RPMBasedPackageManager(PackageManager):
             outputlogger.close()
         found = []
         if success:
-            for basexpr in self.collectglob:
-                globexpr = os.path.join(homedir, basexpr)
-                found.extend(root.glob(globexpr))
+            # all the globs in a single pass over the build directories
+            collected = root.find([os.path.join(homedir, basexpr)
+                for basexpr in self.collectglob])
+            found = [path for path, size, mtime in collected]
+            logger.debug("collected %d files, %s", len(found),
+                    util.format_size(sum(size for path, size, mtime
+                        in collected)))
         return None, success, found
 
 class URPMIPackageManager(RPMBasedPackageManager):
@@ -419,17 +506,39 @@ class URPMIPackageManager(RPMBasedPackageManager):
         self.addmediacmd = shlex.split(pmconf.urpmiaddmedia_command)
         self.updatecmd = shlex.split(pmconf.urpmi_update_command)
         self.urpmicmd = shlex.split(pmconf.urpmi_command)
+        self.urpmecmd = shlex.split(pmconf.urpme_command)
         self.allowedpmcmds = shlex.split(pmconf.interactive_allowed_urpmi_commands)
         self.urpmifatalexpr = compile_conf_re(pmconf.urpmi_fatal_output,
                                          "urpmi-fatal-output")
         self.ignoremediasexpr = compile_conf_re(pmconf.urpmi_ignore_system_medias,
                                          "urpmi-ignore-system-medias")
         self.listmediascmd = shlex.split(pmconf.urpmi_list_medias_command)
+        self.whatprovidescmd = shlex.split(pmconf.urpmq_whatprovides_command)
+        self.urpmqmissingexpr = compile_conf_re(pmconf.urpmq_missing_output,
+                                         "urpmq-missing-output")
 
     def repos_from_config(self, configstr):
         return URPMIRepos(configstr, self.listmediascmd,
                 self.ignoremediasexpr)
 
+    def missing_build_deps(self, deps, repos):
+        if not repos.fromsystem:
+            # only the urpmi configuration of the host can be queried
+            return []
+        deps = self.fix_build_deps(deps)
+        if not deps:
+            return []
+        args = self.whatprovidescmd[:]
+        args.extend(deps)
+        logger.debug("running %s", args)
+        output, _ = cmd.run(args)
+        missing = []
+        for line in output.splitlines():
+            found = self.urpmqmissingexpr.search(line)
+            if found:
+                missing.append(found.group(1))
+        return missing
+
     def create_root(self, suwrapper, repos, path, logger, interactive):
         mediacmds = []
         for media in repos.medias():
@@ -535,6 +644,20 @@ class URPMIPackageManager(RPMBasedPackageManager):
             raise PackageManagerError, msg + logref
 
 
+    def remove(self, packages, root, logstore):
+        args = ["--auto"]
+        args.extend(fullname for _, fullname in packages)
+        outputlogger = logstore.get_output_handler("remove")
+        try:
+            try:
+                root.su().run_package_manager("urpme", args,
+                        outputlogger=outputlogger)
+            finally:
+                outputlogger.close()
+        except su.CommandError, e:
+            raise PackageManagerError, ("failed to remove packages, see "
+                    "the logs at %s" % (outputlogger.location()))
+
     def update_repository_metadata(self, path):
         # FIXME filedeps!
         args = self.genhdlistcmd[:]
@@ -543,9 +666,9 @@ class URPMIPackageManager(RPMBasedPackageManager):
 
     # executed as root:
     def validate_cmd_args(self, pmtype, args):
-        if pmtype == "urpmi" and not "--auto" in args:
-            raise CommandValidationError, "--auto is missing in urpmi "\
-                    "command line"
+        if pmtype in ("urpmi", "urpme") and not "--auto" in args:
+            raise CommandValidationError, "--auto is missing in %s "\
+                    "command line" % (pmtype)
         absrootsdir = os.path.abspath(self.rootsdir) + "/"
         for i, opt in enumerate(args):
             if opt == "--root" or opt == "--urpmi-root":
@@ -564,6 +687,8 @@ class URPMIPackageManager(RPMBasedPackageManager):
             return self.addmediacmd[:] + args
         elif pmtype == "urpmi.update":
             return self.updatecmd[:] + args
+        elif pmtype == "urpme":
+            return self.urpmecmd[:] + args
         else:
             raise PackageManagerError, "invalid package manager"
 
@@ -586,6 +711,7 @@ class SmartPackageManager(RPMBasedPackageManager):
         self.smartcmd = shlex.split(pmconf.smart_command)
         self.addchannelcmd = shlex.split(pmconf.smart_channel_add_command)
         self.installcmd = shlex.split(pmconf.smart_install_command)
+        self.removecmd = shlex.split(pmconf.smart_remove_command)
         self.updatecmd = shlex.split(pmconf.smart_update_command)
         self.datadir = pmconf.smart_datadir.strip()
         self.allowedsmartcmds = shlex.split(pmconf.interactive_allowed_smart_commands)
@@ -679,6 +805,19 @@ class SmartPackageManager(RPMBasedPackageManager):
     def install(self, packages, root, repos, logstore, logname=None):
         raise NotImplementedError
 
+    def remove(self, packages, root, logstore):
+        args = [name for name, _ in packages]
+        outputlogger = logstore.get_output_handler("remove")
+        try:
+            try:
+                root.su().run_package_manager("smart.remove", args,
+                        outputlogger=outputlogger)
+            finally:
+                outputlogger.close()
+        except su.CommandError, e:
+            raise PackageManagerError, ("failed to remove packages, see "
+                    "the logs at %s" % (outputlogger.location()))
+
     def update_repository_metadata(self, path):
         vars = {"path": path}
         args = [template_expand(arg, vars) for arg in self.spoolupdatecmd[:]]
@@ -702,6 +841,8 @@ class SmartPackageManager(RPMBasedPackageManager):
             return self.addchannelcmd[:] + args
         elif pmtype == "smart.update":
             return self.updatecmd[:] + args
+        elif pmtype == "smart.remove":
+            return self.removecmd[:] + args
         else:
             raise PackageManagerError, "invalid package manager"
 
@@ -0,0 +1,80 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Execution domains (personality(2)) used for building for other arches
+
+Setting the personality in the forked child avoids running setarch for
+every command executed in roots of other arches.
+"""
+import os
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.personality")
+
+PERSONALITIES = {
+        "linux": 0x0000,
+        "linux32": 0x0008,
+        }
+
+class PersonalityError(Error):
+    pass
+
+_personality = None
+
+def _libc_personality():
+    global _personality
+    if _personality is None:
+        try:
+            import ctypes
+            import ctypes.util
+            lib = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fun = lib.personality
+            fun.argtypes = (ctypes.c_ulong,)
+            fun.restype = ctypes.c_int
+        except (ImportError, OSError, AttributeError), e:
+            logger.debug("personality syscall not available: %s", e)
+            fun = False
+        _personality = fun
+    return _personality or None
+
+def available():
+    return _libc_personality() is not None
+
+def personality_value(name):
+    try:
+        return PERSONALITIES[name]
+    except KeyError:
+        raise PersonalityError, "unknown personality: %s" % (name)
+
+def set_personality(value):
+    """Sets the personality of the current process
+
+    Intended to be used as preexec_fn of subprocess.Popen.
+    """
+    fun = _libc_personality()
+    if fun is None:
+        raise PersonalityError, "the personality syscall is not available"
+    if fun(value) == -1:
+        import ctypes
+        raise PersonalityError, ("failed to set personality %#x: %s" %
+                (value, os.strerror(ctypes.get_errno())))
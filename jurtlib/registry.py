@@ -36,6 +36,9 @@ class Registry:
         instance = class_(*args, **kwargs)
         return instance
 
+    def names(self):
+        return self._classes.keys()
+
     def get_class(self, name):
         try:
             class_ = self._classes[name]
@@ -21,12 +21,17 @@
 #
 import abc
 import os
+import errno
+import stat
 import shlex
 import subprocess
 import logging
 import time
-from jurtlib import Error, util
+import threading
+import Queue
+from jurtlib import Error, util, personality
 from jurtlib.registry import Registry
+from jurtlib.rootindex import get_root_index, RootIndexError
 from jurtlib.su import SuChrootWrapper, my_username
 from jurtlib.configutil import parse_bool, parse_conf_fields
 
@@ -48,12 +53,14 @@ class Old:
     pass
 class Tmpfs:
     pass
+class Trash:
+    pass
 
 class DontCare:
     """Whether it must be interactive or not"""
 
 STATE_NAMES = {Temp: "temp", Active: "active", Keep: "keep",
-    Old: "old", Tmpfs: "tmpfs"}
+    Old: "old", Tmpfs: "tmpfs", Trash: "trash"}
 STATE_DIRS = dict((v, k) for k, v in STATE_NAMES.iteritems())
 
 class Root(object):
@@ -65,6 +72,7 @@ class Root(object):
       cannot be removed
     - keep: roots that were pinned and can be reused soon
     - old: can be removed at any time, can go to active state at any time
+    - trash: roots being removed by jurt-clean, never listed
     """
     __metaclass__ = abc.ABCMeta
 
@@ -92,6 +100,12 @@ class Root(object):
     def glob(self, globexpr):
         raise NotImplementedError
 
+    @abc.abstractmethod
+    def find(self, globexprs):
+        """Expands several globs at once, providing (path, size, mtime)
+        of each file found"""
+        raise NotImplementedError
+
     @abc.abstractmethod
     def external_path(self, localpath):
         """Should provide an pointer from the outside world to know how to
@@ -107,7 +121,7 @@ class Root(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def destroy(self):
+    def destroy(self, interactive=False, background=False):
         raise NotImplementedError
 
     @abc.abstractmethod
@@ -135,9 +149,12 @@ class RootManager(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def destroy(self, root):
+    def destroy(self, root, interactive, background=False):
         raise NotImplementedError
 
+    def wait_destroyed(self):
+        """Waits for the roots being destroyed in background"""
+
     @abc.abstractmethod
     def test_sudo(self):
         raise NotImplementedError
@@ -155,7 +172,7 @@ class RootManager(object):
         raise NotImplementedError
 
     @abc.abstractmethod
-    def clean(self):
+    def clean(self, dry_run=False, targetfree=None):
         raise NotImplementedError
 
     def invalidate(self, interactive=DontCare):
@@ -240,7 +257,8 @@ class Chroot(Root):
 
     def make_spool_reachable(self, spool):
         dest = os.path.abspath(self.path + "/" + self.manager.spooldir)
-        self.manager.su().cheapcopy(spool.path, dest)
+        # copies the contents so that an existing copy gets refreshed
+        self.manager.su().cheapcopy(os.path.join(spool.path, "."), dest)
         return ChrootSpool(dest, self.manager.spooldir)
 
     def _strip_path(self, path): 
@@ -250,10 +268,14 @@ class Chroot(Root):
         return os.path.abspath(subpath)
 
     def glob(self, globexpr):
-        import glob
-        expr = os.path.abspath(self.path + "/" + globexpr)
-        found = [self._strip_path(p) for p in glob.glob(expr)]
-        return found
+        return [path for path, size, mtime in self.find([globexpr])]
+
+    def find(self, globexprs):
+        basepath = os.path.abspath(self.path)
+        found = util.find_files(basepath, [os.path.abspath("/" + expr)
+            for expr in globexprs])
+        return [(self._strip_path(os.path.join(basepath, subpath)), size,
+            mtime) for subpath, size, mtime in found]
 
     def external_path(self, localpath):
         return os.path.abspath(self.path + "/" + localpath)
@@ -276,11 +298,77 @@ class Chroot(Root):
         self.manager.su().umount_virtual_filesystems(self.path, self.arch)
         self.manager.deactivate_root(self)
 
-    def destroy(self, interactive=False):
-        self.manager.destroy(self, interactive)
+    def destroy(self, interactive=False, background=False):
+        self.manager.destroy(self, interactive, background)
+
+    def disk_usage(self):
+        size = self.manager.su().disk_usage(self.path)
+        self.manager.note_root_size(self, size)
+        return size
+
+    def max_rss(self, reset=False):
+        """Peak RSS of the commands run since the last reset"""
+        return self.manager.su().max_rss(reset)
+
+class RootReaper:
+    """Destroys roots in a background thread
+
+    It uses its own agent, as the one from the root manager is busy with
+    the build. The roots are already in the trash directory when queued, so
+    the ones not destroyed before the process ends are removed by the next
+    jurt-clean.
+    """
+
+    def __init__(self, suwrapper):
+        self.suwrapper = suwrapper
+        self.queue = Queue.Queue()
+        self.thread = None
+
+    def _run(self):
+        while True:
+            path = self.queue.get()
+            if path is None:
+                break
+            logger.debug("destroying root %s in background", path)
+            try:
+                self.suwrapper.destroy_roots([path])
+            except Error, e:
+                logger.warn("failed to destroy root %s, it will be "
+                        "removed by jurt-clean: %s", path, e)
+        self.suwrapper.stop()
+
+    def put(self, path):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run,
+                    name="root-reaper")
+            self.thread.daemon = True
+            self.thread.start()
+        self.queue.put(path)
+
+    def drain(self):
+        if self.thread is not None:
+            pending = self.queue.qsize()
+            if pending:
+                logger.info("waiting for %d roots to be destroyed", pending)
+            self.queue.put(None)
+            # join() with timeout keeps it interruptible
+            while self.thread.is_alive():
+                self.thread.join(0.5)
+            self.thread = None
 
 class ChrootRootManager(RootManager):
 
+    @classmethod
+    def _parse_arch_personalities(class_, rawvalue):
+        found = {}
+        for arch, name in parse_conf_fields(rawvalue, 2, "arch-personality"):
+            try:
+                found[arch] = personality.personality_value(name)
+            except personality.PersonalityError, e:
+                logger.warn("invalid entry in arch-personality "
+                        "configuration option: %s", e)
+        return found
+
     @classmethod
     def _parse_arch_map(class_, rawmap):
         rawmap = rawmap.strip()
@@ -330,6 +418,15 @@ class ChrootRootManager(RootManager):
         seconds = days * 24 * 60 * 60
         return seconds
 
+    @classmethod
+    def _parse_clean_workers(class_, rawvalue):
+        try:
+            workers = int(rawvalue)
+        except ValueError:
+            logger.warn("invalid value for clean-workers: %r" % (rawvalue))
+            workers = 1
+        return max(workers, 1)
+
     def __init__(self, suwrapper, rootconf, globalconf):
         super(ChrootRootManager, self).__init__()
         self.suwrapper = suwrapper
@@ -342,6 +439,9 @@ class ChrootRootManager(RootManager):
         self.postcmd = rootconf.root_post_command.strip()
         self.arch = rootconf.arch
         self.archmap = self._parse_arch_map(rootconf.arch_map)
+        self.useexecutor = parse_bool(rootconf.chroot_executor)
+        self.archpersonalities = self._parse_arch_personalities(
+                rootconf.arch_personality)
         self.allowshell = parse_bool(rootconf.allow_interactive_shell)
         self.latestsuffix_build = rootconf.latest_build_suffix
         self.latestsuffix_interactive = rootconf.latest_interactive_suffix
@@ -354,16 +454,31 @@ class ChrootRootManager(RootManager):
         self.binds = self._parse_binds(rootconf.chroot_binds)
         self.devs = self._parse_devs(rootconf.chroot_devs)
         self.maxrootage = self._parse_max_root_age(rootconf.root_max_age)
+        self.cleanworkers = self._parse_clean_workers(rootconf.clean_workers)
+        self.asyncdestroy = parse_bool(rootconf.async_root_destroy)
+        self.reaper = None
         self.remountcmd = shlex.split(rootconf.chroot_remount_wrapper_command)
         self.chrootcmd = shlex.split(rootconf.chroot_command)
         self.sucmd = shlex.split(rootconf.su_command)
         self.sudointcmd = shlex.split(rootconf.sudo_interactive_shell_command)
         self.intshellcmd = rootconf.interactive_shell_command # template!
         self.targetname = rootconf.target_name
+        self.index = get_root_index(rootconf.root_index_file.strip())
 
     def su(self):
         return self.suwrapper
 
+    def sibling(self):
+        """Returns a copy of the manager with its own agent, to be used
+        from another thread"""
+        import copy
+        other = copy.copy(self)
+        other.suwrapper = self.suwrapper.sibling()
+        other.reaper = None
+        if self.index is not None:
+            other.index = get_root_index(self.index.path)
+        return other
+
     def _copy_files_from_conf(self, root):
         for path in self.copyfiles:
             root.copy_in(path, os.path.dirname(path))
@@ -400,6 +515,17 @@ class ChrootRootManager(RootManager):
             cmd.extend(found)
         return cmd
 
+    # run as root
+    def arch_personality(self, from_, to):
+        """The personality used for running commands of the arch to
+
+        Returns None when setarch_command() must be used instead.
+        """
+        value = self.archpersonalities.get(to)
+        if value is not None and personality.available():
+            return value
+        return None
+
     def _root_arch(self, packagemanager):
         if self.arch == "host":
             arch = packagemanager.system_arch()
@@ -475,29 +601,93 @@ class ChrootRootManager(RootManager):
     def _old_path(self, name):
         return self._state_path(self._state_to_dir(Old), name)
 
+    def _trash_path(self, name):
+        return self._state_path(self._state_to_dir(Trash), name)
+
     def _state_to_dir(self, state):
         return STATE_NAMES[state]
 
     def _dir_to_state(self, dirname):
         return STATE_DIRS[dirname]
 
+    def _scan_roots(self, states=(Active, Old, Keep, Temp)):
+        """Provides (name, state name, kind, timestamp, size) of the roots
+        found in the state directories, the size is never known"""
+        for state in states:
+            path = self._root_path(state, "") # duh!
+            if os.path.exists(path):
+                try:
+                    names = os.listdir(path)
+                except EnvironmentError, e:
+                    logger.warn("failed to list directory: %s", e)
+                else:
+                    for name in names:
+                        rootpath = os.path.abspath(os.path.join(path, name))
+                        if name.startswith("."):
+                            continue
+                        try:
+                            st = os.stat(rootpath)
+                        except EnvironmentError:
+                            continue
+                        if stat.S_ISDIR(st.st_mode):
+                            interactive = self._is_interactive(rootpath)
+                            kind = ("build", "interactive")[interactive]
+                            yield (name, STATE_NAMES[state], kind,
+                                    st.st_ctime, None)
+
+    def _loaded_index(self):
+        if self.index is None:
+            return None
+        try:
+            self.index.load(self._scan_roots)
+        except RootIndexError, e:
+            logger.warn("not using the root index: %s", e)
+            return None
+        return self.index
+
+    def _index_set(self, root):
+        if self.index is not None:
+            name = os.path.basename(root.path)
+            statename = os.path.basename(os.path.dirname(root.path))
+            kind = ("build", "interactive")[bool(root.interactive)]
+            self.index.set(name, statename, kind)
+
+    def note_root_size(self, root, size):
+        if self.index is not None:
+            self.index.set_size(os.path.basename(root.path), size)
+
+    def _index_remove(self, rootpath):
+        if self.index is not None:
+            self.index.remove(os.path.basename(rootpath))
+
     def _existing_root(self, name, required=False, interactive=False):
         if name == "latest":
-            state_and_path = self._resolve_latest_link(interactive)
-        else:
-            statedirs = ((Active, self._active_path(name)),
-                    (Keep, self._keep_path(name)),
-                    (Old, self._old_path(name)),
-                    (Temp, self._temp_path(name)))
-            for state, dir in statedirs:
-                if os.path.exists(dir):
-                    state_and_path = state, dir
-                    break
-            else:
-                if required:
-                    raise ChrootError, "root not found: %s" % (name)
-                state_and_path = None, None
-        return state_and_path
+            return self._resolve_latest_link(interactive)
+        index = self._loaded_index()
+        if index is not None:
+            entry = index.lookup(name)
+            if entry is not None:
+                path = self._state_path(entry[0], name)
+                if os.path.isdir(path):
+                    return self._dir_to_state(entry[0]), path
+        statedirs = ((Active, self._active_path(name)),
+                (Keep, self._keep_path(name)),
+                (Old, self._old_path(name)),
+                (Temp, self._temp_path(name)))
+        for state, dir in statedirs:
+            if os.path.exists(dir):
+                if index is not None and state is not Temp:
+                    logger.debug("root %s was missing from the index",
+                            name)
+                    # dated as _scan_roots does, not to reset its age
+                    index.set(name, STATE_NAMES[state],
+                            ("build", "interactive")[
+                                self._is_interactive(dir)],
+                            os.stat(dir).st_ctime)
+                return state, dir
+        if required:
+            raise ChrootError, "root not found: %s" % (name)
+        return None, None
 
     def _check_state_dirs(self):
         for m in (self._active_path, self._temp_path, self._keep_path,
@@ -537,6 +727,7 @@ class ChrootRootManager(RootManager):
         logger.debug("moving root from %s to %s", root.path, dest)
         self.su().rename(root.path, dest)
         root.path = dest
+        self._index_set(root)
 
     def _is_interactive(self, rootpath):
         checkpath = os.path.abspath(rootpath + os.path.sep +
@@ -617,27 +808,20 @@ class ChrootRootManager(RootManager):
                 fail=False)
         _, buildlatest = self._resolve_latest_link(interactive=False,
                 fail=False)
-        for state in states:
-            path = self._root_path(state, "") # duh!
-            if os.path.exists(path):
-                try:
-                    names = os.listdir(path)
-                except EnvironmentError, e:
-                    logger.warn("failed to list directory: %s", e)
-                else:
-                    for name in names:
-                        rootpath = os.path.abspath(os.path.join(path, name))
-                        if (not name.startswith(".") and
-                                os.path.isdir(rootpath)):
-                            interactive = self._is_interactive(rootpath)
-                            latest = (intlatest == rootpath
-                                    or buildlatest == rootpath)
-                            kind = ("build", "interactive")[interactive]
-                            statename = STATE_NAMES[state]
-                            yield name, rootpath, kind, statename, latest
+        index = self._loaded_index()
+        if index is not None:
+            statenames = set(STATE_NAMES[state] for state in states)
+            found = [entry for entry in index.roots()
+                    if entry[1] in statenames]
+        else:
+            found = self._scan_roots(states)
+        for name, statename, kind, timestamp, size in found:
+            rootpath = os.path.abspath(self._state_path(statename, name))
+            latest = (intlatest == rootpath or buildlatest == rootpath)
+            yield name, rootpath, kind, statename, latest, timestamp, size
 
     def list_roots(self):
-        for name, rootpath, kind, state, latest in self._list_chroots():
+        for name, _, kind, state, latest, _, _ in self._list_chroots():
             yield name, kind, state, latest
 
     def guess_target_name(self, name, interactive=False):
@@ -656,13 +840,20 @@ class ChrootRootManager(RootManager):
                             "inside chroot on %s: %s" % (confpath, e))
         return found
 
-    def destroy(self, root, interactive):
+    def destroy(self, root, interactive, background=False):
         if root.state is not Old:
             raise RootError, ("cannot destroy a root that is still "
                     "active: %s" % (root.path))
-        self.su().destroy_root(root.path)
         _, latestpath = self._resolve_latest_link(interactive, fail=False)
-        if os.path.abspath(root.path) == latestpath:
+        rootpath = os.path.abspath(root.path)
+        if background and self.asyncdestroy:
+            if self.reaper is None:
+                self.reaper = RootReaper(self.su().sibling())
+            self.reaper.put(self._move_to_trash(root.path))
+        else:
+            self.su().destroy_root(root.path)
+            self._index_remove(root.path)
+        if rootpath == latestpath:
             lpath = self._latest_path(interactive)
             logger.debug("removing -latest link as the pointed root was "
                     "destroyed: %s", lpath)
@@ -671,28 +862,158 @@ class ChrootRootManager(RootManager):
             except EnvironmentError, e:
                 logger.warn("failed to remove the latest link: %s" % (e))
 
+    def wait_destroyed(self):
+        if self.reaper is not None:
+            self.reaper.drain()
+
     def is_old(self, timestamp):
         age = time.time() - timestamp
         return age > self.maxrootage
 
-    def clean(self, dry_run=False):
-        for name, rootpath, _, _, latest in self._list_chroots(states=(Old,)):
+    def _trash_owner_alive(self, name):
+        # trashed roots are named name.pid.timestamp
+        fields = name.rsplit(".", 2)
+        if len(fields) != 3:
+            return False
+        try:
+            pid = int(fields[1])
+        except ValueError:
+            return False
+        if pid == os.getpid():
+            # still queued in our reaper, or a sibling manager's
+            return True
+        try:
+            os.kill(pid, 0)
+        except OSError, e:
+            return e.errno == errno.EPERM
+        return True
+
+    def _trashed_roots(self):
+        """Roots left in the trash by interrupted runs"""
+        trashdir = self._trash_path("")
+        try:
+            names = os.listdir(trashdir)
+        except EnvironmentError, e:
+            logger.debug("failed to list trash directory: %s", e)
+            return []
+        found = []
+        for name in names:
+            if self._trash_owner_alive(name):
+                logger.debug("%s is still being destroyed by another "
+                        "process", name)
+            else:
+                found.append(os.path.join(trashdir, name))
+        return found
+
+    def _move_to_trash(self, rootpath):
+        trashdir = self._trash_path("")
+        if not os.path.exists(trashdir):
+            self.su().mkdir(trashdir)
+        # the same root name may have been trashed before and not removed
+        name = "%s.%d.%d" % (os.path.basename(rootpath), os.getpid(),
+                time.time() * 1000)
+        dest = self._trash_path(name)
+        logger.debug("moving root %s to trash at %s", rootpath, dest)
+        self.su().rename(rootpath, dest)
+        self._index_remove(rootpath)
+        return dest
+
+    def _empty_trash(self, paths):
+        trashdir = self._trash_path("")
+        before = util.free_space(trashdir)
+        start = time.time()
+        logger.debug("removing %d roots using %d workers", len(paths),
+                self.cleanworkers)
+        self.su().destroy_roots(paths)
+        elapsed = time.time() - start
+        reclaimed = max(util.free_space(trashdir) - before, 0)
+        logger.info("removed %d roots in %.1fs, reclaimed %s (%s/s)",
+                len(paths), elapsed, util.format_size(reclaimed),
+                util.format_size(reclaimed / max(elapsed, 0.001)))
+
+    def _root_size(self, name, rootpath, size):
+        if size is None:
             try:
-                timestamp = os.stat(rootpath).st_ctime
-            except EnvironmentError, e:
-                logger.error("failed to stat the directory %s: %s" %
-                        (rootpath, e))
-                continue
-            if self.is_old(timestamp):
-                if latest:
+                size = self.su().disk_usage(rootpath)
+            except Error, e:
+                logger.warn("failed to measure the size of %s: %s",
+                        rootpath, e)
+                return 0
+            if self.index is not None:
+                self.index.set_size(name, size)
+        return size
+
+    def _evict(self, roots, targetfree, expected, dry_run, trashed):
+        """Picks the least recently used roots until targetfree bytes are
+        expected to be free"""
+        free = util.free_space(self._old_path("")) + expected
+        if free >= targetfree:
+            logger.info("%s free, no roots need to be evicted",
+                    util.format_size(free))
+            return
+        for timestamp, name, rootpath, size in sorted(roots):
+            if free >= targetfree:
+                break
+            size = self._root_size(name, rootpath, size)
+            logger.debug("evicting %s to free %s", rootpath,
+                    util.format_size(size))
+            yield name, timestamp
+            if not dry_run:
+                try:
+                    trashed.append(self._move_to_trash(rootpath))
+                except Error, e:
+                    # it may have just been taken by someone else
+                    logger.warn("failed to evict %s: %s", rootpath, e)
+                    continue
+            free += size
+        if free < targetfree:
+            logger.warn("only %s are expected to be free after removing "
+                    "all the old roots", util.format_size(free))
+
+    def clean(self, dry_run=False, targetfree=None):
+        """Removes the old roots
+
+        Roots are first renamed into the trash directory, so that they
+        disappear from listings at once, and then destroyed in parallel by
+        the agent.
+
+        When targetfree is set, the least recently used roots are also
+        removed until targetfree bytes are free in the roots directory.
+        """
+        trashed = []
+        if not dry_run:
+            trashed.extend(self._trashed_roots())
+        recent = []
+        expected = 0
+        for name, rootpath, _, _, latest, timestamp, size in \
+                self._list_chroots(states=(Old,)):
+            if latest:
+                if self.is_old(timestamp):
                     logger.debug("root %s is old, but is marked as "
                             "'latest' and will not be removed", rootpath)
-                else:
-                    logger.debug("root at %s has timestamp %s and will be "
-                            "destroyed", rootpath, timestamp)
-                    yield name, timestamp
-                    if not dry_run:
-                        self.su().destroy_root(rootpath)
+            elif self.is_old(timestamp):
+                logger.debug("root at %s has timestamp %s and will be "
+                        "destroyed", rootpath, timestamp)
+                yield name, timestamp
+                if not dry_run:
+                    try:
+                        trashed.append(self._move_to_trash(rootpath))
+                    except Error, e:
+                        # a stale index entry or removed by someone else
+                        logger.warn("failed to remove %s: %s", rootpath, e)
+                elif size is not None:
+                    expected += size
+            else:
+                recent.append((timestamp, name, rootpath, size))
+        if trashed:
+            self._empty_trash(trashed)
+        if targetfree is not None:
+            trashed = []
+            for info in self._evict(recent, targetfree, expected, dry_run,
+                    trashed):
+                yield info
+            if trashed:
+                self._empty_trash(trashed)
 
     def keep(self, id, packagemanager):
         root = self.get_root_by_name(id, packagemanager)
@@ -737,6 +1058,10 @@ class ChrootRootManager(RootManager):
     def root_destroy_command(self):
         return self.destroycmd[:]
 
+    # run as root
+    def clean_workers(self):
+        return self.cleanworkers
+
     # run as root
     def mount_points(self):
         for mountinfo in self.mountpoints:
@@ -844,49 +1169,151 @@ class CompressedChrootManager(CachedManagerMixIn, ChrootRootManager):
         return self.decompress_command + [tarfile, "-C", root, "."]
 
 class TmpfsChrootManager(CompressedChrootManager):
+    """Roots unpacked from the cached root into a tmpfs
+
+    The tmpfs is sized from the size of the cached root plus the space
+    expected to be used by the build. When the host does not have that
+    much memory available, the root is created on disk as done by
+    chroot-with-cache.
+    """
+
+    @classmethod
+    def _parse_megabytes(class_, rawvalue, name):
+        try:
+            return int(float(rawvalue) * 1024 * 1024)
+        except ValueError:
+            raise RootError, "invalid value for %s: %r" % (name, rawvalue)
 
     def __init__(self, suwrapper, rootconf, globalconf):
         super(TmpfsChrootManager, self).__init__(suwrapper, rootconf,
                 globalconf)
         self.mountcmd = shlex.split(rootconf.tmpfs_mount_command)
         self.umountcmd = shlex.split(rootconf.tmpfs_umount_command)
-
-    def _root_path(self, state, name):
-        "Always returns roots inside the 'active' state"
-        return self._state_path(self.activestatedir, name)
+        self.packagespace = self._parse_megabytes(rootconf.tmpfs_package_space,
+                "tmpfs-package-space")
+        self.minfreememory = self._parse_megabytes(
+                rootconf.tmpfs_min_free_memory, "tmpfs-min-free-memory")
+        try:
+            self.compressratio = float(rootconf.tmpfs_compression_ratio)
+        except ValueError:
+            raise RootError, ("invalid value for tmpfs-compression-ratio: "
+                    "%r" % (rootconf.tmpfs_compression_ratio))
 
     def get_root_by_name(self, *args, **kwargs):
         raise ChrootError, ("the root type chroot-with-tmpfs never allows "
                 "using an existing root")
 
-    def create_new(self, name, packagemanager, repos, logstore,
-            interactive=False):
-        rootpath = self._root_path(Tmpfs, name)
+    def _size_path(self, cachepath):
+        return cachepath + ".size"
+
+    def _record_root_size(self, root, cachepath):
+        # measured by the agent, as parts of the root are only readable by
+        # the superuser
+        try:
+            size = root.disk_usage()
+        except Error, e:
+            logger.warn("failed to measure the size of the cached root: %s",
+                    e)
+            return
         try:
-            exists = os.path.exists(rootpath)
+            with open(self._size_path(cachepath), "w") as f:
+                f.write("%d\n" % (size))
         except EnvironmentError, e:
-            raise ChrootError, ("failed to verify if directory %s "
-                    "exists: %s" % (rootpath, e))
-        if not exists:
-            self.su().mkdir(rootpath)
-        self.su().mount_tmpfs(rootpath)
-        return super(TmpfsChrootManager, self).create_new(name,
+            logger.warn("failed to record the size of the cached root: %s",
+                    e)
+        else:
+            logger.debug("cached root at %s uses %s", root.path,
+                    util.format_size(size))
+
+    def _cached_root_size(self, cachepath):
+        try:
+            with open(self._size_path(cachepath)) as f:
+                return int(f.read().strip())
+        except (EnvironmentError, ValueError), e:
+            logger.debug("no usable recorded size for %s: %s", cachepath, e)
+        return int(os.path.getsize(cachepath) * self.compressratio)
+
+    def _create_on_disk(self, name, packagemanager, repos, logstore,
+            interactive, reason):
+        logger.info("creating root %s on disk: %s", name, reason)
+        cachepath = self._cache_path(interactive)
+        created = not os.path.exists(cachepath)
+        root = CompressedChrootManager.create_new(self, name,
                 packagemanager, repos, logstore, interactive)
+        if created:
+            self._record_root_size(root, cachepath)
+        root.tmpfs = False
+        return root
+
+    def create_new(self, name, packagemanager, repos, logstore,
+            interactive=False):
+        self._check_new_root_name(name)
+        cachepath = self._cache_path(interactive)
+        if not os.path.exists(cachepath):
+            return self._create_on_disk(name, packagemanager, repos,
+                    logstore, interactive, "there is no cached root yet")
+        rootsize = self._cached_root_size(cachepath)
+        size = rootsize + self.packagespace
+        available = util.memory_available()
+        if available is not None and size > available - self.minfreememory:
+            return self._create_on_disk(name, packagemanager, repos,
+                    logstore, interactive, "%s needed but only %s of "
+                    "memory available" % (util.format_size(size),
+                        util.format_size(available)))
+        logger.info("creating root %s in a tmpfs of %s (%s for the cached "
+                "root, %s for the build)", name, util.format_size(size),
+                util.format_size(rootsize),
+                util.format_size(self.packagespace))
+        # tmpfs roots never move, as mount points cannot be renamed
+        rootpath = self._active_path(name)
+        if not os.path.exists(rootpath):
+            self.su().mkdir(rootpath)
+        self.su().mount_tmpfs(rootpath, size)
+        try:
+            self.suwrapper.decompress_root(cachepath, rootpath)
+        except:
+            self.su().umount_tmpfs(rootpath)
+            self.su().destroy_root(rootpath)
+            raise
+        root = Chroot(self, rootpath, self._root_arch(packagemanager),
+                interactive=interactive)
+        root.tmpfs = True
+        return root
+
+    def _is_tmpfs(self, root):
+        return getattr(root, "tmpfs", False)
 
     def activate_root(self, root):
-        "Nothing to do"
+        if self._is_tmpfs(root):
+            root.state = Active
+            self._update_latest_link(root.state, root.path,
+                    root.interactive)
+            self._index_set(root)
+        else:
+            super(TmpfsChrootManager, self).activate_root(root)
 
     def deactivate_root(self, root):
-        self.su().umount_tmpfs(root.path)
-        # it should be empty:
-        self.su().destroy_root(root.path)
+        if self._is_tmpfs(root):
+            self.su().umount_tmpfs(root.path)
+            # it should be empty:
+            self.su().destroy_root(root.path)
+            self._index_remove(root.path)
+            root.state = Old
+        else:
+            super(TmpfsChrootManager, self).deactivate_root(root)
 
-    def destroy(self, root, interactive):
-        "Nothing to do"
+    def destroy(self, root, interactive, background=False):
+        if self._is_tmpfs(root):
+            # everything went away with the umount
+            return
+        super(TmpfsChrootManager, self).destroy(root, interactive,
+                background)
 
     # run as root
-    def mount_root_command(self, path):
+    def mount_root_command(self, path, size=None):
         cmd = self.mountcmd[:]
+        if size is not None:
+            cmd.extend(("-o", "size=%d" % (size)))
         cmd.append(path)
         return cmd
 
@@ -896,9 +1323,6 @@ class TmpfsChrootManager(CompressedChrootManager):
         cmd.append(path)
         return cmd
 
-    def list_roots(self):
-        return iter([])
-
 class BtrfsChrootManager(CachedManagerMixIn, ChrootRootManager):
 
     def __init__(self, suwrapper, rootconf, globalconf):
@@ -935,6 +1359,16 @@ root_managers.register("chroot-with-cache", CompressedChrootManager)
 root_managers.register("chroot-with-btrfs", BtrfsChrootManager)
 root_managers.register("chroot-with-tmpfs", TmpfsChrootManager)
 
+def ids_in_use(rootmanagers):
+    """Names of the roots of rootmanagers that are not old
+
+    Spools and logs are named after the build ids, as the roots are, so
+    these are the ones that must not be collected.
+    """
+    return set(name for rootmanager in rootmanagers
+            for name, kind, state, latest in rootmanager.list_roots()
+            if state != "old")
+
 def get_root_manager(suwrapper, rootconf, globalconf):
     instance = root_managers.get_instance(rootconf.root_type, suwrapper,
             rootconf, globalconf)
@@ -27,13 +27,15 @@ import shlex
 from jurtlib import Error, CommandError
 from jurtlib.command import JurtCommand, CliError
 from jurtlib.root import ChrootRootManager
-
-PROC_MOUNTS = "/proc/mounts"
+from jurtlib import mount, fileops, util, personality
+from jurtlib.executor import ChrootExecutor, ExecutorError
 
 class RootCommand(JurtCommand):
 
     descr = "Runs a command privilleged user"
     usage = "%prog -t TYPE [options]"
+    mounttable = None
+    executors = None
 
     def init_parser(self, parser):
         super(RootCommand, self).init_parser(parser)
@@ -115,7 +117,10 @@ class RootCommand(JurtCommand):
                             sys.stderr.write("\n%sERROR %s\n" %
                                     (cookiepart, e))
                         else:
-                            sys.stderr.write("\n%sOK\n" % (cookiepart))
+                            results = "".join(" %s=%s" % item
+                                    for item in sorted(self.results.items()))
+                            sys.stderr.write("\n%sOK%s\n" % (cookiepart,
+                                results))
                         sys.stderr.flush()
                     except IOError, e:
                         if e.errno == 32: # broken pipe
@@ -126,6 +131,8 @@ class RootCommand(JurtCommand):
         if not self.opts.type:
             raise CliError, "--type is mandatory"
         mname = "cmd_" + self.opts.type
+        # reported to the agent client in the OK line
+        self.results = {}
         try:
             getattr(self, mname)()
         except AttributeError:
@@ -160,18 +167,103 @@ class RootCommand(JurtCommand):
             return f(self)
         return w
 
+    def _executor(self):
+        """Returns the executor for the root and user of the command
+
+        Returns None when the command cannot be run by an executor.
+        """
+        manager = self.target.rootmanager
+        if (not (self.opts.agent and manager.useexecutor)
+                or self.opts.remount or self.opts.dry_run):
+            return None
+        manager.check_valid_subdir(self.opts.root)
+        value = None
+        if self.opts.arch:
+            sysarch = self.target.packagemanager.system_arch()
+            if self.opts.arch != sysarch:
+                value = manager.arch_personality(sysarch, self.opts.arch)
+                if value is None:
+                    # setarch would be needed
+                    return None
+        if self.executors is None:
+            self.executors = {}
+        key = (os.path.abspath(self.opts.root), self.opts.run_as, value)
+        executor = self.executors.get(key)
+        if executor is None or not executor.alive():
+            executor = ChrootExecutor(key[0], self.opts.run_as, value)
+            executor.start()
+            self.executors[key] = executor
+        return executor
+
+    def _stop_executors(self, root):
+        if self.executors:
+            root = os.path.abspath(root)
+            for key in self.executors.keys():
+                if key[0] == root:
+                    self.executors.pop(key).stop()
+
+    def _check_status(self, returncode, cmdline, exit, error):
+        if not self.opts.ignore_errors:
+            if returncode != 0:
+                msg = ("command failed with %d (output above "
+                        "^^^^^^^^^^)\n" % returncode)
+                # in case of timeout (err 124), only return the error
+                # code to the caller
+                if exit and not (self.opts.timeout
+                                 and returncode == 124):
+                    raise CliError, msg
+                else:
+                    if error:
+                        sys.stderr.write(msg + "\n")
+                    raise CommandError(returncode, cmdline, "")
+
+    def _exec_in_executor(self, executor, args, exit, error):
+        import subprocess
+        if self.opts.run_as:
+            command = subprocess.list2cmdline(args)
+            cmdline = command
+        else:
+            command = args
+            cmdline = subprocess.list2cmdline(args)
+        if not self.opts.quiet:
+            sys.stderr.write(">>>>>> running in %s: %s\n" %
+                    (executor.root, cmdline))
+            sys.stderr.flush()
+        if self.opts.dry_run:
+            return
+        returncode, maxrss = executor.run(command,
+                shell=bool(self.opts.run_as), timeout=self.opts.timeout,
+                ignorestderr=self.opts.ignore_stderr)
+        self.results["maxrss"] = max(maxrss, self.results.get("maxrss", 0))
+        self._check_status(returncode, cmdline, exit, error)
+
     def _exec(self, args, exit=True, error=True, interactive=False,
             allowchroot=True):
         import subprocess
+        if self.opts.root and allowchroot and not interactive:
+            executor = self._executor()
+            if executor is not None:
+                try:
+                    return self._exec_in_executor(executor, args, exit,
+                            error)
+                except ExecutorError, e:
+                    raise CliError, str(e)
         allcmd = []
+        preexec = None
         if self.opts.timeout is not None:
             allcmd.extend(("timeout", str(self.opts.timeout)))
         if self.opts.root and allowchroot:
             if self.opts.arch:
                 sysarch = self.target.packagemanager.system_arch()
                 if self.opts.arch != sysarch:
-                    allcmd.extend(self.target.rootmanager.setarch_command(sysarch,
-                        self.opts.arch))
+                    manager = self.target.rootmanager
+                    value = manager.arch_personality(sysarch, self.opts.arch)
+                    if value is not None:
+                        # inherited by everything run in the root
+                        preexec = lambda: personality.set_personality(value)
+                    else:
+                        allcmd.extend(manager.setarch_command(sysarch,
+                            self.opts.arch))
             self.target.rootmanager.check_valid_subdir(self.opts.root)
             chrootcmd = self.target.rootmanager.chroot_command()
             allcmd.extend(chrootcmd)
@@ -195,22 +287,65 @@ class RootCommand(JurtCommand):
             sys.stderr.write(">>>>>> running: %s\n" % (cmdline))
             sys.stderr.flush()
         if not self.opts.dry_run:
-            p = subprocess.Popen(args=allcmd, stderr=stderr, shell=False)
-            p.wait()
-            if not self.opts.ignore_errors:
-                if p.returncode != 0:
-                    msg = ("command failed with %d (output above "
-                            "^^^^^^^^^^)\n" % p.returncode)
-                    # in case of timeout (err 124), only return the error
-                    # code to the caller
-                    if exit and not (self.opts.timeout
-                                     and p.returncode == 124):
-                        raise CliError, msg
-                    else:
-                        if error:
-                            sys.stderr.write(msg + "\n")
-                        raise CommandError(p.returncode,
-                                subprocess.list2cmdline(allcmd), "")
+            p = subprocess.Popen(args=allcmd, stderr=stderr, shell=False,
+                    preexec_fn=preexec)
+            self._wait(p)
+            self._check_status(p.returncode, cmdline, exit, error)
+
+    def _returncode(self, status):
+        if os.WIFSIGNALED(status):
+            return -os.WTERMSIG(status)
+        return os.WEXITSTATUS(status)
+
+    def _wait(self, p):
+        # wait4 also provides the peak RSS of the whole process tree
+        _, status, usage = os.wait4(p.pid, 0)
+        p.returncode = self._returncode(status)
+        maxrss = usage.ru_maxrss * 1024
+        self.results["maxrss"] = max(maxrss, self.results.get("maxrss", 0))
+
+    def _exec_parallel(self, cmds, workers):
+        """Runs the commands with at most workers of them at once"""
+        import time
+        import signal
+        import subprocess
+        pending = list(cmds)
+        running = {}
+        failed = []
+        try:
+            while pending or running:
+                while pending and len(running) < workers:
+                    args = pending.pop(0)
+                    cmdline = subprocess.list2cmdline(args)
+                    if not self.opts.quiet:
+                        sys.stderr.write(">>>>>> running: %s\n" % (cmdline))
+                        sys.stderr.flush()
+                    if not self.opts.dry_run:
+                        p = subprocess.Popen(args=args, shell=False)
+                        running[p.pid] = (p, cmdline)
+                # only our own children, the agent may have others, such
+                # as the executors
+                finished = [(pid, status) for pid, status in
+                        (os.waitpid(pid, os.WNOHANG) for pid in running)
+                        if pid]
+                if running and not finished:
+                    time.sleep(0.05)
+                for pid, status in finished:
+                    p, cmdline = running.pop(pid)
+                    p.returncode = self._returncode(status)
+                    if p.returncode != 0:
+                        failed.append((p.returncode, cmdline))
+        finally:
+            for p, cmdline in running.values():
+                try:
+                    os.kill(p.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+                p.wait()
+        if failed and not self.opts.ignore_errors:
+            returncode, cmdline = failed[0]
+            raise CommandError(returncode, cmdline, "%d of %d commands "
+                    "failed" % (len(failed), len(cmds)))
 
     @_requires_target
     def cmd_runpm(self):
@@ -219,18 +354,6 @@ class RootCommand(JurtCommand):
         self.target.packagemanager.validate_cmd_args(self.opts.pm, self.args)
         self._exec(self.target.packagemanager.cmd_args(self.opts.pm, self.args))
 
-    def _install_cmd(self, dir=False):
-        cmd = [self.config.root.install_command]
-        if dir:
-            cmd.append("-d")
-        if self.opts.uid:
-            cmd.extend(("-o", self.opts.uid))
-        if self.opts.gid:
-            cmd.extend(("-g", self.opts.gid))
-        if self.opts.mode:
-            cmd.extend(("-m", self.opts.mode))
-        return cmd
-
     @_requires_target
     def cmd_adduser(self):
         if not self.args:
@@ -248,11 +371,9 @@ class RootCommand(JurtCommand):
         source = self.args[0]
         dest = self.args[1]
         self.target.rootmanager.check_valid_subdir(dest)
-        cmd = self._install_cmd()
-        cmd.append(source)
-        cmd.append(dest)
         if not self.opts.dry_run:
-            self._exec(cmd)
+            fileops.install_file(source, dest, self.opts.uid, self.opts.gid,
+                    self.opts.mode)
 
     @_requires_target
     def cmd_copyout(self):
@@ -263,12 +384,15 @@ class RootCommand(JurtCommand):
         for source in sources:
             self.target.rootmanager.check_valid_subdir(source)
         self.target.rootmanager.check_valid_outdir(dest)
-        cmd = self._install_cmd()
-        cmd.extend(sources)
-        cmd.append(dest)
+        if len(sources) > 1 and not os.path.isdir(dest):
+            raise CliError, "target %s is not a directory" % (dest)
         if not self.opts.dry_run:
-            self._exec(cmd)
-
+            for source in sources:
+                path, method, size = fileops.install_file(source, dest,
+                        self.opts.uid, self.opts.gid, self.opts.mode)
+                if not self.opts.quiet:
+                    sys.stderr.write(">>>>>> copied %s to %s using %s "
+                            "(%d bytes)\n" % (source, path, method, size))
 
     @_requires_target
     def cmd_cheapcopy(self):
@@ -278,21 +402,18 @@ class RootCommand(JurtCommand):
         source = self.args[0]
         dest = self.args[1]
         self.target.rootmanager.check_valid_subdir(dest)
-        copyopts = "-af"
-        if util.same_partition(source, dest):
-            copyopts += "l"
-        cmd = ["cp", copyopts, source, dest]
+        link = util.same_partition(source, dest)
         if not self.opts.dry_run:
-            self._exec(cmd)
+            fileops.link_tree(source, dest, link=link)
 
     @_requires_target
     def cmd_mkdir(self):
         for arg in self.args:
             self.target.rootmanager.check_valid_subdir(arg)
-            cmd = self._install_cmd(dir=True)
-            cmd.append(arg)
-            if not self.opts.dry_run:
-                self._exec(cmd)
+        if not self.opts.dry_run:
+            for arg in self.args:
+                fileops.install_dir(arg, self.opts.uid, self.opts.gid,
+                        self.opts.mode)
 
     def _check_build_user(self, username):
         # checks whether the user being used inside the chroot is the one
@@ -330,36 +451,46 @@ class RootCommand(JurtCommand):
             raise CliError, "invalid mount type: %s" % (typename)
         return mountinfo
 
-    def _parse_proc_mounts(self):
-        if not os.path.exists(PROC_MOUNTS):
-            raise Error, "%s is needed when mounting" % (PROC_MOUNTS)
-        mounted = set()
-        with open(PROC_MOUNTS) as f:
-            for line in f:
-                line = line.strip()
-                if not line.startswith("#"):
-                    fields = line.split()
-                    if len(fields) > 1:
-                        # /proc/mounts represents spaces as \040; too lazy
-                        # for proper parsing:
-                        path = fields[1].replace("\\040", " ")
-                        mounted.add(os.path.abspath(path) + "/")
-        return frozenset(mounted)
+    def _mount_table(self):
+        # kept while running as agent, it is only parsed again when the
+        # kernel reports changes
+        if self.mounttable is None:
+            self.mounttable = mount.MountTable()
+        self.mounttable.refresh()
+        return self.mounttable
+
+    def _check_inside_root(self, path):
+        root = os.path.realpath(self.opts.root) + "/"
+        if not (os.path.realpath(path) + "/").startswith(root):
+            raise Error, "mount point %s points outside the root" % (path)
 
     @_requires_target
     @_requires_root
     @_requires_chroot
     def cmd_mountall(self):
-        mounted = self._parse_proc_mounts()
+        table = self._mount_table()
+        direct = mount.libc() is not None
         for devpath, mountpoint, fsname, options in self.target.rootmanager.mount_points():
             absmntpoint = os.path.abspath(self.opts.root + "/" +
-                    mountpoint) + "/"
+                    mountpoint)
             if not os.path.exists(absmntpoint):
                 try:
                     os.mkdir(absmntpoint)
                 except (IOError, OSError), e:
                     raise Error, "failed to create mountpoint: %s" % e
-            if absmntpoint not in mounted:
+            if table.is_mounted(absmntpoint):
+                continue
+            if direct:
+                # mounting from outside the chroot, so symlinks must not
+                # be followed to the outside world
+                self._check_inside_root(absmntpoint)
+                if not self.opts.quiet:
+                    sys.stderr.write(">>>>>> mounting %s (%s) on %s\n" %
+                            (devpath, fsname, absmntpoint))
+                if not self.opts.dry_run:
+                    table.mount(devpath, absmntpoint, fsname, options,
+                            bind=(fsname == "bind"))
+            else:
                 if fsname == "bind":
                     args = ["mount", "--rbind", devpath, absmntpoint]
                     chroot = False
@@ -373,14 +504,27 @@ class RootCommand(JurtCommand):
     @_requires_root
     @_requires_chroot
     def cmd_umountall(self):
-        mounted = self._parse_proc_mounts()
-        for devpath, mountpoint, fsname, options in self.target.rootmanager.mount_points():
-            absmntpoint = os.path.abspath(self.opts.root + "/" +
-                    mountpoint) + "/"
-            if absmntpoint in mounted:
-                args = ["umount", mountpoint]
+        # they keep the root busy
+        self._stop_executors(self.opts.root)
+        table = self._mount_table()
+        direct = mount.libc() is not None
+        configured = [os.path.abspath(self.opts.root + "/" + mountpoint)
+                for _, mountpoint, _, _ in
+                self.target.rootmanager.mount_points()]
+        # deepest first, so that submounts of recursive binds go first
+        for path in table.below(self.opts.root):
+            if not any(path == mountpoint or
+                    path.startswith(mountpoint + "/")
+                    for mountpoint in configured):
+                continue
+            if direct:
+                if not self.opts.quiet:
+                    sys.stderr.write(">>>>>> umounting %s\n" % (path))
                 if not self.opts.dry_run:
-                    self._exec(args)
+                    table.umount(path)
+            else:
+                if not self.opts.dry_run:
+                    self._exec(["umount", path], allowchroot=False)
 
     @_requires_target
     @_requires_root
@@ -525,6 +669,7 @@ class RootCommand(JurtCommand):
         src, dst = self.args
         self.target.rootmanager.check_valid_subdir(src)
         self.target.rootmanager.check_valid_subdir(dst)
+        self._stop_executors(src)
         os.rename(src, dst) # TODO what else to check? permissions?
 
     @_requires_target
@@ -538,11 +683,41 @@ class RootCommand(JurtCommand):
         self._exec(args)
 
     @_requires_target
-    def cmd_mounttmpfs(self):
+    def cmd_destroyroots(self):
+        if not self.args:
+            raise CliError, "no roots to destroy"
+        manager = self.target.rootmanager
+        cmds = []
+        for path in self.args:
+            manager.check_valid_subdir(path)
+            args = manager.root_destroy_command()
+            args.append(path)
+            cmds.append(args)
+        self._exec_parallel(cmds, manager.clean_workers())
+
+    @_requires_target
+    def cmd_diskusage(self):
         if len(self.args) != 1:
             raise CliError, "unexpected number of args"
         self.target.rootmanager.check_valid_subdir(self.args[0])
-        args = self.target.rootmanager.mount_root_command(self.args[0])
+        size = util.tree_size(self.args[0])
+        self.results["size"] = size
+        if not self.opts.agent:
+            print size
+
+    @_requires_target
+    def cmd_mounttmpfs(self):
+        if len(self.args) not in (1, 2):
+            raise CliError, "unexpected number of args"
+        self.target.rootmanager.check_valid_subdir(self.args[0])
+        size = None
+        if len(self.args) == 2:
+            try:
+                size = int(self.args[1])
+            except ValueError:
+                raise CliError, "invalid tmpfs size: %s" % (self.args[1])
+        args = self.target.rootmanager.mount_root_command(self.args[0],
+                size)
         self._exec(args)
 
     @_requires_target
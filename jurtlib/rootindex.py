@@ -0,0 +1,257 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Journal of the state of the roots
+
+Listing the roots or finding one by name would otherwise require listing
+and probing every state directory. Each change of state is appended as a
+line to the journal, which is replayed when read, and rewritten once it
+has grown too much. When the journal is missing it is rebuilt from a scan
+of the state directories.
+
+Writers take a lock on a separate file, as the journal itself is replaced
+when compacted or rebuilt. Changes are not written when the journal is
+missing, as the scan that rebuilds it will find them.
+"""
+import os
+import time
+import errno
+import fcntl
+import logging
+from jurtlib import Error
+
+logger = logging.getLogger("jurt.rootindex")
+
+# the journal is compacted when it has COMPACT_RATIO times more records
+# than roots, and at least COMPACT_MIN records
+COMPACT_RATIO = 4
+COMPACT_MIN = 1000
+
+class RootIndexError(Error):
+    pass
+
+class RootIndex:
+    """Maps root names to (state name, kind, timestamp, size)
+
+    The timestamp is the time the root entered the state, the size is the
+    disk usage of the root in bytes, None when it has not been measured.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.inode = None
+        self.offset = 0
+        self.records = 0
+
+    def _replay(self, data):
+        for line in data.splitlines():
+            fields = line.split(" ", 5)
+            if len(fields) != 6:
+                logger.warn("ignoring invalid record in %s: %r", self.path,
+                        line)
+                continue
+            timestamp, op, statename, kind, size, name = fields
+            if size == "-":
+                size = None
+            else:
+                size = int(size)
+            entry = self.entries.get(name)
+            if op == "set":
+                if size is None and entry is not None:
+                    # moving a root does not change its size
+                    size = entry[3]
+                self.entries[name] = (statename, kind, float(timestamp),
+                        size)
+            elif op == "size":
+                if entry is not None:
+                    self.entries[name] = entry[:3] + (size,)
+            elif op == "del":
+                self.entries.pop(name, None)
+            self.records += 1
+
+    def _read(self):
+        """Reads the records appended since the last read, returns False
+        if there is no journal"""
+        try:
+            f = open(self.path)
+        except IOError, e:
+            if e.errno != errno.ENOENT:
+                raise RootIndexError, ("failed to open the root index: %s" %
+                        (e))
+            return False
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            if inode != self.inode:
+                # compacted or rebuilt by someone else
+                self.entries = {}
+                self.inode = inode
+                self.offset = 0
+                self.records = 0
+            f.seek(self.offset)
+            data = f.read()
+        # a writer may be in the middle of a record
+        end = data.rfind("\n") + 1
+        self._replay(data[:end])
+        self.offset += end
+        return True
+
+    def load(self, scan):
+        """Brings the index up to date, using scan() to rebuild it
+
+        scan() provides (name, state name, kind, timestamp) of each root
+        present in the state directories.
+        """
+        if not self._read():
+            logger.debug("rebuilding the root index at %s", self.path)
+            self.rebuild(scan)
+            self._read()
+
+    def lookup(self, name):
+        return self.entries.get(name)
+
+    def roots(self):
+        return sorted((name,) + entry
+                for name, entry in self.entries.iteritems())
+
+    def _format(self, op, name, statename="-", kind="-", timestamp=None,
+            size=None):
+        if timestamp is None:
+            timestamp = time.time()
+        if size is None:
+            size = "-"
+        return "%.3f %s %s %s %s %s\n" % (timestamp, op, statename, kind,
+                size, name)
+
+    def _make_dir(self):
+        dir = os.path.dirname(self.path)
+        if not os.path.isdir(dir):
+            try:
+                os.makedirs(dir)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+    def _lock(self):
+        self._make_dir()
+        fd = os.open(self.path + ".lock", os.O_WRONLY | os.O_CREAT, 0664)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            st = os.fstat(fd)
+            if st.st_uid == os.geteuid() and st.st_mode & 0664 != 0664:
+                # the umask must not keep the other users out
+                os.fchmod(fd, 0664)
+        except:
+            os.close(fd)
+            raise
+        return fd
+
+    def _append(self, data):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+        return True
+
+    def _write(self, data):
+        try:
+            lock = self._lock()
+            try:
+                if self._append(data):
+                    if self.entries is not None:
+                        self._read()
+                    if self._should_compact():
+                        self._compact()
+            finally:
+                os.close(lock)
+        except EnvironmentError, e:
+            self._invalidate(e)
+
+    def _invalidate(self, error):
+        # an index missing changes is worse than no index at all
+        logger.warn("failed to update the root index at %s, it will be "
+                "rebuilt: %s", self.path, error)
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+        self.entries = None
+        self.inode = None
+
+    def _should_compact(self):
+        return (self.entries is not None and self.records > COMPACT_MIN
+                and self.records > COMPACT_RATIO * len(self.entries))
+
+    def _replace(self, records):
+        self._make_dir()
+        tmppath = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmppath, "w") as f:
+            f.writelines(records)
+        os.chmod(tmppath, 0664)
+        os.rename(tmppath, self.path)
+
+    def _compact(self):
+        # called with the journal locked
+        self._read()
+        self._replace(self._format("set", name, statename, kind, timestamp,
+            size) for name, statename, kind, timestamp, size in self.roots())
+        logger.debug("compacted the root index at %s from %d records",
+                self.path, self.records)
+
+    def rebuild(self, scan):
+        """Writes a new journal from the roots provided by scan(), unless
+        another process wrote one meanwhile"""
+        try:
+            lock = self._lock()
+            try:
+                if os.path.exists(self.path):
+                    return
+                self._replace(self._format("set", name, statename, kind,
+                    timestamp, size)
+                    for name, statename, kind, timestamp, size in scan())
+            finally:
+                os.close(lock)
+        except EnvironmentError, e:
+            raise RootIndexError, ("failed to rebuild the root index: %s" %
+                    (e))
+
+    def set(self, name, statename, kind, timestamp=None):
+        """Records the state of a root, timestamp is the time it entered
+        the state, now by default"""
+        self._write(self._format("set", name, statename, kind, timestamp))
+
+    def set_size(self, name, size):
+        self._write(self._format("size", name, size=size))
+
+    def remove(self, name):
+        self._write(self._format("del", name))
+
+def get_root_index(path):
+    if not path:
+        return None
+    return RootIndex(os.path.expanduser(path))
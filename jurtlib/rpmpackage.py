@@ -40,6 +40,9 @@ class RPMPackage:
         tags = ("name", "epoch", "version", "release", "distepoch",
                 "disttag", "arch")
         queryformat = "/".join("%%{%s}" % tag for tag in tags)
+        # followed by one line for each requirement (BuildRequires for
+        # source packages)
+        queryformat += "\n[%{REQUIRENAME}\n]"
         out = self._rpmq(path, queryformat)
         lines = out.split("\n", 1)
         if not lines or not lines[0]:
@@ -61,6 +64,9 @@ class RPMPackage:
         self.distepoch = g(it)
         self.disttag = g(it)
         self.arch = g(it)
+        self.requires = []
+        if len(lines) > 1:
+            self.requires = [line for line in lines[1].splitlines() if line]
 
     def _rpmq(self, path, qf):
         args = ["/bin/rpm", "-q", "-p", "--qf"]
@@ -0,0 +1,112 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Ordering of the packages of a batch from their expected build durations
+"""
+import re
+import logging
+
+logger = logging.getLogger("jurt.schedule")
+
+# BuildRequires such as pkgconfig(foo) or perl(Foo::Bar)
+WRAPPED_DEP = re.compile(r"^[\w-]+\((?P<name>[^)]+)\)")
+
+class Job:
+
+    def __init__(self, index, path, sourceid, name, requires, duration):
+        self.index = index
+        self.path = path
+        self.sourceid = sourceid
+        self.name = name
+        self.requires = requires
+        self.duration = duration
+        self.after = set()
+
+def provided_by(require, name):
+    """Guesses whether a build requirement refers to a source package
+
+    The names of the binary packages are only known after building, so
+    they are guessed from the usual naming of subpackages.
+    """
+    require = require.lower()
+    names = [name.lower()]
+    found = WRAPPED_DEP.match(require)
+    if found:
+        require = found.group("name").replace("::", "-")
+        # perl(Foo::Bar) is provided by perl-Foo-Bar
+        for prefix in ("perl-", "python-"):
+            if names[0].startswith(prefix):
+                names.append(names[0][len(prefix):])
+    for name in names:
+        for prefix in ("", "lib", "lib64"):
+            if require == prefix + name:
+                return True
+            if require.startswith(prefix + name + "-"):
+                return True
+    return False
+
+def link_dependencies(jobs):
+    """Jobs requiring a package that precedes them must stay after it"""
+    for job in jobs:
+        for other in jobs[:job.index]:
+            if any(provided_by(require, other.name)
+                    for require in job.requires):
+                logger.debug("%s seems to require %s", job.sourceid,
+                        other.sourceid)
+                job.after.add(other.index)
+
+def default_duration(jobs):
+    """Duration assumed for the jobs without estimate: the average of the
+    known ones"""
+    known = [job.duration for job in jobs if job.duration is not None]
+    if known:
+        return sum(known) / len(known)
+    return 0.0
+
+def longest_first(jobs):
+    """Orders the jobs putting the longest ones first
+
+    Jobs without estimate are assumed to take the default_duration().
+    Ties keep the order given on the command line.
+    """
+    default = default_duration(jobs)
+    link_dependencies(jobs)
+    done = set()
+    pending = list(jobs)
+    ordered = []
+    while pending:
+        ready = [job for job in pending if job.after <= done]
+        def key(job):
+            if job.duration is None:
+                return (-default, job.index)
+            return (-job.duration, job.index)
+        chosen = min(ready, key=key)
+        pending.remove(chosen)
+        done.add(chosen.index)
+        ordered.append(chosen)
+    return ordered
+
+def makespan(jobs):
+    """Expected duration of building the jobs one after the other"""
+    default = default_duration(jobs)
+    return sum(default if job.duration is None else job.duration
+            for job in jobs)
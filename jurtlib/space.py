@@ -0,0 +1,115 @@
+#
+# Copyright (c) 2011 Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# Written by Bogdano Arendartchuk <bogdano@mandriva.com.br>
+#
+# This file is part of Jurt Build Bot.
+#
+# Jurt Build Bot is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as published
+# by the Free Software Foundation; either version 2 of the License, or (at
+# your option) any later version.
+#
+# Jurt Build Bot is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Jurt Build Bot; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+#
+"""
+Cleaning up when the disk space is running out
+
+Builds would otherwise fail halfway with "No space left on device". The
+watcher checks the free space of some directories before new roots are
+created and periodically while building, and runs the registered
+cleaners, in order, until the free space is above the threshold again.
+"""
+import os
+import logging
+import threading
+from jurtlib import Error, util
+
+logger = logging.getLogger("jurt.space")
+
+def existing_parent(path):
+    # the directory may not exist yet
+    while not os.path.exists(path) and path != os.path.dirname(path):
+        path = os.path.dirname(path)
+    return path
+
+class SpaceWatcher:
+
+    def __init__(self, paths, threshold, interval):
+        self.paths = [existing_parent(path) for path in paths]
+        self.threshold = threshold
+        self.interval = interval
+        self.cleaners = []
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def add_cleaner(self, name, path, fun):
+        """Adds fun(targetfree) as a way to free space in the partition of
+        path, the cleaners added first are run first"""
+        self.cleaners.append((name, existing_parent(path), fun))
+
+    def _clean(self, path):
+        free = util.free_space(path)
+        logger.warn("only %s available in %s, cleaning up",
+                util.format_size(free), path)
+        for name, cleanerpath, fun in self.cleaners:
+            if not util.same_partition(path, cleanerpath):
+                continue
+            logger.info("removing %s to free space in %s", name, path)
+            try:
+                fun(self.threshold)
+            except (EnvironmentError, Error), e:
+                logger.warn("failed to remove %s: %s", name, e)
+            free = util.free_space(path)
+            if free >= self.threshold:
+                logger.info("%s available in %s after cleaning up",
+                        util.format_size(free), path)
+                return
+        logger.warn("still only %s available in %s after cleaning up",
+                util.format_size(free), path)
+
+    def check(self):
+        # the paths already being cleaned by another thread are ok
+        if not self.lock.acquire(False):
+            return
+        try:
+            done = set()
+            for path in self.paths:
+                if util.free_space(path) >= self.threshold:
+                    continue
+                device = util.node_dev(path)
+                if device not in done:
+                    done.add(device)
+                    self._clean(path)
+        finally:
+            self.lock.release()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except (EnvironmentError, Error), e:
+                logger.warn("failed to check the free space: %s", e)
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self._run,
+                name="space-watcher")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.stopped.set()
+            # join() with timeout keeps it interruptible
+            while self.thread.is_alive():
+                self.thread.join(0.5)
+            self.thread = None
@@ -20,8 +20,11 @@
 # Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 #
 import os
+import stat
+import time
+import shutil
 import logging
-from jurtlib import Error
+from jurtlib import Error, fileops, util
 
 logger = logging.getLogger("jurt.spool")
 
@@ -46,27 +49,100 @@ class Spool:
     def _update(self):
         self.packagemanager.update_repository_metadata(self.path)
 
-    def package_count(self):
-        return sum(1 for name in os.listdir(self.path)
+    def packages(self):
+        return sorted(name for name in os.listdir(self.path)
                 if self.packagemanager.valid_binary(name))
 
+    def package_count(self):
+        return len(self.packages())
+
     def put_packages(self, paths):
         spoolpaths = []
         for path in paths:
             if self.packagemanager.valid_binary(path):
                 dest = os.path.join(self.path, os.path.basename(path))
                 spoolpaths.append(dest)
-                logger.debug("creating hardlink from %s to %s" % (path, dest))
                 if os.path.exists(dest):
-                    logger.debug("%s already exists, removing it", dest)
-                    try:
-                        os.unlink(dest)
-                    except EnvironmentError, e:
-                        raise SpoolError, ("failed to remove package from "
-                                "root spool: %s" % (e))
-                os.link(path, dest)
+                    logger.debug("%s already exists, replacing it", dest)
+                try:
+                    fileops.copy_file(path, dest)
+                except fileops.FileOpsError, e:
+                    raise SpoolError, ("failed to put package in the "
+                            "spool: %s" % (e))
             else:
                 logger.debug("not copying %s to the spool at %s" % (path,
                     self.path))
         self._update()
         return spoolpaths
+
+def spool_usage(path):
+    """Provides the space and the inodes freed by removing a spool
+
+    Files still hardlinked from elsewhere (ie. the success directory) do
+    not free any space.
+    """
+    size = 0
+    inodes = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if st.st_nlink <= 1 or name in dirnames:
+                size += st.st_blocks * 512
+                inodes += 1
+    return size, inodes + 1
+
+def stale_spools(spooldir, maxage, inuse):
+    """Provides (name, path, mtime) of the spools not changed in maxage
+    seconds and not in inuse"""
+    try:
+        names = os.listdir(spooldir)
+    except EnvironmentError, e:
+        raise SpoolError, "failed to list the spools: %s" % (e)
+    now = time.time()
+    for name in names:
+        if name in inuse:
+            continue
+        path = os.path.join(spooldir, name)
+        try:
+            st = os.lstat(path)
+        except OSError:
+            continue
+        if stat.S_ISDIR(st.st_mode) and now - st.st_mtime > maxage:
+            yield name, path, st.st_mtime
+
+def collect_spools(spooldir, maxage, inuse, workers, dry_run=False):
+    """Removes the stale spools in parallel
+
+    Yields (name, mtime, size, inodes) of each spool removed.
+    """
+    from multiprocessing.pool import ThreadPool
+    def remove(info):
+        name, path, mtime = info
+        size, inodes = spool_usage(path)
+        if not dry_run:
+            try:
+                shutil.rmtree(path)
+            except EnvironmentError, e:
+                logger.warn("failed to remove the spool %s: %s", path, e)
+                return None
+        return name, mtime, size, inodes
+    found = list(stale_spools(spooldir, maxage, inuse))
+    if not found:
+        return
+    count = totalsize = totalinodes = 0
+    pool = ThreadPool(min(workers, len(found)))
+    try:
+        for removed in pool.imap_unordered(remove, found):
+            if removed is not None:
+                count += 1
+                totalsize += removed[2]
+                totalinodes += removed[3]
+                yield removed
+    finally:
+        pool.close()
+        pool.join()
+    logger.info("removed %d spools, reclaimed %s and %d inodes", count,
+            util.format_size(totalsize), totalinodes)
@@ -21,16 +21,24 @@
 #
 
 import os
+import re
+import errno
 import select
 import subprocess
 import logging
 import shlex
 from jurtlib import Error, CommandError, SetupError
 from jurtlib.registry import Registry
+from jurtlib.util import TailBuffer
 from cStringIO import StringIO
 
 logger = logging.getLogger("jurt.su")
 
+# bytes of output of failed commands kept in their error messages
+ERROR_OUTPUT_SIZE = 64 * 1024
+# longer lines are passed to line handlers in pieces
+MAX_LINE_SIZE = 64 * 1024
+
 def my_username():
     import pwd
     uid = os.geteuid()
@@ -53,6 +61,74 @@ class AgentError(SuError):
 class SudoNotSetup(SuError):
     pass
 
+def error_output(output):
+    if len(output) > ERROR_OUTPUT_SIZE:
+        output = ("(%d bytes omitted)\n%s" % (len(output) -
+            ERROR_OUTPUT_SIZE, output[-ERROR_OUTPUT_SIZE:]))
+    return output
+
+class LineOutput:
+    """Passes each line of the output to linehandler as it arrives, only
+    the last ERROR_OUTPUT_SIZE bytes are kept
+
+    Lines end with \\n, \\r\\n or \\r (progress output). Longer lines
+    are passed in pieces of MAX_LINE_SIZE bytes, so handlers parsing
+    them must expect fragments when the output is not line-oriented.
+    """
+
+    newline = re.compile(r"\r\n|\r|\n")
+
+    def __init__(self, linehandler):
+        self.linehandler = linehandler
+        self.partial = []
+        self.partialsize = 0
+        self.skiplf = False
+        # the last line was cut at MAX_LINE_SIZE
+        self.split = False
+        self.tail = TailBuffer(ERROR_OUTPUT_SIZE)
+
+    def _flush_partial(self, end=""):
+        self.partial.append(end)
+        line = "".join(self.partial)
+        self.partial = []
+        self.partialsize = 0
+        self.linehandler(line)
+
+    def write(self, data):
+        if not data:
+            return
+        self.tail.write(data)
+        if self.skiplf and data.startswith("\n"):
+            # the \r\n was split between two writes
+            data = data[1:]
+        self.skiplf = data.endswith("\r")
+        lines = self.newline.split(data)
+        rest = lines.pop()
+        if lines:
+            # the end of a line just cut is not another, empty, line
+            if lines[0] or self.partial or not self.split:
+                self._flush_partial(lines[0])
+            self.split = False
+            for line in lines[1:]:
+                self.linehandler(line)
+        if rest:
+            self.partial.append(rest)
+            self.partialsize += len(rest)
+            if self.partialsize >= MAX_LINE_SIZE:
+                self._flush_partial()
+                self.split = True
+
+    def finish(self):
+        if self.partial:
+            self._flush_partial()
+
+    def getvalue(self):
+        output = self.tail.getvalue()
+        omitted = self.tail.omitted()
+        if omitted:
+            output = "(%d bytes omitted)\n%s" % (omitted, output)
+        return output
+
 class SuWrapper:
 
     def add_user(self, username, uid, gid):
@@ -73,6 +149,8 @@ class JurtRootWrapper(SuWrapper):
 
     def __init__(self, targetname, suconf, globalconf):
         self.targetname = targetname
+        self.suconf = suconf
+        self.globalconf = globalconf
         self.sucmd = shlex.split(suconf.sudo_command)
         self.jurtrootcmd = shlex.split(suconf.jurt_root_command_command)
         self.cmdpolltime = float(suconf.command_poll_time)
@@ -81,6 +159,8 @@ class JurtRootWrapper(SuWrapper):
         self.agentproc = None
         self.agentcmdline = None
         self.agentcookie = str(id(self))
+        self.agentresults = {}
+        self.maxrss = 0
 
     def start(self):
         cmd = self.sucmd[:]
@@ -100,6 +180,21 @@ class JurtRootWrapper(SuWrapper):
         self.agentproc = proc
         self.agentrunning = True
 
+    def sibling(self):
+        """Returns a new wrapper for the same target with its own agent
+
+        The agent protocol handles one command at a time, so a separate
+        agent is needed by anything running commands from another thread.
+        """
+        return self.__class__(self.targetname, self.suconf, self.globalconf)
+
+    def stop(self):
+        if self.agentrunning:
+            logger.debug("stopping the superuser agent")
+            self.agentproc.stdin.close()
+            self.agentproc.wait()
+            self.agentrunning = False
+
     def _check_agent_output(self, data):
         returncode = None
         newdata = data
@@ -108,9 +203,11 @@ class JurtRootWrapper(SuWrapper):
         if index != -1:
             newdata = data[:index]
             tail = data[index:]
-            status = tail.split(None, 2)[1]
+            fields = tail.split()
+            status = fields[1]
             if status == "OK":
                 returncode = 0
+                self._parse_results(fields[2:])
             elif status == "ERROR":
                 logger.debug("agent ERROR line: %s", tail)
                 try:
@@ -125,6 +222,19 @@ class JurtRootWrapper(SuWrapper):
                     returncode = reason
         return returncode, newdata
 
+    def _parse_results(self, fields):
+        # the agent can append name=value pairs to the OK line
+        for field in fields:
+            name, sep, value = field.partition("=")
+            if sep:
+                self.agentresults[name] = value
+        rawrss = self.agentresults.get("maxrss")
+        if rawrss is not None:
+            try:
+                self.maxrss = max(self.maxrss, int(rawrss))
+            except ValueError:
+                logger.debug("invalid maxrss from agent: %r", rawrss)
+
     def _collect_from_agent(self, targetfile, outputlogger):
         rfd = self.agentproc.stdout.fileno()
         efd = self.agentproc.stderr.fileno()
@@ -152,6 +262,13 @@ class JurtRootWrapper(SuWrapper):
                 returncode, newdata = self._check_agent_output(data)
                 targetfile.write(newdata)
                 if returncode is not None:
+                    # the command has finished, but not all its output
+                    # may have been read yet
+                    while select.select([rfd], [], [], 0)[0]:
+                        data = os.read(rfd, 8196)
+                        if not data:
+                            break
+                        targetfile.write(data)
                     done = True
             if self.agentproc.poll() is not None:
                 self.agentrunning = False
@@ -165,14 +282,21 @@ class JurtRootWrapper(SuWrapper):
                     # the output from targetfile:
                     raise AgentError, ("Ouch! There was an unhandled "
                             "exception in the root helper "
-                            "agent:\n%s\n" % (targetfile.getvalue()))
+                            "agent:\n%s\n" % (error_output(
+                                targetfile.getvalue())))
         return returncode
 
     def _exec_wrapper(self, type, args, root=None, arch=None,
             outputlogger=None, timeout=None, ignoreerrors=False,
             interactive=False, quiet=False, ignorestderr=False,
-            remount=False):
+            remount=False, linehandler=None):
+        """Runs a command through the agent
+
+        Without outputlogger, the output is returned, unless linehandler
+        is used, then each line is passed to it instead.
+        """
         assert not (interactive and outputlogger)
+        assert not (linehandler and outputlogger)
 
         basecmd = self.jurtrootcmd[:]
         basecmd.extend(("--type", type))
@@ -208,17 +332,28 @@ class JurtRootWrapper(SuWrapper):
                 outputlogger.flush()
             if not self.agentrunning:
                 self.start()
+            self.agentresults = {}
             logger.debug("sending command to agent: %s", cmdline)
-            self.agentproc.stdin.write(cmdline + "\n")
-            self.agentproc.stdin.flush()
+            try:
+                self.agentproc.stdin.write(cmdline + "\n")
+                self.agentproc.stdin.flush()
+            except IOError, e:
+                if e.errno != errno.EPIPE:
+                    raise
+                # the agent is dead, _collect_from_agent will report it
+                logger.debug("broken pipe while sending command to agent")
             if outputlogger:
                 targetfile = outputlogger
+            elif linehandler:
+                targetfile = LineOutput(linehandler)
             else:
                 targetfile = StringIO()
             returncode = self._collect_from_agent(targetfile, outputlogger)
             if outputlogger:
                 output = "(error in log available in log files)"
             else:
+                if linehandler:
+                    targetfile.finish()
                 output = targetfile.getvalue()
         # check for error:
         if returncode != 0:
@@ -226,7 +361,9 @@ class JurtRootWrapper(SuWrapper):
                 # command timeout
                 raise CommandTimeout, ("command timed out:\n%s\n" %
                         (cmdline))
-            raise CommandError(returncode, cmdline, output)
+            raise CommandError(returncode, cmdline, error_output(output))
+        if linehandler:
+            return None
         return output
 
     def add_user(self, username, uid, root=None, arch=None):
@@ -242,12 +379,13 @@ class JurtRootWrapper(SuWrapper):
 
     def run_as(self, args, user, root=None, arch=None, timeout=None,
             outputlogger=None, quiet=False, ignorestderr=False,
-            remount=False):
+            remount=False, linehandler=None):
         execargs = ["--run-as", user, "--"]
         execargs.extend(args)
         return self._exec_wrapper("runcmd", execargs, root=root, arch=arch,
                 timeout=timeout, outputlogger=outputlogger, quiet=quiet,
-                ignorestderr=ignorestderr, remount=False)
+                ignorestderr=ignorestderr, remount=False,
+                linehandler=linehandler)
 
     def _perm_args(self, uid, gid, mode):
         args = []
@@ -308,8 +446,11 @@ class JurtRootWrapper(SuWrapper):
         args = [root, file]
         return self._exec_wrapper("rootdecompress", args)
 
-    def mount_tmpfs(self, root):
-        return self._exec_wrapper("mounttmpfs", [root])
+    def mount_tmpfs(self, root, size=None):
+        args = [root]
+        if size is not None:
+            args.append(str(size))
+        return self._exec_wrapper("mounttmpfs", args)
 
     def umount_tmpfs(self, root):
         return self._exec_wrapper("umounttmpfs", [root])
@@ -342,6 +483,23 @@ class JurtRootWrapper(SuWrapper):
     def destroy_root(self, path):
         return self._exec_wrapper("destroyroot", [path])
 
+    def destroy_roots(self, paths):
+        return self._exec_wrapper("destroyroots", paths)
+
+    def disk_usage(self, root):
+        self._exec_wrapper("diskusage", [root])
+        try:
+            return int(self.agentresults["size"])
+        except (KeyError, ValueError):
+            raise AgentError, "the agent did not report the disk usage"
+
+    def max_rss(self, reset=False):
+        """Peak RSS in bytes of the commands run by the agent"""
+        value = self.maxrss
+        if reset:
+            self.maxrss = 0
+        return value
+
 class SuChrootWrapper:
 
     def __init__(self, root, suwrapper):
@@ -356,12 +514,13 @@ class SuChrootWrapper:
                 root=self.root.path, arch=self.root.arch, outputlogger=outputlogger)
 
     def run_as(self, args, user, timeout=None, outputlogger=None,
-            quiet=False, ignorestderr=False, remount=False):
+            quiet=False, ignorestderr=False, remount=False,
+            linehandler=None):
         return self.suwrapper.run_as(args, user=user, root=self.root.path,
                 arch=self.root.arch, timeout=timeout,
                 outputlogger=outputlogger, quiet=quiet,
                 ignorestderr=ignorestderr,
-                remount=False)
+                remount=False, linehandler=linehandler)
 
     def post_root_command(self):
         return self.suwrapper.post_root_command(root=self.root.path,
@@ -82,15 +82,23 @@ class Target:
         self.permchecker = permchecker
 
     def build(self, paths, id=None, fresh=False, stage=None, timeout=None,
-            outputfile=None, keeproot=False, keepbuilding=False):
+            outputfile=None, keeproot=False, keepbuilding=False,
+            reuseroot=None, buildorder=None):
         if id is None:
             id = self.builder.build_id()
         if stage:
             self.builder.set_interactive()
             self.packagemanager.check_build_stage(stage)
         logstore = self.loggerfactory.get_logger(id, outputfile)
-        self.builder.build(id, fresh, paths, logstore, stage, timeout,
-                keeproot, keepbuilding)
+        return self.builder.build(id, fresh, paths, logstore, stage, timeout,
+                keeproot, keepbuilding, reuseroot, buildorder)
+
+    def stop(self):
+        self.builder.stop()
+
+    def estimate(self, paths):
+        self.builder.check_sources(paths)
+        return self.builder.estimate(paths)
 
     def shell(self, id=None, fresh=False):
         if id is None:
@@ -114,32 +122,56 @@ class Target:
         self.builder.set_interactive()
         username, uid = self.builder.build_user_info()
         homedir = os.path.abspath(self.builder.build_user_home(username))
-        for partialglob in self.packagemanager.files_to_pull():
-            globexpr = os.path.join(homedir, partialglob)
-            found = root.glob(globexpr)
-            for path in found:
-                path = os.path.abspath(path)
-                subpath = path[len(homedir)+2:]
-                destpath = os.path.join(dest, subpath)
-                if not overwrite and os.path.exists(destpath):
-                    logger.warn("already exists, skipping: %s", destpath)
-                    continue
-                destdir = os.path.dirname(destpath)
-                if not dryrun:
-                    if not os.path.exists(destdir):
-                        logger.debug("creating directories for %s", destdir)
-                        os.makedirs(destdir)
-                    root.copy_out([path], destpath, sameuser=True)
-                yield path, destpath
+        found = root.find([os.path.join(homedir, partialglob)
+            for partialglob in self.packagemanager.files_to_pull()])
+        for path, size, mtime in found:
+            path = os.path.abspath(path)
+            subpath = path[len(homedir)+2:]
+            destpath = os.path.join(dest, subpath)
+            if not overwrite and os.path.exists(destpath):
+                logger.warn("already exists, skipping: %s", destpath)
+                continue
+            destdir = os.path.dirname(destpath)
+            if not dryrun:
+                if not os.path.exists(destdir):
+                    logger.debug("creating directories for %s", destdir)
+                    os.makedirs(destdir)
+                root.copy_out([path], destpath, sameuser=True)
+            yield path, destpath
 
     def list_roots(self):
         for rootinfo in self.rootmanager.list_roots():
             yield rootinfo
 
-    def clean(self, dry_run=False):
-        for info in self.rootmanager.clean(dry_run):
+    def clean(self, dry_run=False, targetfree=None):
+        for info in self.rootmanager.clean(dry_run, targetfree):
+            yield info
+
+    def spool_dir(self):
+        return os.path.abspath(self.builder.spooldir)
+
+    def share_spools(self, targets):
+        """Tells the builder about the other targets using the spool
+        directory"""
+        self.builder.share_spools([target.rootmanager for target in targets])
+
+    def clean_spools(self, inuse, dry_run=False):
+        for info in self.builder.collect_spools(inuse, dry_run):
             yield info
 
+    def logs_dir(self):
+        return os.path.abspath(self.loggerfactory.logbasedir)
+
+    def clean_logs(self, inuse, dry_run=False):
+        for info in self.loggerfactory.collect(inuse, dry_run):
+            yield info
+
+    def artifact_store(self):
+        return self.builder.artifacts
+
+    def build_cache(self):
+        return self.builder.buildcache
+
     def keep(self, id):
         self.rootmanager.keep(id, self.packagemanager)
 
@@ -21,6 +21,7 @@
 #
 import os
 import logging
+from collections import deque
 
 logger = logging.getLogger("jurt.util")
 
@@ -46,3 +47,192 @@ def node_dev(path):
 
 def same_partition(one, other):
     return node_dev(one) == node_dev(other)
+
+def free_space(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+def format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(size) < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = "TB"
+    if unit == "B":
+        return "%d%s" % (size, unit)
+    return "%.1f%s" % (size, unit)
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def parse_size(raw):
+    """Parses sizes such as 200G or 512M into bytes"""
+    value = raw.strip().upper()
+    if value.endswith("B"):
+        value = value[:-1]
+    multiplier = 1
+    if value and value[-1] in SIZE_UNITS:
+        multiplier = SIZE_UNITS[value[-1]]
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds < 60:
+        return "%ds" % (seconds)
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return "%dm%02ds" % (minutes, seconds)
+    hours, minutes = divmod(minutes, 60)
+    return "%dh%02dm" % (hours, minutes)
+
+def tree_size(path):
+    """Disk usage of a directory tree in bytes, as in du -x"""
+    total = 0
+    seen = set()
+    device = os.lstat(path).st_dev
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames[:]:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                dirnames.remove(name)
+                continue
+            if st.st_dev != device:
+                # /proc, /sys and friends mounted in active roots
+                dirnames.remove(name)
+                continue
+            total += st.st_blocks * 512
+        for name in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, name))
+            except OSError:
+                continue
+            if st.st_nlink > 1:
+                key = (st.st_dev, st.st_ino)
+                if key in seen:
+                    continue
+                seen.add(key)
+            total += st.st_blocks * 512
+    return total
+
+def memory_available(meminfo="/proc/meminfo"):
+    """Memory available on the host in bytes, None when unknown"""
+    values = {}
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    values[fields[0].rstrip(":")] = int(fields[1]) * 1024
+    except (EnvironmentError, ValueError), e:
+        logger.debug("failed to read %s: %s", meminfo, e)
+        return None
+    if "MemAvailable" in values:
+        return values["MemAvailable"]
+    # kernels older than 3.14
+    return (values.get("MemFree", 0) + values.get("Cached", 0) +
+            values.get("Buffers", 0))
+
+def find_files(basedir, patterns):
+    """Expands several glob patterns relative to basedir at once
+
+    Each directory is listed and each path is stat'ed only once, no matter
+    how many patterns reach them. Returns a sorted list of (subpath, size,
+    mtime) of the files found, subpath being relative to basedir.
+    """
+    import glob
+    import stat
+    import fnmatch
+    listings = {}
+    stats = {}
+    def listdir(subpath):
+        names = listings.get(subpath)
+        if names is None:
+            try:
+                names = os.listdir(os.path.join(basedir, subpath))
+            except OSError:
+                names = []
+            listings[subpath] = names
+        return names
+    def getstat(subpath):
+        if subpath not in stats:
+            try:
+                stats[subpath] = os.stat(os.path.join(basedir, subpath))
+            except OSError:
+                stats[subpath] = None
+        return stats[subpath]
+    found = {}
+    pending = [("", [part for part in pattern.split("/") if part])
+            for pattern in patterns]
+    while pending:
+        subpath, parts = pending.pop()
+        if not parts:
+            continue
+        part = parts[0]
+        if glob.has_magic(part):
+            names = listdir(subpath)
+            if not part.startswith("."):
+                # as glob does, hidden files need an explicit dot
+                names = [name for name in names if not name.startswith(".")]
+            names = fnmatch.filter(names, part)
+        else:
+            names = [part]
+        for name in names:
+            childpath = os.path.join(subpath, name)
+            st = getstat(childpath)
+            if st is None:
+                continue
+            if len(parts) > 1:
+                if stat.S_ISDIR(st.st_mode):
+                    pending.append((childpath, parts[1:]))
+            else:
+                found[childpath] = (st.st_size, st.st_mtime)
+    return sorted((subpath, size, mtime)
+            for subpath, (size, mtime) in found.iteritems())
+
+class TailBuffer:
+    """File-like object that only keeps the last maxsize bytes written
+
+    The first chunk kept is skipped up to offset instead of being copied
+    on every write, so at most twice maxsize bytes are held.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.chunks = deque()
+        self.offset = 0
+        self.size = 0
+        self.dropped = 0
+
+    def write(self, data):
+        if not data:
+            return
+        if len(data) >= self.maxsize:
+            self.dropped += self.size + len(data) - self.maxsize
+            self.chunks.clear()
+            self.offset = 0
+            self.size = 0
+            data = data[len(data) - self.maxsize:]
+            if not data:
+                return
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size - (len(self.chunks[0]) - self.offset) \
+                >= self.maxsize:
+            dropped = len(self.chunks.popleft()) - self.offset
+            self.offset = 0
+            self.size -= dropped
+            self.dropped += dropped
+        excess = self.size - self.maxsize
+        if excess > 0:
+            self.offset += excess
+            self.size -= excess
+            self.dropped += excess
+
+    def omitted(self):
+        """Number of bytes written and not kept"""
+        return self.dropped
+
+    def getvalue(self):
+        return "".join(self.chunks)[self.offset:]
@@ -0,0 +1,119 @@
+"""
+Offline end-to-end build simulator, for measuring jurt's own overhead
+
+It runs the real Builder, Spool, ChrootRootManager and JurtRootWrapper,
+but the superuser agent is tests/fake_su_wrapper.py in simulation mode and
+the package manager is SimulatedPackageManager, so that installing,
+building and destroying roots only sleep or do synthetic I/O according to
+a profile (see DEFAULT_PROFILE in tests/fakes.py for its format).
+
+Run from the top directory of the source tree:
+
+    python -m tests.bench_build [--packages N] [--profile FILE]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import resource
+import subprocess
+
+from tests.fakes import SimulatedTarget, SimulatedPackageManager
+
+_Popen = subprocess.Popen
+
+class CountingPopen(_Popen):
+
+    spawned = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.spawned += 1
+        _Popen.__init__(self, *args, **kwargs)
+
+def read_proc_io():
+    """Returns the number of read and write syscalls done by this process"""
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                name, value = line.split(":", 1)
+                counters[name] = int(value)
+    except EnvironmentError:
+        return None
+    return counters.get("syscr", 0) + counters.get("syscw", 0)
+
+def count_calls(obj, name):
+    method = getattr(obj, name)
+    counter = [0]
+    def wrapper(*args, **kwargs):
+        counter[0] += 1
+        return method(*args, **kwargs)
+    setattr(obj, name, wrapper)
+    return counter
+
+def parse_options(args):
+    parser = optparse.OptionParser(usage="python -m tests.bench_build "
+            "[options]")
+    parser.add_option("--packages", type="int", default=100,
+            help="Number of synthetic source packages built")
+    parser.add_option("--outputs", type="int", default=2,
+            help="Number of binary packages built from each source")
+    parser.add_option("--output-size", type="int", default=65536,
+            help="Size in bytes of each binary package")
+    parser.add_option("--profile", default=None,
+            help="JSON file with the step timings (see tests/fakes.py)")
+    parser.add_option("--metadata-delay", type="float", default=0.0,
+            help="Seconds spent on each repository metadata update")
+    parser.add_option("--reuse-root", default=False, action="store_true",
+            help="Build all the packages in the same root")
+    parser.add_option("--dir", default=None,
+            help="Directory where everything is created (default: a "
+                "temporary directory)")
+    return parser.parse_args(args)
+
+def main(args):
+    import json
+    opts, _ = parse_options(args)
+    profile = None
+    if opts.profile:
+        with open(opts.profile) as f:
+            profile = json.load(f)
+    basedir = tempfile.mkdtemp(prefix="jurt-sim-", dir=opts.dir)
+    subprocess.Popen = CountingPopen
+    try:
+        pm = SimulatedPackageManager(opts.outputs, opts.output_size,
+                opts.metadata_delay)
+        target = SimulatedTarget(basedir, profile, pm)
+        paths = target.create_sources(opts.packages)
+        agentcmds = count_calls(target.suwrapper, "_exec_wrapper")
+        usagebefore = resource.getrusage(resource.RUSAGE_SELF)
+        iobefore = read_proc_io()
+        start = time.time()
+        results = target.build("simulated", paths,
+                reuseroot=opts.reuse_root)
+        elapsed = time.time() - start
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        io = read_proc_io()
+        npkgs = max(len(results), 1)
+        cpu = ((usage.ru_utime - usagebefore.ru_utime) +
+                (usage.ru_stime - usagebefore.ru_stime))
+        print "packages built:        %d" % (len(results))
+        print "wall time:             %.3fs (%.2fms/package)" % (elapsed,
+                elapsed * 1000 / npkgs)
+        print "jurt-side CPU time:    %.3fs (%.2fms/package)" % (cpu,
+                cpu * 1000 / npkgs)
+        print "subprocess spawns:     %d (%.2f/package)" % (
+                CountingPopen.spawned, CountingPopen.spawned / float(npkgs))
+        print "agent commands:        %d (%.2f/package)" % (agentcmds[0],
+                agentcmds[0] / float(npkgs))
+        if io is not None:
+            print "read/write syscalls:   %d (%.2f/package)" % (
+                    io - iobefore, (io - iobefore) / float(npkgs))
+    finally:
+        subprocess.Popen = _Popen
+        shutil.rmtree(basedir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
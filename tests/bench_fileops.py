@@ -0,0 +1,108 @@
+"""
+Compares the in-process file operations of the agent (jurtlib.fileops)
+with forking install(1) and cp(1), as done before
+
+Run from the top directory of the source tree:
+
+    python -m tests.bench_fileops [--files N] [--file-size BYTES]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+from jurtlib import fileops
+
+def timed(fun, *args):
+    start = time.time()
+    fun(*args)
+    return time.time() - start
+
+def run(args):
+    subprocess.check_call(args)
+
+def create_files(topdir, count, size):
+    paths = []
+    for i in xrange(count):
+        subdir = os.path.join(topdir, "d%d" % (i // 50))
+        if not os.path.isdir(subdir):
+            os.makedirs(subdir)
+        path = os.path.join(subdir, "f%d" % (i))
+        with open(path, "w") as f:
+            f.write("x" * size)
+        paths.append(path)
+    return paths
+
+def bench_install(paths, destdir, forked):
+    if not os.path.isdir(destdir):
+        os.makedirs(destdir)
+    for path in paths:
+        if forked:
+            run(["install", "-m", "0644", path, destdir])
+        else:
+            fileops.install_file(path, destdir, mode="0644")
+
+def bench_mkdir(topdir, count, forked):
+    # the RPM topdir plus its subdirectories, as in build_prepare
+    names = ("BUILD", "BUILDROOT", "RPMS", "SOURCES", "SPECS", "SRPMS")
+    for i in xrange(count):
+        home = os.path.join(topdir, "home%d" % (i))
+        dirs = [home] + [os.path.join(home, name) for name in names]
+        for path in dirs:
+            if forked:
+                run(["install", "-d", "-m", "0755", path])
+            else:
+                fileops.install_dir(path, mode="0755")
+
+def bench_cheapcopy(source, dest, forked):
+    if forked:
+        run(["cp", "-afl", source, dest])
+    else:
+        fileops.link_tree(source, dest)
+
+def parse_options(args):
+    parser = optparse.OptionParser(usage="python -m tests.bench_fileops "
+            "[options]")
+    parser.add_option("--files", type="int", default=500,
+            help="Number of files copied and linked")
+    parser.add_option("--file-size", type="int", default=16384,
+            help="Size in bytes of each file")
+    parser.add_option("--dirs", type="int", default=50,
+            help="Number of RPM topdirs created")
+    parser.add_option("--dir", default=None,
+            help="Directory where files are created (default: a temporary "
+                "directory)")
+    return parser.parse_args(args)
+
+def main(args):
+    opts, _ = parse_options(args)
+    basedir = tempfile.mkdtemp(prefix="jurt-bench-", dir=opts.dir)
+    try:
+        source = os.path.join(basedir, "source")
+        paths = create_files(source, opts.files, opts.file_size)
+        print "%-12s %8s %12s %12s %8s" % ("operation", "count",
+                "forked(s)", "in-proc(s)", "speedup")
+        results = []
+        for forked in (True, False):
+            kind = ("inproc", "forked")[forked]
+            results.append((
+                timed(bench_install, paths,
+                    os.path.join(basedir, "install-" + kind), forked),
+                timed(bench_mkdir, os.path.join(basedir, "mkdir-" + kind),
+                    opts.dirs, forked),
+                timed(bench_cheapcopy, source,
+                    os.path.join(basedir, "link-" + kind), forked)))
+        forked, inproc = results
+        names = ("copy", "mkdir", "cheapcopy")
+        counts = (opts.files, opts.dirs * 7, 1)
+        for name, count, f, i in zip(names, counts, forked, inproc):
+            print "%-12s %8d %12.3f %12.3f %7.1fx" % (name, count, f, i,
+                    f / max(i, 1e-6))
+    finally:
+        shutil.rmtree(basedir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
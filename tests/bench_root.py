@@ -0,0 +1,196 @@
+"""
+Benchmark of the root lifecycle operations for every registered root type
+
+It uses a fake package manager that populates roots with a synthetic tree
+and a superuser wrapper that runs everything as the current user, so it
+can run on any Linux box. Root types whose filesystem is not available
+are skipped.
+
+Run from the top directory of the source tree:
+
+    python -m tests.bench_root [--roots N] [--files N] [--file-size BYTES]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+import optparse
+import subprocess
+
+from jurtlib.root import root_managers, get_root_manager, Old
+
+from tests.fakes import (LocalSuWrapper, FakePackageManager, root_config,
+        create_state_dirs)
+
+OPERATIONS = ("create_new", "activate_root", "deactivate_root", "keep",
+        "destroy", "clean")
+
+class Timings:
+
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, name, fun, *args, **kwargs):
+        start = time.time()
+        result = fun(*args, **kwargs)
+        self.add(name, time.time() - start)
+        return result
+
+    def add(self, name, elapsed, count=1):
+        self.samples.setdefault(name, []).append((elapsed, count))
+
+    def report(self, name):
+        samples = self.samples.get(name)
+        if not samples:
+            return None
+        total = sum(elapsed for elapsed, _ in samples)
+        count = sum(count for _, count in samples)
+        latencies = [elapsed / max(n, 1) for elapsed, n in samples]
+        return (count, total, min(latencies), total / max(count, 1),
+                max(latencies))
+
+def _unescape_mount_path(raw):
+    return raw.replace("\\040", " ").replace("\\011", "\t")
+
+def filesystem_type(path):
+    path = os.path.realpath(path)
+    found = ""
+    fstype = None
+    with open("/proc/mounts") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 3:
+                continue
+            mountpoint = _unescape_mount_path(fields[1])
+            prefix = mountpoint.rstrip("/") + "/"
+            if ((path + "/").startswith(prefix)
+                    and len(mountpoint) >= len(found)):
+                found = mountpoint
+                fstype = fields[2]
+    return fstype
+
+def available_filesystems():
+    with open("/proc/filesystems") as f:
+        return frozenset(line.split()[-1] for line in f if line.strip())
+
+def mounted_below(basedir):
+    prefix = os.path.realpath(basedir) + "/"
+    found = []
+    with open("/proc/mounts") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) > 1:
+                mountpoint = _unescape_mount_path(fields[1])
+                if mountpoint.startswith(prefix):
+                    found.append(mountpoint)
+    return found
+
+def missing_requirement(roottype, rootspath):
+    if roottype == "chroot-with-btrfs":
+        if filesystem_type(rootspath) != "btrfs":
+            return "%s is not on a btrfs filesystem" % (rootspath)
+    elif roottype == "chroot-with-tmpfs":
+        if "tmpfs" not in available_filesystems():
+            return "tmpfs is not supported by the kernel"
+        if os.geteuid() != 0:
+            return "mounting tmpfs requires running as root"
+    return None
+
+def bench_root_type(roottype, rootspath, opts):
+    create_state_dirs(rootspath)
+    config, rootconf = root_config(rootspath, roottype,
+            extra={"root-max-age": "0", "root-copy-files": "/etc/hosts"})
+    suwrapper = LocalSuWrapper()
+    manager = get_root_manager(suwrapper, rootconf, config)
+    suwrapper.rootmanager = manager
+    pm = FakePackageManager(opts.files, opts.file_size)
+    timings = Timings()
+    roots = []
+    for i in xrange(opts.roots):
+        name = "bench-%d" % (i)
+        root = timings.measure("create_new", manager.create_new, name, pm,
+                None, None)
+        roots.append((name, root))
+    for name, root in roots:
+        timings.measure("activate_root", root.activate)
+    for name, root in roots:
+        timings.measure("deactivate_root", root.deactivate)
+    kept = set()
+    for i, (name, root) in enumerate(roots):
+        # tmpfs roots cannot be reused, so they cannot be kept either
+        if (i % 4 == 0 and root.state is Old
+                and roottype != "chroot-with-tmpfs"):
+            timings.measure("keep", manager.keep, name, pm)
+            kept.add(name)
+    for i, (name, root) in enumerate(roots[:-1]):
+        if i % 2 and name not in kept and root.state is Old:
+            timings.measure("destroy", root.destroy)
+    start = time.time()
+    cleaned = list(manager.clean())
+    timings.add("clean", time.time() - start, len(cleaned))
+    return timings, pm.tree_size()
+
+def print_report(roottype, timings, treesize):
+    print "%s:" % (roottype)
+    print "  %-16s %6s %10s %10s %10s %10s %10s" % ("operation", "count",
+            "total(s)", "min(ms)", "avg(ms)", "max(ms)", "ops/s")
+    for name in OPERATIONS:
+        found = timings.report(name)
+        if found is None:
+            continue
+        count, total, minl, avgl, maxl = found
+        rate = count / total if total else 0.0
+        print "  %-16s %6d %10.3f %10.2f %10.2f %10.2f %10.1f" % (name,
+                count, total, minl * 1000, avgl * 1000, maxl * 1000, rate)
+    found = timings.report("create_new")
+    if found and found[1]:
+        mb = treesize * found[0] / (1024.0 * 1024.0)
+        print "  create_new throughput: %.1f MB/s" % (mb / found[1])
+
+def parse_options(args):
+    parser = optparse.OptionParser(usage="python -m tests.bench_root "
+            "[options]")
+    parser.add_option("--roots", type="int", default=8,
+            help="Number of roots created for each root type")
+    parser.add_option("--files", type="int", default=200,
+            help="Number of files in the synthetic root tree")
+    parser.add_option("--file-size", type="int", default=4096,
+            help="Size in bytes of each file in the synthetic tree")
+    parser.add_option("--types", default=None,
+            help="Comma-separated list of root types (default: all)")
+    parser.add_option("--dir", default=None,
+            help="Directory where roots are created (default: a temporary "
+                "directory)")
+    return parser.parse_args(args)
+
+def main(args):
+    opts, _ = parse_options(args)
+    if opts.types:
+        types = opts.types.split(",")
+    else:
+        types = sorted(root_managers.names())
+    basedir = tempfile.mkdtemp(prefix="jurt-bench-", dir=opts.dir)
+    try:
+        for roottype in types:
+            rootspath = os.path.join(basedir, roottype)
+            create_state_dirs(rootspath)
+            missing = missing_requirement(roottype, rootspath)
+            if missing:
+                print "%s: skipped (%s)" % (roottype, missing)
+                continue
+            try:
+                timings, treesize = bench_root_type(roottype, rootspath,
+                        opts)
+            except Exception, e:
+                print "%s: failed: %s: %s" % (roottype, type(e).__name__, e)
+            else:
+                print_report(roottype, timings, treesize)
+    finally:
+        # failed runs of root types that mount things may leave them behind
+        for mountpoint in reversed(mounted_below(basedir)):
+            subprocess.call(["umount", mountpoint])
+        shutil.rmtree(basedir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
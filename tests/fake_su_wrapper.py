@@ -1,16 +1,173 @@
 #!/usr/bin/python
+import os
 import select
 import sys
+import time
+import shlex
+import shutil
+import optparse
 import subprocess
 
+def agent_parser():
+    parser = optparse.OptionParser()
+    for opt in ("--type", "--target", "--root", "--arch", "--run-as", "--pm",
+            "--timeout", "-u", "-g", "-m"):
+        parser.add_option(opt, type="string", default=None)
+    for opt in ("--ignore-errors", "--quiet", "--ignore-stderr",
+            "--remount"):
+        parser.add_option(opt, action="store_true", default=False)
+    return parser
+
+class Simulator:
+    """Pretends to be jurt-root-command, following a recorded profile
+
+    The profile is a JSON file with one entry for each step (install,
+    remove, build, extract, describe, destroy), each one with the keys 'sleep' (seconds)
+    and 'io' (number of bytes written to a scratch file). The optional
+    key 'maxrss' is reported as the peak RSS of the step.
+    """
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.parser = agent_parser()
+        self.results = {}
+
+    def step(self, name, root=None):
+        conf = self.profile.get(name, {})
+        if conf.get("maxrss"):
+            self.results["maxrss"] = conf["maxrss"]
+        delay = conf.get("sleep", 0)
+        if delay:
+            time.sleep(delay)
+        size = conf.get("io", 0)
+        if size:
+            scratch = os.path.join(root or "/tmp",
+                    ".jurt-sim-%d" % (os.getpid()))
+            with open(scratch, "w") as f:
+                chunk = "x" * 65536
+                for i in xrange(0, size, len(chunk)):
+                    f.write(chunk[:size - i])
+                f.flush()
+                os.fsync(f.fileno())
+            os.unlink(scratch)
+
+    def _copy(self, sources, dest):
+        for source in sources:
+            if os.path.isdir(dest):
+                target = os.path.join(dest, os.path.basename(source))
+            else:
+                target = dest
+            shutil.copyfile(source, target)
+
+    def _linktree(self, source, dest):
+        # the spool has to be hardlinked as in the real agent
+        subprocess.check_call(["cp", "-afl", source, dest])
+
+    def _runcmd(self, opts, args):
+        root = opts.root
+        if not args:
+            return
+        if args[0] == "fake-extract":
+            self.step("extract", root)
+            specpath = root + args[1]
+            specdir = os.path.dirname(specpath)
+            if not os.path.isdir(specdir):
+                os.makedirs(specdir)
+            open(specpath, "w").close()
+        elif args[0] == "fake-build":
+            self.step("build", root)
+            outdir = root + args[1]
+            count, size = int(args[2]), int(args[3])
+            if not os.path.isdir(outdir):
+                os.makedirs(outdir)
+            for i in xrange(count):
+                path = os.path.join(outdir, "%s-sub%d-1-1.x86_64.rpm" %
+                        (args[4], i))
+                with open(path, "w") as f:
+                    f.write("x" * size)
+        elif args[0] == "rm":
+            for path in args[1:]:
+                if not path.startswith("-"):
+                    shutil.rmtree(root + path, ignore_errors=True)
+        elif args[0] == "fake-output":
+            for i in xrange(int(args[1])):
+                sys.stdout.write("line %d\n" % (i))
+            sys.stdout.flush()
+            if args[2:] == ["fail"]:
+                raise Exception("failed after the output")
+        elif args[0] == "fake-describe":
+            self.step("describe", root)
+            sys.stdout.write("n=basesystem e=(none) v=1 r=1 de=(none) "
+                    "dt=(none)\n")
+            sys.stdout.flush()
+
+    def handle(self, line):
+        opts, args = self.parser.parse_args(shlex.split(line)[1:])
+        type = opts.type
+        if type == "mkdir":
+            for path in args:
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+        elif type in ("copy", "copyout"):
+            self._copy(args[:-1], args[-1])
+        elif type == "cheapcopy":
+            self._linktree(args[0], args[1])
+        elif type == "rename":
+            os.rename(args[0], args[1])
+        elif type in ("destroyroot", "destroyroots"):
+            for path in args:
+                self.step("destroy")
+                shutil.rmtree(path)
+        elif type == "runpm":
+            if opts.pm == "urpme":
+                self.step("remove", opts.root)
+            else:
+                self.step("install", opts.root)
+        elif type == "runcmd":
+            self._runcmd(opts, args)
+        elif type == "diskusage":
+            size = 0
+            for dirpath, dirnames, filenames in os.walk(args[0]):
+                for name in filenames:
+                    size += os.lstat(os.path.join(dirpath, name)).st_size
+            self.results["size"] = size
+
+    def loop(self, cookie):
+        while True:
+            line = sys.stdin.readline()
+            if not line:
+                return
+            self.results = {}
+            try:
+                self.handle(line)
+            except Exception, e:
+                sys.stderr.write("\n%s ERROR 1 %s\n" % (cookie, e))
+            else:
+                results = "".join(" %s=%s" % item
+                        for item in sorted(self.results.items()))
+                sys.stderr.write("\n%s OK%s\n" % (cookie, results))
+            sys.stderr.flush()
+
+def simulate(profilepath, cookie):
+    import json
+    with open(profilepath) as f:
+        profile = json.load(f)
+    Simulator(profile).loop(cookie)
+
 def main():
     cookie = None
+    resultfile = None
+    profile = None
     for i, arg in enumerate(sys.argv):
         if arg == "--cookie":
             cookie = sys.argv[i+1]
         elif arg == "--result":
             resultfile = sys.argv[i+1]
-    if cookie:
+        elif arg == "--simulate":
+            profile = sys.argv[i+1]
+    if profile:
+        simulate(profile, cookie)
+    elif cookie:
         with open(resultfile, "w") as f:
             while True:
                 rl, wl, xl = select.select([sys.stdin.fileno()], [],
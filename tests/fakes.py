@@ -0,0 +1,416 @@
+"""
+Fake collaborators that allow exercising root managers and builders
+without sudo, mounts or a real package manager
+"""
+import os
+import time
+import shutil
+import subprocess
+
+from jurtlib import CommandError
+
+class Recorder:
+
+    def __init__(self):
+        self.calls = []
+
+    def record(self, name, *args):
+        self.calls.append((name,) + args)
+
+class LocalSuWrapper(Recorder):
+    """Runs the superuser operations in-process as the current user
+
+    Operations that really need privileges (mknod, mounting, adding users)
+    are only recorded. The commands configured in the root manager (destroy,
+    compress, btrfs) are really executed so that their cost is accounted.
+    """
+
+    def __init__(self, rootmanager=None):
+        Recorder.__init__(self)
+        self.rootmanager = rootmanager
+
+    def _run(self, args):
+        proc = subprocess.Popen(args=args, shell=False,
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        output = proc.communicate()[0]
+        if proc.returncode != 0:
+            raise CommandError(proc.returncode,
+                    subprocess.list2cmdline(args), output)
+        return output
+
+    def add_user(self, username, uid, root=None, arch=None):
+        self.record("adduser", username, uid, root)
+
+    def run_package_manager(self, pmname, pmargs, root=None, arch=None,
+            outputlogger=None):
+        self.record("runpm", pmname, pmargs, root)
+        return ""
+
+    def run_as(self, args, user, root=None, arch=None, timeout=None,
+            outputlogger=None, quiet=False, ignorestderr=False,
+            remount=False, linehandler=None):
+        self.record("runcmd", args, user, root)
+        return ""
+
+    def rename(self, srcpath, dstpath):
+        self.record("rename", srcpath, dstpath)
+        try:
+            os.rename(srcpath, dstpath)
+        except OSError, e:
+            # as the agent reports it
+            raise CommandError(1, "rename", str(e))
+
+    def mkdir(self, path_or_paths, uid=None, gid=None, mode="0755"):
+        if isinstance(path_or_paths, basestring):
+            paths = [path_or_paths]
+        else:
+            paths = path_or_paths
+        for path in paths:
+            if not os.path.isdir(path):
+                os.makedirs(path, int(mode, 8))
+
+    def create_devs(self, root):
+        self.record("createdevs", root)
+        devdir = os.path.join(root, "dev")
+        if not os.path.isdir(devdir):
+            os.makedirs(devdir)
+
+    def _copy_into(self, srcpaths, dstpath, mode):
+        for srcpath in srcpaths:
+            if os.path.isdir(dstpath):
+                dest = os.path.join(dstpath, os.path.basename(srcpath))
+            else:
+                dest = dstpath
+            shutil.copyfile(srcpath, dest)
+            if mode is not None:
+                os.chmod(dest, int(mode, 8))
+
+    def copy(self, src_path_or_paths, dstpath, uid=None, gid=None,
+            mode="0644"):
+        if isinstance(src_path_or_paths, basestring):
+            src_path_or_paths = [src_path_or_paths]
+        self._copy_into(src_path_or_paths, dstpath, mode)
+
+    def copyout(self, srcpaths, dstpath, uid=None, gid=None, mode="0644"):
+        self._copy_into(srcpaths, dstpath, mode)
+
+    def cheapcopy(self, srcpath, dstpath):
+        self._run(["cp", "-afl", srcpath, dstpath])
+
+    def mount_virtual_filesystems(self, root, arch=None):
+        self.record("mountall", root)
+
+    def umount_virtual_filesystems(self, root, arch=None):
+        self.record("umountall", root)
+
+    def compress_root(self, root, file):
+        tmpname = file + ".tmp"
+        self._run(self.rootmanager.root_compress_command(root, tmpname))
+        os.rename(tmpname, file)
+
+    def decompress_root(self, file, root):
+        self._run(self.rootmanager.root_decompress_command(root, file))
+
+    def mount_tmpfs(self, root, size=None):
+        self._run(self.rootmanager.mount_root_command(root, size))
+
+    def umount_tmpfs(self, root):
+        self._run(self.rootmanager.umount_root_command(root))
+
+    def post_root_command(self, root=None, arch=None):
+        self.record("postcommand", root)
+
+    def interactive_prepare_conf(self, username, root=None, arch=None):
+        self.record("interactiveprepare", username, root)
+
+    def test_sudo(self, interactive=True):
+        self.record("test")
+
+    def btrfs_snapshot(self, from_, to):
+        self._run(self.rootmanager.snapsvcmd + [from_, to])
+
+    def btrfs_create(self, dest):
+        self._run(self.rootmanager.newsvcmd + [dest])
+
+    def destroy_root(self, path):
+        self._run(self.rootmanager.root_destroy_command() + [path])
+
+    def destroy_roots(self, paths):
+        self.record("destroyroots", paths)
+        for path in paths:
+            self.destroy_root(path)
+
+    def disk_usage(self, root):
+        from jurtlib import util
+        self.record("diskusage", root)
+        return util.tree_size(root)
+
+    def max_rss(self, reset=False):
+        return 0
+
+    def sibling(self):
+        sibling = LocalSuWrapper(self.rootmanager)
+        sibling.calls = self.calls
+        return sibling
+
+    def stop(self):
+        self.record("stop")
+
+class FakePackageManager(Recorder):
+    """Populates roots with a synthetic tree of nfiles of filesize bytes"""
+
+    def __init__(self, nfiles=100, filesize=4096, filesperdir=50,
+            arch="x86_64"):
+        Recorder.__init__(self)
+        self.nfiles = nfiles
+        self.filesize = filesize
+        self.filesperdir = filesperdir
+        self.arch = arch
+
+    def tree_size(self):
+        return self.nfiles * self.filesize
+
+    def create_root(self, suwrapper, repos, path, logger, interactive):
+        self.record("create_root", path)
+        for name in ("etc", "tmp", "usr"):
+            subdir = os.path.join(path, name)
+            if not os.path.isdir(subdir):
+                os.makedirs(subdir)
+        data = "x" * self.filesize
+        for i in xrange(self.nfiles):
+            subdir = os.path.join(path, "usr", "d%d" % (i // self.filesperdir))
+            if not os.path.isdir(subdir):
+                os.mkdir(subdir)
+            with open(os.path.join(subdir, "f%d" % (i)), "w") as f:
+                f.write(data)
+
+    def system_arch(self):
+        return self.arch
+
+    def repos_from_config(self, configstr):
+        return None
+
+def root_config(rootspath, roottype="chroot", targetname="fake",
+        extra=None):
+    """Creates a target configuration using rootspath as roots-path"""
+    from jurtlib.config import JurtConfig
+    values = {"roots-path": rootspath, "root-type": roottype,
+            "root-index-file": os.path.join(rootspath, "index",
+                "roots.journal")}
+    if extra:
+        values.update(extra)
+    lines = ["[target %s]" % (targetname)]
+    lines.extend("%s = %s" % item for item in values.iteritems())
+    config = JurtConfig()
+    config.parse("\n".join(lines) + "\n")
+    return config, dict(config.targets())[targetname]
+
+def create_state_dirs(rootspath):
+    from jurtlib.root import STATE_DIRS
+    for name in STATE_DIRS:
+        path = os.path.join(rootspath, name)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+class SourceInfo:
+
+    def __init__(self, path):
+        basename = os.path.basename(path)
+        if basename.endswith(".src.rpm"):
+            basename = basename[:-len(".src.rpm")]
+        self.name, self.version, self.release = basename.rsplit("-", 2)
+        self.requires = []
+
+class SimulatedPackageManager(Recorder):
+    """Package manager that delegates its work to the simulated agent
+
+    The fake-* commands are interpreted by fake_su_wrapper.py --simulate,
+    which sleeps and does synthetic I/O as described by its profile.
+    """
+
+    def __init__(self, outputs=2, outputsize=65536, metadatadelay=0.0,
+            requires=None):
+        Recorder.__init__(self)
+        self.outputs = outputs
+        self.outputsize = outputsize
+        self.metadatadelay = metadatadelay
+        self.requires = requires or {}
+
+    def repos_from_config(self, configstr):
+        return None
+
+    def system_arch(self):
+        return "x86_64"
+
+    def get_source_info(self, path):
+        self.record("get_source_info", path)
+        info = SourceInfo(path)
+        info.requires = self.requires.get(info.name, [])
+        return info
+
+    def check_source_package(self, path):
+        self.get_source_info(path)
+
+    def missing_build_deps(self, deps, repos):
+        self.record("missing_build_deps", deps)
+        return [dep for dep in deps if dep.startswith("missing-")]
+
+    def valid_binary(self, path):
+        return path.endswith(".rpm") and not path.endswith(".src.rpm")
+
+    def update_repository_metadata(self, path):
+        self.record("update_repository_metadata", path)
+        if self.metadatadelay:
+            time.sleep(self.metadatadelay)
+
+    def create_root(self, suwrapper, repos, path, logger, interactive):
+        self.record("create_root", path)
+        suwrapper.run_package_manager("urpmi", ["--auto", "--root", path],
+                root=path)
+
+    def snapshot(self, root, username):
+        root.su().run_as(["fake-describe"], user=username, quiet=True)
+        return frozenset()
+
+    def rollback(self, root, username, snapshot, logstore):
+        self.record("rollback")
+        root.su().run_package_manager("urpme", ["--auto"])
+        return True
+
+    def reset_build_dirs(self, root, homedir, username):
+        args = ["rm", "-rf"]
+        args.extend(os.path.join(homedir, name)
+                for name in ("RPMS", "SOURCES", "SPECS", "SRPMS"))
+        root.su().run_as(args, user=username, quiet=True)
+
+    def setup_repositories(self, root, repos, logstore, spool=None):
+        if spool is not None and spool.package_count():
+            root.make_spool_reachable(spool)
+            root.su().run_package_manager("urpmi.addmedia",
+                    ["build-spool", spool.path])
+
+    def build_prepare(self, root, homedir, username, uid):
+        dirs = [homedir]
+        dirs.extend(os.path.join(homedir, name)
+                for name in ("RPMS", "SOURCES", "SPECS", "SRPMS"))
+        root.mkdir(dirs, uid=uid)
+
+    def extract_source(self, path, root, username, homedir, logstore):
+        info = SourceInfo(path)
+        specpath = os.path.join(homedir, "SPECS", info.name + ".spec")
+        root.su().run_as(["fake-extract", specpath], user=username)
+        return specpath
+
+    def install_build_deps(self, srcpath, root, username, homedir, repos,
+            logstore, spool):
+        root.make_spool_reachable(spool)
+        outputlogger = logstore.get_output_handler("build-deps-install")
+        try:
+            root.su().run_package_manager("urpmi", ["--auto",
+                "--buildrequires", srcpath], outputlogger=outputlogger)
+        finally:
+            outputlogger.close()
+
+    def describe_root(self, root, username, logstore):
+        outputlogger = logstore.get_output_handler("packages-list")
+        try:
+            root.su().run_as(["fake-describe"], user=username,
+                    outputlogger=outputlogger)
+        finally:
+            outputlogger.close()
+
+    def build_source(self, sourcepath, root, logstore, username, homedir,
+            spool, stage=None, timeout=None):
+        name = os.path.basename(sourcepath)[:-len(".spec")]
+        outdir = os.path.join(homedir, "RPMS", "x86_64")
+        outputlogger = logstore.get_output_handler("build")
+        try:
+            root.su().run_as(["fake-build", outdir, str(self.outputs),
+                str(self.outputsize), name], user=username,
+                outputlogger=outputlogger, timeout=timeout)
+        finally:
+            outputlogger.close()
+        found = root.glob(os.path.join(homedir, "RPMS/*/*.rpm"))
+        return None, True, found
+
+DEFAULT_PROFILE = {
+        "install": {"sleep": 0.0, "io": 0},
+        "remove": {"sleep": 0.0, "io": 0},
+        "extract": {"sleep": 0.0, "io": 0},
+        "describe": {"sleep": 0.0, "io": 0},
+        "build": {"sleep": 0.0, "io": 0},
+        "destroy": {"sleep": 0.0, "io": 0}}
+
+class AllowAllChecker:
+
+    def check_filesystem_permissions(self):
+        pass
+
+class SimulatedTarget:
+    """A real Builder/ChrootRootManager/JurtRootWrapper setup that talks to
+    fake_su_wrapper.py in simulation mode instead of jurt-root-command"""
+
+    def __init__(self, basedir, profile=None, pm=None, options=None):
+        import json
+        from jurtlib import su, build, logger
+        from jurtlib.root import ChrootRootManager
+        profile = profile or DEFAULT_PROFILE
+        self.basedir = basedir
+        if not os.path.isdir(basedir):
+            os.makedirs(basedir)
+        self.profilepath = os.path.join(basedir, "profile.json")
+        with open(self.profilepath, "w") as f:
+            json.dump(profile, f)
+        dirs = {}
+        for name in ("roots", "spools", "logs", "fail", "success",
+                "delivery", "sources"):
+            dirs[name] = os.path.join(basedir, name)
+            if not os.path.isdir(dirs[name]):
+                os.makedirs(dirs[name])
+        create_state_dirs(dirs["roots"])
+        fake = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                "fake_su_wrapper.py")
+        extra = {"spool-dir": dirs["spools"],
+                "logs-dir": dirs["logs"],
+                "failure-dir": dirs["fail"],
+                "success-dir": dirs["success"],
+                "delivery-dir": dirs["delivery"],
+                "root-copy-files": "",
+                "build-history-file": os.path.join(basedir, "history.sqlite"),
+                "artifact-store-dir": os.path.join(basedir, "artifacts"),
+                "sudo-command": "%s --simulate %s" % (fake,
+                    self.profilepath)}
+        extra.update(options or {})
+        self.config, self.targetconf = root_config(dirs["roots"], "chroot",
+                extra=extra)
+        self.dirs = dirs
+        self.suwrapper = su.JurtRootWrapper("fake", self.targetconf,
+                self.config)
+        self.packagemanager = pm or SimulatedPackageManager()
+        self.rootmanager = ChrootRootManager(self.suwrapper, self.targetconf,
+                self.config)
+        self.builder = build.Builder(self.rootmanager, self.packagemanager,
+                self.targetconf, self.config)
+        self.loggerfactory = logger.LoggerFactory(self.targetconf,
+                self.config)
+
+    def target(self, name):
+        """A jurtlib.target.Target using the simulated setup"""
+        from jurtlib.target import Target
+        return Target(name, self.rootmanager, self.packagemanager,
+                self.builder, self.loggerfactory, AllowAllChecker())
+
+    def create_sources(self, count, size=1024):
+        paths = []
+        for i in xrange(count):
+            path = os.path.join(self.dirs["sources"],
+                    "pkg%04d-1.0-1.src.rpm" % (i))
+            with open(path, "w") as f:
+                f.write("s" * size)
+            paths.append(path)
+        return paths
+
+    def build(self, id, paths, keepbuilding=False, reuseroot=False):
+        logstore = self.loggerfactory.get_logger(id)
+        return self.builder.build(id, True, paths, logstore,
+                keepbuilding=keepbuilding, reuseroot=reuseroot)
@@ -0,0 +1,46 @@
+import os
+
+import tests
+
+from jurtlib.artifacts import ArtifactStore, file_digest
+
+class TestArtifactStore(tests.Test):
+
+    def setUp(self):
+        super(TestArtifactStore, self).setUp()
+        self.store = ArtifactStore(os.path.join(self.spooldir, "artifacts"))
+
+    def _write(self, name, data):
+        path = os.path.join(self.spooldir, name)
+        with open(path, "w") as f:
+            f.write(data)
+        return path
+
+    def test_deduplication(self):
+        first = self._write("first.rpm", "x" * 1000)
+        second = self._write("second.rpm", "x" * 1000)
+        other = self._write("other.rpm", "y" * 10)
+        self.assertEquals(self.store.add_files([first, other]), 0)
+        self.assertEquals(self.store.add(second), 1000)
+        self.assertTrue(os.path.samefile(first, second))
+        self.assertTrue(os.path.samefile(first,
+            self.store.object_path(file_digest(first))))
+        self.assertEquals(self.store.add(second), 0)
+        self.assertEquals(self.store.usage(), (2, 1010, 2010))
+
+    def test_store_files(self):
+        first = self._write("first.rpm", "x" * 1000)
+        second = self._write("second.rpm", "x" * 1000)
+        digests, saved = self.store.store_files([first, second])
+        self.assertEquals(digests, [file_digest(first)] * 2)
+        self.assertEquals(saved, 1000)
+
+    def test_collect(self):
+        first = self._write("first.rpm", "x" * 1000)
+        other = self._write("other.rpm", "y" * 10)
+        self.store.add_files([first, other])
+        os.unlink(other)
+        removed = list(self.store.collect(dry_run=True))
+        self.assertEquals([size for _, size in removed], [10])
+        self.assertEquals(list(self.store.collect()), removed)
+        self.assertEquals(self.store.usage(), (1, 1000, 1000))
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+
+from jurtlib.build import BuildError
+from tests import Test
+from tests.fakes import SimulatedTarget
+
+class TestSimulatedBuild(Test):
+
+    def setUp(self):
+        Test.setUp(self)
+        self.basedir = tempfile.mkdtemp(prefix="jurt-test-")
+
+    def tearDown(self):
+        Test.tearDown(self)
+        shutil.rmtree(self.basedir, ignore_errors=True)
+
+    def test_build_and_deliver(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(3)
+        results = target.build("sim", paths)
+        self.assertEquals(len(results), 3)
+        self.assertTrue(all(result.success for result in results))
+        topdir = os.path.join(target.dirs["delivery"], "sim")
+        for result in results:
+            pkgsdir = os.path.join(topdir, result.sourceid, "packages")
+            self.assertEquals(len(os.listdir(pkgsdir)), 2)
+        with open(os.path.join(topdir, "status")) as f:
+            self.assertEquals(f.read(), "success\n")
+        self.assertEquals(os.listdir(target.dirs["roots"] + "/active"), [])
+
+    def test_packages_stored_once(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(2)
+        results = target.build("sim", paths)
+        store = target.builder.artifacts
+        # the simulated packages all have the same contents
+        count, stored, linked = store.usage()
+        self.assertEquals(count, 1)
+        self.assertTrue(linked >= 3 * 4 * stored)
+        for result in results:
+            pkgsdir = os.path.join(target.dirs["delivery"], "sim",
+                    result.sourceid, "packages")
+            for name in os.listdir(pkgsdir):
+                self.assertTrue(os.path.samefile(os.path.join(pkgsdir, name),
+                    result.builtpaths[0]))
+
+    def test_unchanged_sources_not_rebuilt(self):
+        target = SimulatedTarget(self.basedir,
+                options={"build-cache-ttl": "1",
+                    "build-order": "command-line"})
+        paths = target.create_sources(2)
+        target.build("first", paths)
+        with open(paths[1], "a") as f:
+            f.write("changed")
+        calls = target.packagemanager.calls
+        del calls[:]
+        results = target.build("second", paths)
+        self.assertTrue(all(result.success for result in results))
+        self.assertEquals([call[0] for call in calls].count("create_root"),
+                1)
+        self.assertEquals(results[0].stats, None)
+        self.assertNotEquals(results[1].stats, None)
+        pkgsdir = os.path.join(target.dirs["delivery"], "second",
+                results[0].sourceid, "packages")
+        self.assertEquals(len(os.listdir(pkgsdir)), 2)
+        spool = os.path.join(target.dirs["spools"], "second")
+        self.assertEquals(len([name for name in os.listdir(spool)
+            if name.endswith(".rpm")]), 4)
+
+    def test_build_reusing_root(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(3)
+        results = target.build("sim", paths, reuseroot=True)
+        self.assertTrue(all(result.success for result in results))
+        for result in results:
+            self.assertEquals(len(result.builtpaths), 2)
+            names = [os.path.basename(path) for path in result.builtpaths]
+            self.assertTrue(all(name.startswith(result.sourceid[:7])
+                for name in names), names)
+        calls = [call[0] for call in target.packagemanager.calls]
+        self.assertEquals(calls.count("create_root"), 1)
+        self.assertEquals(calls.count("rollback"), 2)
+
+    def test_history_recorded(self):
+        profile = {"build": {"maxrss": 4096}}
+        target = SimulatedTarget(self.basedir, profile=profile)
+        paths = target.create_sources(2)
+        results = target.build("sim", paths)
+        for result in results:
+            phases = [name for name, _ in result.stats.phases]
+            self.assertEquals(phases, ["root", "setup", "prepare",
+                "builddeps", "build", "copyout", "deliver"])
+            self.assertEquals(result.stats.maxrss, 4096)
+            self.assertTrue(result.stats.diskusage > 0)
+        estimates = list(target.builder.estimate(paths))
+        self.assertEquals([sourceid for sourceid, _ in estimates],
+                [result.sourceid for result in results])
+        self.assertTrue(all(duration > 0 for _, duration in estimates))
+
+    def test_sources_read_once(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(3)
+        list(target.target("sim").estimate(paths))
+        target.builder.order_sources(paths)
+        calls = [call for call in target.packagemanager.calls
+                if call[0] == "get_source_info"]
+        self.assertEquals(calls, [("get_source_info", path)
+            for path in paths])
+
+    def test_longest_first_order(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(3)
+        target.build("first", paths)
+        # pretend the last one took much longer
+        conn = target.builder.history._connect()
+        with conn:
+            for name, duration in (("pkg0000", 5), ("pkg0001", 1),
+                    ("pkg0002", 1000)):
+                conn.execute("UPDATE builds SET duration = ? WHERE "
+                        "package = ?", (duration, name))
+        self.assertEquals(target.builder.order_sources(paths),
+                [paths[2], paths[0], paths[1]])
+        target.packagemanager.requires = {"pkg0002": ["pkg0001-devel"]}
+        target.builder.sourceinfo.clear()
+        self.assertEquals(target.builder.order_sources(paths),
+                [paths[0], paths[1], paths[2]])
+
+    def test_preflight_failures(self):
+        target = SimulatedTarget(self.basedir)
+        paths = target.create_sources(3)
+        target.packagemanager.requires = {"pkg0001": ["missing-devel",
+            "pkg0000-devel"], "pkg0002": ["missing-lib"]}
+        try:
+            target.build("sim", paths)
+        except BuildError, e:
+            message = str(e)
+        else:
+            self.fail("the build should not start")
+        self.assertTrue("pkg0001-1.0-1.src.rpm" in message, message)
+        self.assertTrue("missing-lib" in message, message)
+        # pkg0000-devel will come from the spool
+        self.assertFalse("pkg0000-devel" in message, message)
+        calls = [call[0] for call in target.packagemanager.calls]
+        self.assertFalse("create_root" in calls)
+        self.assertEquals(os.listdir(target.dirs["spools"]), [])
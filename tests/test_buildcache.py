@@ -0,0 +1,61 @@
+import os
+import time
+
+import tests
+
+from jurtlib.artifacts import ArtifactStore
+from jurtlib.buildcache import BuildCache, cache_key
+
+class TestBuildCache(tests.Test):
+
+    def setUp(self):
+        super(TestBuildCache, self).setUp()
+        self.store = ArtifactStore(os.path.join(self.spooldir, "artifacts"))
+        self.cache = BuildCache(os.path.join(self.spooldir, "builds"),
+                self.store, 60)
+        self.built = os.path.join(self.spooldir, "foo-1-1.x86_64.rpm")
+        with open(self.built, "w") as f:
+            f.write("x" * 100)
+        self.digests, _ = self.store.store_files([self.built])
+
+    def test_key(self):
+        key = cache_key([("source", "abc"), ("spool", ["foo.rpm"])])
+        self.assertEquals(key, cache_key([("source", "abc"),
+            ("spool", ["foo.rpm"])]))
+        self.assertNotEquals(key, cache_key([("source", "abc"),
+            ("spool", [])]))
+
+    def test_record_and_restore(self):
+        key = cache_key([("source", "abc")])
+        self.assertEquals(self.cache.lookup(key), None)
+        self.cache.record(key, "foo-1-1", "build1", [self.built],
+                self.digests)
+        entry = self.cache.lookup(key)
+        self.assertEquals(entry["id"], "build1")
+        destdir = os.path.join(self.spooldir, "restored")
+        paths = self.cache.restore(entry, destdir)
+        self.assertEquals(paths, [os.path.join(destdir,
+            "foo-1-1.x86_64.rpm")])
+        self.assertTrue(os.path.samefile(paths[0], self.built))
+
+    def test_expired_and_missing(self):
+        old = cache_key([("source", "old")])
+        gone = cache_key([("source", "gone")])
+        self.cache.record(old, "foo-1-1", "build1", [self.built],
+                self.digests)
+        self.cache.record(gone, "foo-1-1", "build2", [self.built],
+                self.digests)
+        path = self.cache._entry_path(old)
+        past = time.time() - 120
+        with open(path) as f:
+            data = f.read()
+        with open(path, "w") as f:
+            f.write(data.replace('"time": ', '"time": %f, "was": ' % (past)))
+        self.assertEquals(self.cache.lookup(old), None)
+        self.assertNotEquals(self.cache.lookup(gone), None)
+        os.unlink(self.built)
+        list(self.store.collect())
+        self.assertEquals(self.cache.lookup(gone), None)
+        self.assertEquals(len(list(self.cache.collect(dry_run=True))), 2)
+        self.assertEquals(len(list(self.cache.collect())), 2)
+        self.assertEquals(list(self.cache.collect()), [])
@@ -20,3 +20,9 @@ class TestCmd(tests.Test):
         output, status = run(args)
         self.assertEquals(output, "oops\n")
         self.assertEquals(status, 0)
+
+    def test_large_output(self):
+        # more than a pipe buffer holds
+        output, status = run(["seq", "100000"])
+        self.assertEquals(len(output.splitlines()), 100000)
+        self.assertEquals(status, 0)
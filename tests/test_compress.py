@@ -0,0 +1,51 @@
+import os
+import subprocess
+
+import tests
+
+from jurtlib import CommandError, compress
+
+class TestCompress(tests.Test):
+
+    def _logs(self, count):
+        pairs = []
+        for i in xrange(count):
+            path = os.path.join(self.spooldir, "log%d" % (i))
+            with open(path, "w") as f:
+                f.write("line %d\n" % (i) * (1000 * (i + 1)))
+            pairs.append((path, path + ".xz"))
+        return pairs
+
+    def test_xz_preset(self):
+        self.assertEquals(compress.xz_preset(["xz", "-9c"]), 9)
+        self.assertEquals(compress.xz_preset(["/usr/bin/xz", "-c"]), 6)
+        self.assertEquals(compress.xz_preset(["xz", "-c", "-3"]), 3)
+        self.assertEquals(compress.xz_preset(["xz", "-9"]), None)
+        self.assertEquals(compress.xz_preset(["xz", "-9c", "-T0"]), None)
+        self.assertEquals(compress.xz_preset(["gzip", "-9c"]), None)
+
+    def test_compress_files(self):
+        pairs = self._logs(5)
+        compress.compress_files(pairs, ["xz", "-9c"], 3)
+        for path, destpath in pairs:
+            with open(path) as f:
+                expected = f.read()
+            output = subprocess.Popen(["xz", "-dc", destpath],
+                    stdout=subprocess.PIPE).communicate()[0]
+            self.assertEquals(output, expected)
+
+    def test_in_process(self):
+        if compress.lzma is None:
+            self.skipTest("no lzma module")
+        pairs = self._logs(1)
+        compress.compress_files(pairs, ["xz", "-9c"], 1)
+        with open(pairs[0][0]) as f:
+            expected = f.read()
+        output = subprocess.Popen(["xz", "-dc", pairs[0][1]],
+                stdout=subprocess.PIPE).communicate()[0]
+        self.assertEquals(output, expected)
+
+    def test_failure(self):
+        pairs = self._logs(2)
+        self.assertRaises(CommandError, compress.compress_files, pairs,
+                ["false"], 2)
@@ -0,0 +1,80 @@
+import os
+import time
+
+import tests
+
+from jurtlib.executor import ChrootExecutor, ExecutorError, TIMEOUT_STATUS
+
+class TestExecutor(tests.Test):
+
+    def _running(self, pid):
+        # it may be left as a zombie until someone reaps it
+        for i in xrange(50):
+            try:
+                with open("/proc/%d/stat" % (pid)) as f:
+                    state = f.read().rsplit(")", 1)[1].split()[0]
+            except IOError:
+                return False
+            if state in "ZX":
+                return False
+            time.sleep(0.1)
+        return True
+
+    def test_run_commands(self):
+        if os.geteuid() != 0:
+            return
+        executor = ChrootExecutor("/")
+        executor.start()
+        try:
+            self.assertEquals(executor.run(["true"], shell=False)[0], 0)
+            returncode, maxrss = executor.run(["sh", "-c", "exit 3"],
+                    shell=False)
+            self.assertEquals(returncode, 3)
+            self.assertTrue(maxrss > 0)
+            self.assertEquals(executor.run(["sleep", "5"], shell=False,
+                timeout=1)[0], TIMEOUT_STATUS)
+            # the same executor keeps serving after a timeout
+            self.assertEquals(executor.run(["true"], shell=False)[0], 0)
+            # the processes started by a command are killed too
+            pidfile = os.path.join(self.spooldir, "child.pid")
+            self.assertEquals(executor.run(["sh", "-c", "(trap '' TERM; "
+                "exec sleep 30) & echo $! > %s; wait" % (pidfile)],
+                shell=False, timeout=1)[0], TIMEOUT_STATUS)
+            with open(pidfile) as f:
+                child = int(f.read())
+            self.assertFalse(self._running(child))
+        finally:
+            executor.stop()
+        self.assertFalse(executor.alive())
+
+    def test_dead_executor(self):
+        if os.geteuid() != 0:
+            return
+        executor = ChrootExecutor(os.path.join(self.spooldir, "missing"))
+        executor.start()
+        self.assertRaises(ExecutorError, executor.run, ["true"],
+                shell=False)
+
+    def test_minimal_root(self):
+        if os.geteuid() != 0:
+            return
+        import sys
+        import subprocess
+        root = os.path.join(self.spooldir, "minimal")
+        os.makedirs(os.path.join(root, "etc"))
+        with open(os.path.join(root, "etc", "passwd"), "w") as f:
+            f.write("root:x:0:0:root:/:/bin/sh\n")
+        with open(os.path.join(root, "etc", "group"), "w") as f:
+            f.write("root:x:0:\n")
+        # in a fresh interpreter, where nothing else has loaded the
+        # modules it needs inside the root
+        script = ("from jurtlib.executor import ChrootExecutor\n"
+                "executor = ChrootExecutor(%r, user='root')\n"
+                "executor.start()\n"
+                "print executor.run(['/missing'], shell=False)[0]\n"
+                "executor.stop()\n" % (root))
+        proc = subprocess.Popen([sys.executable, "-c", script],
+                cwd=os.path.dirname(self.rootdir), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE)
+        output, errors = proc.communicate()
+        self.assertEquals(output.strip(), "127", errors)
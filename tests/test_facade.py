@@ -1,10 +1,128 @@
+import os
+import shutil
+import tempfile
+import time
+
 import tests
 
 from jurtlib.config import JurtConfig
 from jurtlib.facade import JurtFacade
 
+from tests.fakes import SimulatedTarget
+
 class TestFacade(tests.Test):
     
     def test_create_facade(self):
         config = JurtConfig()
         facade = JurtFacade(config)
+
+    def test_build_targets(self):
+        config, _ = self.sample_config()
+        facade = JurtFacade(config)
+        basedir = tempfile.mkdtemp(prefix="jurt-test-")
+        try:
+            simulated = {}
+            for name in ("first", "second"):
+                simulated[name] = SimulatedTarget(os.path.join(basedir,
+                    name))
+                facade.targets[name] = simulated[name].target(name)
+            paths = simulated["first"].create_sources(2)
+            outcomes = facade.build_targets(paths, ["second", "first"],
+                    "multi")
+            self.assertEquals([name for name, _, _ in outcomes],
+                    ["second", "first"])
+            for name, results, error in outcomes:
+                self.assertEquals(error, None)
+                self.assertEquals(len(results), 2)
+                self.assertTrue(all(result.success for result in results))
+                delivery = simulated[name].dirs["delivery"]
+                self.assertTrue(os.path.isdir(os.path.join(delivery,
+                    "multi-" + name)))
+        finally:
+            shutil.rmtree(basedir, ignore_errors=True)
+
+    def test_build_targets_interrupted(self):
+        import thread
+        import threading
+        config, _ = self.sample_config()
+        facade = JurtFacade(config)
+        basedir = tempfile.mkdtemp(prefix="jurt-test-")
+        profile = {"build": {"sleep": 0.5}}
+        try:
+            simulated = {}
+            for name in ("first", "second"):
+                simulated[name] = SimulatedTarget(os.path.join(basedir,
+                    name), profile=profile)
+                facade.targets[name] = simulated[name].target(name)
+            paths = simulated["first"].create_sources(3)
+            threading.Timer(0.3, thread.interrupt_main).start()
+            self.assertRaises(KeyboardInterrupt, facade.build_targets,
+                    paths, ["second", "first"], "multi")
+            self.assertEquals(threading.active_count(), 1)
+            for name in ("first", "second"):
+                roots = simulated[name].dirs["roots"]
+                self.assertEquals(os.listdir(roots + "/active"), [])
+                self.assertTrue(len(os.listdir(os.path.join(simulated[name]
+                    .dirs["success"], "multi-" + name, "built"))) < 6)
+        finally:
+            shutil.rmtree(basedir, ignore_errors=True)
+
+    def _shared_targets(self, facade, basedir, options):
+        simulated = {}
+        for name in ("first", "second"):
+            simulated[name] = SimulatedTarget(os.path.join(basedir, name),
+                    options=options)
+            facade.targets[name] = simulated[name].target(name)
+            facade.targetsconf[name] = simulated[name].targetconf
+        return simulated
+
+    def _old_dirs(self, basedir, names):
+        past = time.time() - 3600
+        for name in names:
+            path = os.path.join(basedir, name)
+            os.makedirs(path)
+            os.utime(path, (past, past))
+
+    def test_shared_spools(self):
+        config, _ = self.sample_config()
+        facade = JurtFacade(config)
+        basedir = tempfile.mkdtemp(prefix="jurt-test-")
+        shared = os.path.join(basedir, "spools")
+        # always short of space, so that the builds clean up spools
+        options = {"spool-dir": shared, "spool-max-age": "0.01",
+                "auto-clean-free-space": str(2 ** 40)}
+        try:
+            simulated = self._shared_targets(facade, basedir, options)
+            # the spool of a root kept by the other target
+            os.makedirs(os.path.join(simulated["second"].dirs["roots"],
+                "keep", "busy"))
+            self._old_dirs(shared, ["busy", "stale"])
+            paths = simulated["first"].create_sources(1)
+            facade.build(paths, "first", "b1", fresh=True)
+            self.assertEquals(sorted(os.listdir(shared)), ["b1", "busy"])
+            self._old_dirs(shared, ["stale"])
+            removed = [info[0] for info in facade.clean_spools()]
+            self.assertEquals(removed, ["stale"])
+            self.assertEquals(sorted(os.listdir(shared)), ["b1", "busy"])
+        finally:
+            shutil.rmtree(basedir, ignore_errors=True)
+
+    def test_shared_logs(self):
+        config, _ = self.sample_config()
+        facade = JurtFacade(config)
+        basedir = tempfile.mkdtemp(prefix="jurt-test-")
+        shared = os.path.join(basedir, "logs")
+        options = {"logs-dir": shared, "logs-max-age": "0.01"}
+        try:
+            simulated = self._shared_targets(facade, basedir, options)
+            # each one keeps the logs of its roots
+            for name in ("first", "second"):
+                os.makedirs(os.path.join(simulated[name].dirs["roots"],
+                    "keep", "busy-" + name))
+            self._old_dirs(shared, ["busy-first", "busy-second", "stale"])
+            removed = [info[0] for info in facade.clean_logs()]
+            self.assertEquals(removed, ["stale"])
+            self.assertEquals(sorted(os.listdir(shared)),
+                    ["busy-first", "busy-second"])
+        finally:
+            shutil.rmtree(basedir, ignore_errors=True)
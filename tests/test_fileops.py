@@ -0,0 +1,89 @@
+import os
+import stat
+
+import tests
+
+from jurtlib import fileops
+
+class TestFileOps(tests.Test):
+
+    def _write(self, path, data="data"):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(data)
+        return path
+
+    def test_install_file(self):
+        source = self._write(os.path.join(self.spooldir, "src", "file"),
+                "x" * 100000)
+        destdir = os.path.join(self.spooldir, "dest")
+        os.mkdir(destdir)
+        dest, method, size = fileops.install_file(source, destdir,
+                mode="0640")
+        self.assertEquals(dest, os.path.join(destdir, "file"))
+        self.assertEquals(size, 100000)
+        self.assertEquals(open(dest).read(), "x" * 100000)
+        self.assertEquals(stat.S_IMODE(os.stat(dest).st_mode), 0640)
+        # replaces the existing file instead of writing through it
+        inode = os.stat(dest).st_ino
+        os.link(dest, dest + ".link")
+        fileops.install_file(source, dest)
+        self.assertEquals(stat.S_IMODE(os.stat(dest).st_mode), 0755)
+        self.assertEquals(os.stat(dest + ".link").st_ino, inode)
+
+    def test_install_dir(self):
+        path = os.path.join(self.spooldir, "a", "b", "c")
+        fileops.install_dir(path, mode="0700")
+        self.assertEquals(stat.S_IMODE(os.stat(path).st_mode), 0700)
+        parent = os.path.dirname(path)
+        self.assertEquals(stat.S_IMODE(os.stat(parent).st_mode), 0755)
+
+    def test_link_tree(self):
+        source = os.path.join(self.spooldir, "spool")
+        first = self._write(os.path.join(source, "a.rpm"))
+        self._write(os.path.join(source, "media_info", "hdlist"))
+        os.symlink("a.rpm", os.path.join(source, "link"))
+        dest = os.path.join(self.spooldir, "root-spool")
+        fileops.link_tree(source, dest)
+        self.assertEquals(os.stat(os.path.join(dest, "a.rpm")).st_ino,
+                os.stat(first).st_ino)
+        self.assertEquals(os.readlink(os.path.join(dest, "link")), "a.rpm")
+        self.assertTrue(os.path.exists(os.path.join(dest, "media_info",
+            "hdlist")))
+        # dest exists: cp -a puts the copy inside it, unless src/. is used
+        fileops.link_tree(source, dest)
+        self.assertTrue(os.path.isdir(os.path.join(dest, "spool")))
+        self._write(os.path.join(source, "b.rpm"))
+        fileops.link_tree(os.path.join(source, "."), dest)
+        self.assertTrue(os.path.exists(os.path.join(dest, "b.rpm")))
+
+    def test_copy_file(self):
+        source = self._write(os.path.join(self.spooldir, "pkg.rpm"),
+                "y" * 4096)
+        os.chmod(source, 0604)
+        dest = os.path.join(self.spooldir, "linked.rpm")
+        self.assertEquals(fileops.copy_file(source, dest), ("link", 0))
+        self.assertEquals(os.stat(dest).st_ino, os.stat(source).st_ino)
+        method, size = fileops.copy_file(source, dest, link=False)
+        self.assertTrue(method in [name for name, _ in
+            fileops.COPY_METHODS])
+        self.assertEquals(size, 4096)
+        self.assertNotEquals(os.stat(dest).st_ino, os.stat(source).st_ino)
+        self.assertEquals(open(dest).read(), "y" * 4096)
+        self.assertEquals(stat.S_IMODE(os.stat(dest).st_mode), 0604)
+
+    def test_copy_methods(self):
+        source = self._write(os.path.join(self.spooldir, "big"),
+                "z" * 300000)
+        for name, method in fileops.COPY_METHODS:
+            dest = os.path.join(self.spooldir, "copy-" + name)
+            srcfd = os.open(source, os.O_RDONLY)
+            dstfd = os.open(dest, os.O_WRONLY | os.O_CREAT, 0600)
+            try:
+                done = method(srcfd, dstfd, 300000)
+            finally:
+                os.close(srcfd)
+                os.close(dstfd)
+            if done:
+                self.assertEquals(open(dest).read(), "z" * 300000, name)
@@ -0,0 +1,45 @@
+import os
+
+import tests
+
+from jurtlib.history import (BuildHistory, BuildStats, NullHistory,
+        get_build_history, package_name)
+
+class TestHistory(tests.Test):
+
+    def setUp(self):
+        super(TestHistory, self).setUp()
+        self.history = BuildHistory(os.path.join(self.spooldir,
+            "history.sqlite"))
+
+    def tearDown(self):
+        self.history.close()
+        super(TestHistory, self).tearDown()
+
+    def _record(self, sourceid, duration, success=True, target="t"):
+        stats = BuildStats(sourceid)
+        stats.add_phase("build", duration)
+        stats.finish(success)
+        stats.finished = stats.started + duration
+        stats.diskusage = 1000
+        stats.maxrss = 2000
+        self.history.record(target, "id", stats)
+
+    def test_package_name(self):
+        self.assertEquals(package_name("foo-bar-1.0-2mdv"), "foo-bar")
+        self.assertEquals(package_name("weird"), "weird")
+
+    def test_estimate(self):
+        self.assertEquals(self.history.estimate("t", "foo"), None)
+        self._record("foo-1.0-1", 10)
+        self._record("foo-1.1-1", 20)
+        self._record("foo-1.2-1", 500, success=False)
+        self._record("foo-1.0-1", 1000, target="other")
+        self.assertEquals(self.history.estimate("t", "foo"), 15)
+        self.assertEquals(self.history.usage("t", "foo"), (1000, 2000))
+
+    def test_disabled(self):
+        history = get_build_history("")
+        self.assertTrue(isinstance(history, NullHistory))
+        self.assertFalse(history.enabled)
+        self.assertEquals(history.estimate("t", "foo"), None)
@@ -116,3 +116,61 @@ class TestLoggerFactory(tests.Test):
         self.assertEquals(logs[1][5][0], "pkg-c")
         self.assertEquals(logs[1][5][1], abspath(join(self.spooldir, logid,
             "pkg-c", "handler-1.log")))
+
+    def test_max_size(self):
+        logger = self._sample_logger("some-id")
+        logger.maxlogsize = 1000
+        handler = logger.get_output_handler("handler-name")
+        for i in xrange(1000):
+            handler.write("line %04d\n" % (i))
+        handler.close()
+        contents = open(handler.location()).read()
+        lines = contents.splitlines()
+        self.assertTrue(lines[0].startswith("==== started log at "))
+        self.assertEquals(lines[1], "line 0000")
+        self.assertTrue(lines[-1].startswith("==== closing log at "))
+        self.assertEquals(lines[-2], "line 0999")
+        self.assertTrue("bytes omitted" in contents)
+        self.assertTrue(len(contents) < 1100)
+
+    def test_max_size_single_write(self):
+        logger = self._sample_logger("some-id")
+        logger.maxlogsize = 1000
+        handler = logger.get_output_handler("handler-name")
+        handler.write("x" * 100000 + "last\n")
+        self.assertTrue(sum(len(chunk) for chunk in handler.tail.chunks)
+                <= 500)
+        handler.write("y" * 10)
+        self.assertEquals(handler.tail.size, 500)
+        self.assertTrue(handler.tail.getvalue().endswith("last\n" + "y" * 10))
+        handler.close()
+        contents = open(handler.location()).read()
+        self.assertTrue("bytes omitted" in contents)
+        self.assertTrue(len(contents) < 1100)
+
+    def test_collect(self):
+        import os
+        import time
+        config, targets = self.sample_config()
+        target = targets[0][1]
+        target.logs_dir = self.spooldir
+        target.logs_max_age = "1"
+        target.logs_max_total_size = "1"
+        fac = LoggerFactory(target, config)
+        now = time.time()
+        for logid, age, size in (("old", 2, 10), ("big", 0.5, 1024 * 1024),
+                ("inuse", 3, 10), ("new", 0, 10)):
+            logger = fac.get_logger(logid)
+            handler = logger.get_output_handler("build")
+            handler.write("x" * size)
+            handler.close()
+            mtime = now - age * 24 * 60 * 60
+            os.utime(handler.location(), (mtime, mtime))
+            os.utime(logger.path, (mtime, mtime))
+        removed = [name for name, mtime, size in fac.collect(set(["inuse"]),
+            dry_run=True)]
+        self.assertEquals(removed, ["old", "big"])
+        self.assertEquals([info[0] for info in fac.collect(set(["inuse"]))],
+                removed)
+        self.assertEquals(sorted(os.listdir(self.spooldir)), ["inuse",
+            "new"])
@@ -0,0 +1,46 @@
+import os
+
+import tests
+
+from jurtlib.mount import (MountTable, parse_mountinfo, parse_options,
+        unescape, MS_NOSUID, MS_NODEV)
+
+SAMPLE = r"""23 28 0:22 / /proc rw,relatime - proc proc rw
+36 28 0:31 / /var/roots/active/a\040b/proc rw,relatime - proc jurt-proc rw
+37 28 0:32 / /var/roots/active/a\040b/dev/pts rw shared:5 - devpts jurt-pts rw
+38 28 0:33 / /var/roots/active/other/proc rw - proc jurt-proc rw
+39 37 0:34 / /var/roots/active/a\040b/dev/pts/x rw - tmpfs t\134x rw
+"""
+
+class TestMount(tests.Test):
+
+    def test_unescape(self):
+        self.assertEquals(unescape(r"a\040b\011c\012d\134e"),
+                "a b\tc\nd\\e")
+
+    def test_parse_mountinfo(self):
+        entries = list(parse_mountinfo(SAMPLE.splitlines()))
+        self.assertEquals(len(entries), 5)
+        self.assertEquals(entries[1].mountpoint,
+                "/var/roots/active/a b/proc")
+        self.assertEquals(entries[2].fstype, "devpts")
+        self.assertEquals(entries[2].source, "jurt-pts")
+        self.assertEquals(entries[4].source, "t\\x")
+
+    def test_parse_options(self):
+        self.assertEquals(parse_options("defaults"), (0, ""))
+        self.assertEquals(parse_options("nosuid,nodev,mode=0620,gid=5"),
+                (MS_NOSUID | MS_NODEV, "mode=0620,gid=5"))
+
+    def test_below(self):
+        path = os.path.join(self.spooldir, "mountinfo")
+        with open(path, "w") as f:
+            f.write(SAMPLE)
+        table = MountTable(path)
+        table.refresh()
+        self.assertEquals(table.below("/var/roots/active/a b"),
+                ["/var/roots/active/a b/dev/pts/x",
+                 "/var/roots/active/a b/dev/pts",
+                 "/var/roots/active/a b/proc"])
+        self.assertTrue(table.is_mounted("/var/roots/active/other/proc/"))
+        self.assertFalse(table.is_mounted("/var/roots/active/other"))
@@ -0,0 +1,24 @@
+import os
+import subprocess
+
+import tests
+
+from jurtlib import personality
+
+class TestPersonality(tests.Test):
+
+    def test_personality_value(self):
+        self.assertEquals(personality.personality_value("linux32"), 0x0008)
+        self.assertRaises(personality.PersonalityError,
+                personality.personality_value, "amiga")
+
+    def test_set_personality_in_child(self):
+        if os.uname()[4] != "x86_64" or not personality.available():
+            return
+        value = personality.personality_value("linux32")
+        proc = subprocess.Popen(["uname", "-m"], stdout=subprocess.PIPE,
+                preexec_fn=lambda: personality.set_personality(value))
+        output = proc.communicate()[0]
+        self.assertEquals(output.strip(), "i686")
+        # the parent is left untouched
+        self.assertEquals(os.uname()[4], "x86_64")
@@ -1,9 +1,273 @@
+import os
+import shutil
+import threading
+import time
 import tests
 
-from jurtlib.root import Root, RootManager
+from jurtlib import util
+from jurtlib.root import (Root, RootManager, ChrootRootManager,
+        TmpfsChrootManager, Active, Old, Keep, Temp)
+
+from jurtlib.rootindex import RootIndex
+
+from tests.fakes import (LocalSuWrapper, FakePackageManager, root_config,
+        create_state_dirs)
 
 class TestRootABC(tests.Test):
 
     def test_instantiate_abc(self):
         self.assertRaises(TypeError, Root)
         self.assertRaises(TypeError, RootManager)
+
+class TestChrootLifecycle(tests.Test):
+
+    def setUp(self):
+        super(TestChrootLifecycle, self).setUp()
+        self.rootspath = os.path.join(self.spooldir, "roots")
+        create_state_dirs(self.rootspath)
+        config, rootconf = root_config(self.rootspath, "chroot",
+                extra={"root-max-age": "0",
+                       "root-copy-files": "/etc/hosts"})
+        self.su = LocalSuWrapper()
+        self.manager = ChrootRootManager(self.su, rootconf, config)
+        self.su.rootmanager = self.manager
+        self.pm = FakePackageManager(nfiles=10, filesize=16)
+
+    def _state_path(self, statename, name):
+        return os.path.join(self.rootspath, statename, name)
+
+    def test_create_activate_deactivate(self):
+        root = self.manager.create_new("first", self.pm, None, None)
+        self.assertEquals(root.state, Temp)
+        self.assertTrue(os.path.isdir(self._state_path("temp", "first")))
+        self.assertTrue(os.path.exists(os.path.join(root.path,
+            "jurt-target")))
+        root.activate()
+        self.assertEquals(root.state, Active)
+        self.assertEquals(root.path, self._state_path("active", "first"))
+        root.deactivate()
+        self.assertEquals(root.state, Old)
+        self.assertEquals(root.path, self._state_path("old", "first"))
+        names = [(name, state) for name, _, state, _
+                in self.manager.list_roots()]
+        self.assertEquals(names, [("first", "old")])
+        root.destroy()
+        self.assertFalse(os.path.exists(root.path))
+
+    def test_arch_personality(self):
+        self.assertEquals(self.manager.arch_personality("x86_64", "i586"),
+                0x0008)
+        self.assertEquals(self.manager.arch_personality("x86_64", "armv7l"),
+                None)
+
+    def test_find(self):
+        root = self.manager.create_new("first", self.pm, None, None)
+        home = os.path.join(root.path, "home/user")
+        for subpath, size in (("RPMS/x86_64/foo-1-1.x86_64.rpm", 3),
+                ("RPMS/noarch/foo-doc-1-1.noarch.rpm", 5),
+                ("RPMS/noarch/.hidden.rpm", 1),
+                ("SRPMS/foo-1-1.src.rpm", 7),
+                ("SRPMS/notes.txt", 2)):
+            path = os.path.join(home, subpath)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(path, "w") as f:
+                f.write("x" * size)
+        found = root.find(["/home/user/RPMS/*/*.rpm",
+            "/home/user/SRPMS/*.src.rpm", "/home/user/missing/*"])
+        self.assertEquals([(os.path.basename(path), size)
+            for path, size, mtime in found],
+            [("foo-doc-1-1.noarch.rpm", 5), ("foo-1-1.x86_64.rpm", 3),
+                ("foo-1-1.src.rpm", 7)])
+        self.assertEquals(root.glob("/home/user/SRPMS/*"),
+                [path for path, _, _ in root.find(["/home/user/SRPMS/*"])])
+        self.assertEquals(len(root.glob("/home/user/SRPMS/*")), 2)
+
+    def test_root_index(self):
+        for name in ("a", "b"):
+            root = self.manager.create_new(name, self.pm, None, None)
+            root.activate()
+        root.deactivate()
+        expected = [("a", "active"), ("b", "old")]
+        listed = [(name, state) for name, _, state, _
+                in self.manager.list_roots()]
+        self.assertEquals(listed, expected)
+        self.assertEquals(self.manager._existing_root("b"),
+                (Old, self._state_path("old", "b")))
+        # a root missing from the index keeps its age when found
+        self.manager.index.remove("b")
+        time.sleep(0.1)
+        self.manager._existing_root("b")
+        self.assertAlmostEquals(self.manager.index.lookup("b")[2],
+                os.stat(self._state_path("old", "b")).st_ctime, places=2)
+        # the journal is rebuilt from the state directories
+        os.unlink(self.manager.index.path)
+        self.manager.index = RootIndex(self.manager.index.path)
+        listed = [(name, state) for name, _, state, _
+                in self.manager.list_roots()]
+        self.assertEquals(listed, expected)
+
+    def test_keep_and_clean(self):
+        for name in ("a", "b", "c"):
+            root = self.manager.create_new(name, self.pm, None, None)
+            root.activate()
+            root.deactivate()
+        self.manager.keep("a", self.pm)
+        self.assertTrue(os.path.isdir(self._state_path("keep", "a")))
+        # "c" is pointed by the -latest link and must survive
+        cleaned = [name for name, _ in self.manager.clean()]
+        self.assertEquals(cleaned, ["b"])
+        self.assertFalse(os.path.exists(self._state_path("old", "b")))
+        self.assertTrue(os.path.exists(self._state_path("old", "c")))
+        self.assertTrue(os.path.exists(self._state_path("keep", "a")))
+
+    def test_clean_with_stale_index(self):
+        for name in ("a", "b", "c"):
+            root = self.manager.create_new(name, self.pm, None, None)
+            root.activate()
+            root.deactivate()
+        # removed behind the back of the index
+        shutil.rmtree(self._state_path("old", "a"))
+        cleaned = [name for name, _ in self.manager.clean()]
+        self.assertEquals(cleaned, ["a", "b"])
+        self.assertFalse(os.path.exists(self._state_path("old", "b")))
+
+    def test_clean_to_target_free(self):
+        self.manager.maxrootage = 10 ** 9
+        roots = {}
+        for name in ("a", "b", "c", "d"):
+            root = self.manager.create_new(name, self.pm, None, None)
+            root.activate()
+            root.deactivate()
+            roots[name] = root
+        self.manager.note_root_size(roots["a"], 100)
+        self.manager.note_root_size(roots["b"], 200)
+        freespace = util.free_space
+        self.addCleanup(setattr, util, "free_space", freespace)
+        util.free_space = lambda path: 1000
+        self.assertEquals(list(self.manager.clean(targetfree=1000)), [])
+        # "a" is the least recently used, "d" is the latest
+        cleaned = [name for name, _ in self.manager.clean(dry_run=True,
+            targetfree=1050)]
+        self.assertEquals(cleaned, ["a"])
+        cleaned = [name for name, _ in self.manager.clean(targetfree=1250)]
+        self.assertEquals(cleaned, ["a", "b"])
+        self.assertTrue(os.path.exists(self._state_path("old", "c")))
+
+    def test_clean_empties_trash(self):
+        for name in ("a", "b"):
+            root = self.manager.create_new(name, self.pm, None, None)
+            root.activate()
+            root.deactivate()
+        # left behind by an interrupted jurt-clean
+        leftover = self._state_path("trash", "z.1234")
+        os.makedirs(leftover)
+        cleaned = [name for name, _ in self.manager.clean()]
+        self.assertEquals(cleaned, ["a"])
+        self.assertEquals(os.listdir(self._state_path("trash", "")), [])
+        batches = [call[1] for call in self.su.calls
+                if call[0] == "destroyroots"]
+        self.assertEquals(len(batches), 1)
+        self.assertEquals(len(batches[0]), 2)
+
+    def test_destroy_in_background(self):
+        root = self.manager.create_new("bg", self.pm, None, None)
+        root.activate()
+        root.deactivate()
+        root.destroy(background=True)
+        self.assertFalse(os.path.exists(self._state_path("old", "bg")))
+        self.manager.wait_destroyed()
+        self.assertEquals(os.listdir(self._state_path("trash", "")), [])
+        self.assertTrue(("stop",) in self.su.calls)
+
+    def test_clean_while_destroying_in_background(self):
+        root = self.manager.create_new("bg", self.pm, None, None)
+        root.activate()
+        root.deactivate()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        blocked = self.su.sibling()
+        destroy_roots = blocked.destroy_roots
+        def wait_and_destroy(paths):
+            release.wait(10)
+            destroy_roots(paths)
+        blocked.destroy_roots = wait_and_destroy
+        self.su.sibling = lambda: blocked
+        root.destroy(background=True)
+        del self.su.sibling
+        trashed = os.listdir(self._state_path("trash", ""))
+        self.assertEquals(len(trashed), 1)
+        # the reaper still holds it, the sibling must leave it alone
+        other = self.manager.sibling()
+        self.assertEquals(list(other.clean()), [])
+        self.assertEquals(os.listdir(self._state_path("trash", "")),
+                trashed)
+        self.assertFalse([call for call in self.su.calls
+            if call[0] == "destroyroots"])
+        release.set()
+        self.manager.wait_destroyed()
+        self.assertEquals(os.listdir(self._state_path("trash", "")), [])
+
+class TestTmpfsSizing(tests.Test):
+
+    def setUp(self):
+        super(TestTmpfsSizing, self).setUp()
+        self.rootspath = os.path.join(self.spooldir, "roots")
+        create_state_dirs(self.rootspath)
+        config, rootconf = root_config(self.rootspath, "chroot-with-tmpfs",
+                extra={"tmpfs-package-space": "1",
+                       "tmpfs-min-free-memory": "1"})
+        self.su = LocalSuWrapper()
+        self.manager = TmpfsChrootManager(self.su, rootconf, config)
+        self.su.rootmanager = self.manager
+        # mounting is only recorded, the root is unpacked in the directory
+        self.su.mount_tmpfs = lambda root, size=None: self.su.record(
+                "mounttmpfs", root, size)
+        self.su.umount_tmpfs = lambda root: self.su.record("umounttmpfs",
+                root)
+        self.pm = FakePackageManager(nfiles=10, filesize=4096)
+        self.memory = None
+        self._memory_available = util.memory_available
+        util.memory_available = lambda: self.memory
+
+    def tearDown(self):
+        util.memory_available = self._memory_available
+        super(TestTmpfsSizing, self).tearDown()
+
+    def _mounts(self):
+        return [call for call in self.su.calls if call[0] == "mounttmpfs"]
+
+    def test_first_root_is_built_on_disk(self):
+        root = self.manager.create_new("first", self.pm, None, None)
+        self.assertFalse(root.tmpfs)
+        self.assertEquals(root.state, Temp)
+        self.assertEquals(self._mounts(), [])
+        sizepath = self.manager._cache_path(False) + ".size"
+        with open(sizepath) as f:
+            self.assertTrue(int(f.read()) >= 10 * 4096)
+        self.assertTrue(("diskusage", root.path) in self.su.calls)
+
+    def test_tmpfs_sized_from_cached_root(self):
+        self.manager.create_new("first", self.pm, None, None)
+        rootsize = self.manager._cached_root_size(
+                self.manager._cache_path(False))
+        self.memory = 1024 ** 3
+        root = self.manager.create_new("second", self.pm, None, None)
+        self.assertTrue(root.tmpfs)
+        self.assertEquals(self._mounts(), [("mounttmpfs", root.path,
+            rootsize + 1024 * 1024)])
+        root.activate()
+        self.assertEquals(root.path, os.path.join(self.rootspath, "active",
+            "second"))
+        root.deactivate()
+        self.assertEquals(root.state, Old)
+        self.assertFalse(os.path.exists(root.path))
+
+    def test_spill_to_disk_when_memory_is_short(self):
+        self.manager.create_new("first", self.pm, None, None)
+        self.memory = 1024 * 1024
+        root = self.manager.create_new("second", self.pm, None, None)
+        self.assertFalse(root.tmpfs)
+        self.assertEquals(self._mounts(), [])
+        self.assertTrue(os.path.exists(os.path.join(root.path,
+            "jurt-target")))
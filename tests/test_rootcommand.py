@@ -0,0 +1,34 @@
+import os
+import optparse
+import subprocess
+
+import tests
+
+from jurtlib import CommandError
+from jurtlib.rootcommand import RootCommand
+
+class TestExecParallel(tests.Test):
+
+    def _command(self):
+        command = RootCommand.__new__(RootCommand)
+        command.opts = optparse.Values({"quiet": True, "dry_run": False,
+            "ignore_errors": False})
+        return command
+
+    def test_killed_command_fails(self):
+        command = self._command()
+        try:
+            command._exec_parallel([["true"], ["sh", "-c", "kill -9 $$"]],
+                    2)
+        except CommandError, e:
+            self.assertEquals(e.returncode, -9)
+        else:
+            self.fail("a killed command should fail")
+
+    def test_other_children_not_reaped(self):
+        command = self._command()
+        other = subprocess.Popen(["sleep", "0.3"])
+        command._exec_parallel([["true"]] * 4, 2)
+        pid, status = os.waitpid(other.pid, 0)
+        self.assertEquals(pid, other.pid)
+        self.assertEquals(status, 0)
@@ -0,0 +1,92 @@
+import os
+import fcntl
+import threading
+
+import tests
+
+from jurtlib import rootindex
+from jurtlib.rootindex import RootIndex
+
+class TestRootIndex(tests.Test):
+
+    def setUp(self):
+        super(TestRootIndex, self).setUp()
+        self.path = os.path.join(self.spooldir, "index", "roots.journal")
+
+    def test_rebuild_and_replay(self):
+        scanned = [("a", "old", "build", 10.0, None),
+                ("b", "active", "interactive", 20.0, 300)]
+        index = RootIndex(self.path)
+        index.load(lambda: scanned)
+        self.assertEquals(index.roots(), scanned)
+        index.set("a", "keep", "build")
+        index.remove("b")
+        # another process sees the changes appended to the journal
+        other = RootIndex(self.path)
+        other.load(lambda: self.fail("should not scan"))
+        self.assertEquals([(name, state) for name, state, _, _, _
+            in other.roots()], [("a", "keep")])
+        index.set("c", "active", "build")
+        other.load(None)
+        self.assertEquals(other.lookup("c")[:2], ("active", "build"))
+        self.assertEquals(other.lookup("b"), None)
+
+    def test_sizes(self):
+        index = RootIndex(self.path)
+        index.load(lambda: [])
+        index.set("a", "active", "build")
+        index.set_size("a", 1234)
+        # moving the root keeps its size
+        index.set("a", "old", "build")
+        index.set_size("missing", 10)
+        other = RootIndex(self.path)
+        other.load(None)
+        self.assertEquals([(name, state, size) for name, state, _, _, size
+            in other.roots()], [("a", "old", 1234)])
+
+    def test_compaction(self):
+        self.patch_compact_min(10)
+        index = RootIndex(self.path)
+        index.load(lambda: [])
+        other = RootIndex(self.path)
+        other.load(None)
+        for i in xrange(50):
+            index.set("a", ("active", "old")[i % 2], "build")
+        index.set("b", "old", "build")
+        with open(self.path) as f:
+            self.assertTrue(len(f.readlines()) < 20)
+        other.load(None)
+        self.assertEquals([(name, state) for name, state, _, _, _
+            in other.roots()], [("a", "old"), ("b", "old")])
+
+    def test_changes_need_a_journal(self):
+        index = RootIndex(self.path)
+        index.set("a", "active", "build")
+        self.assertFalse(os.path.exists(self.path))
+        index.load(lambda: [("a", "active", "build", 10.0, None)])
+        self.assertEquals(index.lookup("a")[:2], ("active", "build"))
+
+    def test_rebuild_locked(self):
+        index = RootIndex(self.path)
+        index.load(lambda: [])
+        os.unlink(self.path)
+        lock = open(self.path + ".lock", "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        rebuilder = threading.Thread(target=index.rebuild,
+                args=(lambda: [("a", "old", "build", 10.0, None)],))
+        rebuilder.start()
+        rebuilder.join(0.2)
+        self.assertTrue(rebuilder.is_alive())
+        self.assertFalse(os.path.exists(self.path))
+        lock.close()
+        rebuilder.join()
+        other = RootIndex(self.path)
+        other.load(lambda: self.fail("should not scan"))
+        self.assertEquals(other.lookup("a")[:2], ("old", "build"))
+        # not rebuilt again when someone else already did it
+        index.rebuild(lambda: self.fail("should not scan"))
+
+    def patch_compact_min(self, value):
+        old = rootindex.COMPACT_MIN
+        rootindex.COMPACT_MIN = value
+        self.addCleanup(setattr, rootindex, "COMPACT_MIN", old)
@@ -0,0 +1,34 @@
+import tests
+
+from jurtlib.schedule import Job, longest_first, makespan, provided_by
+
+class TestSchedule(tests.Test):
+
+    def _jobs(self, specs):
+        return [Job(i, name + ".src.rpm", name + "-1-1", name, requires,
+            duration) for i, (name, requires, duration)
+                in enumerate(specs)]
+
+    def test_provided_by(self):
+        self.assertTrue(provided_by("foo", "foo"))
+        self.assertTrue(provided_by("foo-devel", "foo"))
+        self.assertTrue(provided_by("libfoo-devel", "foo"))
+        self.assertTrue(provided_by("lib64foo-devel", "foo"))
+        self.assertTrue(provided_by("pkgconfig(foo)", "foo"))
+        self.assertTrue(provided_by("perl(Foo::Bar)", "perl-Foo"))
+        self.assertFalse(provided_by("foobar-devel", "foo"))
+        self.assertFalse(provided_by("rpmlib(CompressedFileNames)", "foo"))
+
+    def test_longest_first(self):
+        jobs = self._jobs([("small", [], 10.0), ("unknown", [], None),
+            ("kernel", [], 300.0), ("medium", [], 50.0)])
+        ordered = [job.name for job in longest_first(jobs)]
+        # unknown ones are assumed to take the average of the known ones
+        self.assertEquals(ordered, ["kernel", "unknown", "medium", "small"])
+        self.assertEquals(makespan(jobs), 480.0)
+
+    def test_dependencies_are_kept(self):
+        jobs = self._jobs([("foo", [], 10.0), ("bar", ["libfoo-devel"],
+            100.0), ("big", [], 50.0), ("baz", ["bar"], 500.0)])
+        ordered = [job.name for job in longest_first(jobs)]
+        self.assertEquals(ordered, ["big", "foo", "bar", "baz"])
@@ -0,0 +1,51 @@
+import os
+
+import tests
+
+from jurtlib import util
+from jurtlib.space import SpaceWatcher, existing_parent
+
+class TestSpaceWatcher(tests.Test):
+
+    def setUp(self):
+        super(TestSpaceWatcher, self).setUp()
+        self.free = {"value": 100}
+        freespace = util.free_space
+        self.addCleanup(setattr, util, "free_space", freespace)
+        util.free_space = lambda path: self.free["value"]
+
+    def test_existing_parent(self):
+        path = os.path.join(self.spooldir, "not", "there")
+        self.assertEquals(existing_parent(path),
+                os.path.dirname(os.path.dirname(path)))
+
+    def test_cleaners_run_in_order(self):
+        called = []
+        def first(targetfree):
+            called.append(("first", targetfree))
+            self.free["value"] += 500
+        def second(targetfree):
+            called.append(("second", targetfree))
+            self.free["value"] += 500
+        watcher = SpaceWatcher([self.spooldir], 1000, 60)
+        watcher.add_cleaner("first", self.spooldir, first)
+        watcher.add_cleaner("second", self.spooldir, second)
+        watcher.check()
+        self.assertEquals(called, [("first", 1000), ("second", 1000)])
+        # enough space now, nothing else is removed
+        watcher.check()
+        self.assertEquals(len(called), 2)
+
+    def test_failing_cleaner(self):
+        called = []
+        def failing(targetfree):
+            called.append("failing")
+            raise EnvironmentError("oops")
+        def other(targetfree):
+            called.append("other")
+            self.free["value"] = 2000
+        watcher = SpaceWatcher([self.spooldir], 1000, 60)
+        watcher.add_cleaner("failing", self.spooldir, failing)
+        watcher.add_cleaner("other", self.spooldir, other)
+        watcher.check()
+        self.assertEquals(called, ["failing", "other"])
@@ -0,0 +1,44 @@
+import os
+import time
+
+import tests
+
+from jurtlib.spool import collect_spools, spool_usage
+
+class TestSpoolCollection(tests.Test):
+
+    def setUp(self):
+        super(TestSpoolCollection, self).setUp()
+        self.spools = os.path.join(self.spooldir, "spools")
+        self.success = os.path.join(self.spooldir, "success")
+        os.makedirs(self.success)
+        old = time.time() - 10 * 24 * 60 * 60
+        for name, mtime in (("old", old), ("kept", old), ("new", None)):
+            path = os.path.join(self.spools, name)
+            os.makedirs(path)
+            with open(os.path.join(path, "hdlist.cz"), "w") as f:
+                f.write("x" * 8192)
+            built = os.path.join(self.success, name + ".rpm")
+            with open(built, "w") as f:
+                f.write("x" * 8192)
+            os.link(built, os.path.join(path, name + ".rpm"))
+            if mtime is not None:
+                os.utime(path, (mtime, mtime))
+
+    def test_usage_ignores_hardlinked_files(self):
+        size, inodes = spool_usage(os.path.join(self.spools, "old"))
+        self.assertEquals(inodes, 2)
+        self.assertTrue(8192 <= size < 16384)
+
+    def test_collect(self):
+        dryrun = list(collect_spools(self.spools, 7 * 24 * 60 * 60,
+            set(["kept"]), 2, dry_run=True))
+        self.assertEquals([info[0] for info in dryrun], ["old"])
+        self.assertTrue(os.path.exists(os.path.join(self.spools, "old")))
+        removed = list(collect_spools(self.spools, 7 * 24 * 60 * 60,
+            set(["kept"]), 2))
+        self.assertEquals(removed, dryrun)
+        self.assertEquals(sorted(os.listdir(self.spools)), ["kept", "new"])
+        # the built package is still in the success directory
+        self.assertTrue(os.path.exists(os.path.join(self.success,
+            "old.rpm")))
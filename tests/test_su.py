@@ -2,9 +2,43 @@ import tests
 import subprocess
 from os.path import join
 
-from jurtlib import SetupError
+from jurtlib import SetupError, CommandError
 from jurtlib.config import JurtConfig
-from jurtlib.su import JurtRootWrapper, AgentError, SudoNotSetup
+from jurtlib.su import (JurtRootWrapper, AgentError, SudoNotSetup,
+        LineOutput, ERROR_OUTPUT_SIZE, MAX_LINE_SIZE)
+
+class TestLineOutput(tests.Test):
+
+    def test_line_ends(self):
+        lines = []
+        output = LineOutput(lines.append)
+        for data in ("a\nb", "\r\nc\r", "\nd\re", "", "\n\nf"):
+            output.write(data)
+        output.finish()
+        self.assertEquals(lines, ["a", "b", "c", "d", "e", "", "f"])
+
+    def test_long_line(self):
+        lines = []
+        output = LineOutput(lines.append)
+        for i in xrange(MAX_LINE_SIZE // 10 * 3):
+            output.write("x" * 10)
+            self.assertTrue(output.partialsize < MAX_LINE_SIZE)
+        output.write("\n")
+        output.finish()
+        self.assertEquals(len(lines), 3)
+        self.assertEquals(sum(len(line) for line in lines),
+                MAX_LINE_SIZE // 10 * 30)
+        self.assertTrue(len(output.getvalue()) < ERROR_OUTPUT_SIZE + 100)
+
+    def test_line_cut_at_its_end(self):
+        for end in ("\n", "\r\n", "\r"):
+            lines = []
+            output = LineOutput(lines.append)
+            output.write("x" * MAX_LINE_SIZE)
+            output.write(end + "abc\n\n")
+            output.finish()
+            self.assertEquals([len(line) for line in lines],
+                    [MAX_LINE_SIZE, 3, 0])
 
 class TestJurtRootWrapper(tests.Test):
 
@@ -104,6 +138,9 @@ class TestJurtRootWrapper(tests.Test):
         su.mount_tmpfs("/my/root/path")
         self._expect("--type mounttmpfs --target first "
                 "/my/root/path")
+        su.mount_tmpfs("/my/root/path", 1048576)
+        self._expect("--type mounttmpfs --target first "
+                "/my/root/path 1048576")
         su.umount_tmpfs("/my/root/path")
         self._expect("--type umounttmpfs --target first "
                 "/my/root/path")
@@ -146,3 +183,38 @@ class TestJurtRootWrapper(tests.Test):
         suconf.sudo_command = "missing"
         su = JurtRootWrapper("first", suconf, config)
         self.assertRaises(SetupError, su.test_sudo)
+
+    def _get_simulated_wrapper(self):
+        profile = join(self.spooldir, "profile.json")
+        with open(profile, "w") as f:
+            f.write("{}")
+        config, sections = self.sample_config()
+        suconf = sections[0][1]
+        suconf.sudo_command = "%s --simulate %s" % (join(self.rootdir,
+            "fake_su_wrapper.py"), profile)
+        return JurtRootWrapper("first", suconf, config)
+
+    def test_output_lines(self):
+        su = self._get_simulated_wrapper()
+        lines = []
+        output = su.run_as(["fake-output", "3"], "someuser",
+                root=self.spooldir, quiet=True, linehandler=lines.append)
+        self.assertEquals(output, None)
+        self.assertEquals(lines, ["line 0", "line 1", "line 2"])
+        output = su.run_as(["fake-output", "2"], "someuser",
+                root=self.spooldir, quiet=True)
+        self.assertEquals(output.splitlines(), ["line 0", "line 1"])
+
+    def test_error_output_bounded(self):
+        su = self._get_simulated_wrapper()
+        for linehandler in (None, lambda line: None):
+            try:
+                su.run_as(["fake-output", "100000", "fail"], "someuser",
+                        root=self.spooldir, quiet=True,
+                        linehandler=linehandler)
+            except CommandError, e:
+                self.assertTrue(len(e.output) < ERROR_OUTPUT_SIZE + 100)
+                self.assertTrue("line 99999" in e.output)
+                self.assertTrue("bytes omitted" in e.output)
+            else:
+                self.fail("the command should fail")